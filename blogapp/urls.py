@@ -1,4 +1,5 @@
 from django.urls import path, include
+from mysite.replica import replica_reads
 from .views import ArticlesListView, RSSArticlesListView, RSSArticlesDetailView, LatestArticlesFeed
 
 
@@ -8,5 +9,5 @@ urlpatterns = [
     path("list/", ArticlesListView.as_view(), name="article_list"),
     path("articles/", RSSArticlesListView.as_view(), name="articles"),
     path("articles/<int:pk>/", RSSArticlesDetailView.as_view(), name="article"),
-    path("articles/latest/feed/", LatestArticlesFeed(), name="articles-feed")
+    path("articles/latest/feed/", replica_reads(LatestArticlesFeed()), name="articles-feed")
     ]
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""
+Чтение тяжёлых страниц с реплики.
+
+Экспорт, ленты, карта сайта и список товаров API только читают, но
+делят единственную базу default с записью заказов. Представления,
+отмеченные replica_reads (в API -- ReplicaReadMixin), читают через
+псевдоним replica; остальные представления и любая запись идут в default.
+
+Даже в отмеченном представлении чтение остаётся на основной базе, если:
+
+- в этом запросе уже была запись -- запрос читает то, что сам записал;
+- клиент недавно писал: ReplicaMiddleware после запроса с записью ставит
+  куку, и REPLICA_STICKY_SECONDS клиент читает только с основной базы;
+  окно не короче REPLICA_MAX_LAG, иначе клиент успел бы прочитать
+  реплику без своей записи;
+- реплика отстала: после последней синхронизации были записи и с неё
+  прошло больше max_lag секунд (REPLICA_MAX_LAG), или синхронизации
+  ещё не было, или сейчас пишет задача или команда (tracking_writes).
+
+Сессии и пользователи (sessions, auth) всегда читаются с основной базы:
+только что вошедший пользователь может ещё не попасть в реплику.
+
+Запись вне запроса, задачи и команды (shell, скрипты, потоки) отмечается
+после того, как она закоммичена (mark_after_write), а не когда роутер
+выбирает базу: иначе синхронизация между отметкой и коммитом сочла бы
+реплику догнавшей без этой строки.
+
+Время синхронизации и последней записи хранятся в кэше, общем для
+воркеров. Локально реплика -- второй файл SQLite, его обновляет
+``manage.py sync_replica``; если под псевдонимом replica стоит настоящая
+реплика, mark_synced() вызывает то, что следит за её синхронизацией.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+REPLICA = "replica"
+SYNCED_KEY = "replica:synced_at"
+WRITTEN_KEY = "replica:written_at"
+WRITERS_KEY = "replica:writers"
+STICKY_COOKIE = "primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+PRIMARY_APPS = ("sessions", "auth")
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLAC")
+
+UNKNOWN = object()
+
+
+class RoutingState:
+    """
+    Маршрутизация текущего запроса. Объект изменяемый, чтобы запись,
+    отмеченная роутером во вложенном контексте, была видна middleware.
+    """
+    def __init__(self, pinned=False, background=False):
+        # основная база для всего запроса: небезопасный метод или кука после записи
+        self.pinned = pinned
+        self.wrote = False
+        # задача или команда: её запись отмечается в начале и в конце, а не в ответе
+        self.background = background
+        # None -- представление не просило реплику
+        self.max_lag = None
+        self.lag = UNKNOWN
+
+    def uses_replica(self) -> bool:
+        if self.max_lag is None or self.pinned or self.wrote:
+            return False
+        if self.lag is UNKNOWN:
+            # отставание проверяется один раз за запрос, а не на каждый SELECT
+            self.lag = replica_lag()
+        return self.lag is not None and self.lag <= self.max_lag
+
+    def write(self):
+        if not self.wrote and self.background:
+            cache.add(WRITERS_KEY, 0, None)
+            cache.incr(WRITERS_KEY)
+        self.wrote = True
+
+
+routing = ContextVar("db_routing", default=None)
+
+
+def mark_synced(started: float):
+    """
+    Реплика содержит всё, что было записано в основную базу до started.
+    """
+    cache.set(SYNCED_KEY, started, None)
+    cache.add(WRITTEN_KEY, started, None)
+
+
+def mark_written():
+    cache.set(WRITTEN_KEY, time(), None)
+
+
+def mark_after_write(execute, sql, params, many, context):
+    """
+    execute_wrapper основной базы для записи без состояния маршрутизации:
+    в autocommit оператор уже закоммичен, в транзакции отметка
+    откладывается до коммита -- одна на транзакцию.
+    """
+    result = execute(sql, params, many, context)
+    if routing.get() is None and sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+        connection = context["connection"]
+        if not connection.in_atomic_block:
+            mark_written()
+        elif not any(func is mark_written for _, func, _ in connection.run_on_commit):
+            transaction.on_commit(mark_written, using=connection.alias)
+    return result
+
+
+def replica_lag():
+    """
+    На сколько секунд реплика может отставать: 0, если после синхронизации
+    записей не было и никто не пишет; None, если реплики нет или её ни разу
+    не синхронизировали.
+    """
+    if REPLICA not in settings.DATABASES:
+        return None
+    marks = cache.get_many([SYNCED_KEY, WRITTEN_KEY, WRITERS_KEY])
+    synced = marks.get(SYNCED_KEY)
+    if synced is None:
+        return None
+    written = marks.get(WRITTEN_KEY)
+    if written is not None and written <= synced and not marks.get(WRITERS_KEY):
+        return 0.0
+    return max(0.0, time() - synced)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return None
+        state = routing.get()
+        if state is not None and state.uses_replica():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is None:
+            # запись вне запроса, задачи и команды отмечается после коммита
+            connection = connections[DEFAULT_DB_ALIAS]
+            if mark_after_write not in connection.execute_wrappers:
+                connection.execute_wrappers.append(mark_after_write)
+        else:
+            state.write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика -- копия default, объекты из обеих баз можно связывать
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплики приходит вместе с данными при синхронизации
+        if db == REPLICA:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Заводит состояние маршрутизации на запрос. После запроса с записью
+    отмечает время записи и закрепляет клиента за основной базой.
+    """
+    def __init__(self, get_response):
+        if settings.REPLICA_STICKY_SECONDS < settings.REPLICA_MAX_LAG:
+            raise ImproperlyConfigured("REPLICA_STICKY_SECONDS must not be shorter than REPLICA_MAX_LAG")
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(pinned=request.method not in SAFE_METHODS or self.is_sticky(request))
+        token = routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.reset(token)
+        if state.wrote:
+            mark_written()
+            sticky = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, f"{time() + sticky:.3f}", max_age=sticky, httponly=True,
+                                samesite="Lax")
+        return response
+
+    def is_sticky(self, request) -> bool:
+        try:
+            return time() < float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            return False
+
+
+@contextmanager
+def tracking_writes():
+    """
+    Задача или команда вне запроса: вместо отметки на каждую запись она
+    отмечается писателем при первой записи и снимается в конце блока.
+    Пока писатель есть, реплика не считается догнавшей. Внутри запроса
+    блок ничего не меняет.
+    """
+    state = routing.get()
+    if state is not None:
+        yield state
+        return
+    state = RoutingState(background=True)
+    token = routing.set(state)
+    try:
+        yield state
+    finally:
+        routing.reset(token)
+        if state.wrote:
+            mark_written()
+            try:
+                cache.decr(WRITERS_KEY)
+            except ValueError:
+                # счётчик вытеснен из кэша
+                pass
+
+
+@contextmanager
+def reading_replica(max_lag=None):
+    """
+    Чтение внутри блока идёт с реплики, если она отстаёт не больше
+    max_lag секунд (по умолчанию REPLICA_MAX_LAG).
+    """
+    with tracking_writes() as state:
+        previous = state.max_lag
+        state.max_lag = settings.REPLICA_MAX_LAG if max_lag is None else max_lag
+        try:
+            yield state
+        finally:
+            state.max_lag = previous
+
+
+def iter_reading_replica(chunks, state, max_lag):
+    """
+    Потоковый ответ читает базу уже после выхода из представления:
+    каждая порция снова вычисляется в состоянии этого запроса.
+    """
+    chunks = iter(chunks)
+    while True:
+        token = routing.set(state)
+        previous = state.max_lag
+        state.max_lag = max_lag
+        try:
+            chunk = next(chunks, None)
+        finally:
+            state.max_lag = previous
+            routing.reset(token)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def replica_response(response, state):
+    if response.streaming:
+        response.streaming_content = iter_reading_replica(response.streaming_content, state, state.max_lag)
+    return response
+
+
+def replica_reads(view_func=None, *, max_lag=None):
+    """
+    Декоратор представления, которое только читает: его запросы идут
+    на реплику. replica_reads(max_lag=0) -- только на догнавшую реплику.
+    """
+    if view_func is None:
+        return partial(replica_reads, max_lag=max_lag)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with reading_replica(max_lag) as state:
+            return replica_response(view_func(request, *args, **kwargs), state)
+    return wrapper
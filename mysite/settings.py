@@ -71,6 +71,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     #"django.middleware.cache.UpdateCacheMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "mysite.replica.ReplicaMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -115,11 +116,31 @@ DATABASE_DIR.mkdir(exist_ok=True)
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        # WAL, busy timeout и BEGIN IMMEDIATE для нескольких воркеров (см. mysite/sqlite_backend)
+        "ENGINE": "mysite.sqlite_backend",
         "NAME": DATABASE_DIR / "db.sqlite3",
-    }
+        "CONN_MAX_AGE": int(getenv("DJANGO_DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # копия default для тяжёлых чтений, обновляется manage.py sync_replica (см. mysite/replica.py)
+    "replica": {
+        "ENGINE": "mysite.sqlite_backend",
+        "NAME": DATABASE_DIR / "replica.sqlite3",
+        "CONN_MAX_AGE": int(getenv("DJANGO_DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        # только чтение: блокировка записи при BEGIN реплике не нужна
+        "OPTIONS": {"transaction_mode": "DEFERRED", "pragmas": {"query_only": 1}},
+        "TEST": {"MIRROR": "default"},
+    },
 }
 
+DATABASE_ROUTERS = ["mysite.replica.PrimaryReplicaRouter"]
+
+# Heavy read views fall back to default when the replica is older than this (seconds)
+REPLICA_MAX_LAG = int(getenv("DJANGO_REPLICA_MAX_LAG", "30"))
+# After a write the client reads from default for this long (seconds), never less than REPLICA_MAX_LAG
+REPLICA_STICKY_SECONDS = max(REPLICA_MAX_LAG, int(getenv("DJANGO_REPLICA_STICKY_SECONDS", "0")))
+
 CACHES = {
     "default": {
         #"BACKEND": "django.core.cache.backends.dummy.DummyCache"
@@ -130,6 +151,9 @@ CACHES = {
 
 CACHE_MIDDLEWARE_SECONDS = 200
 
+# Rebuild the cached products export right after it is invalidated
+SHOP_PREWARM_PRODUCTS_EXPORT = getenv("SHOP_PREWARM_PRODUCTS_EXPORT", "0") == "1"
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -152,7 +176,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
-LANGUAGE_CODE = "en-us"
+LANGUAGE_CODE = "en"
 
 TIME_ZONE = "UTC"
 
@@ -0,0 +1,45 @@
+"""
+SQLite для нескольких процессов-воркеров.
+
+Стандартный бэкенд оставляет журнал отката и отложенные транзакции:
+писатель блокирует читателей, а транзакция, которая сначала читает
+и потом пишет, при повышении блокировки сразу получает
+"database is locked", не дожидаясь busy timeout. Здесь при подключении:
+
+- journal_mode=WAL -- читатели и писатель не мешают друг другу;
+- synchronous=NORMAL -- в WAL безопасно, fsync только при checkpoint;
+- busy_timeout -- ожидание занятой блокировки вместо ошибки;
+- mmap_size, cache_size, temp_store -- чтение через отображение файла,
+  больший кэш страниц и временные B-деревья в памяти.
+
+Транзакции по умолчанию начинаются с BEGIN IMMEDIATE: блокировка записи
+берётся сразу и ждётся по busy_timeout. Прагмы меняются через
+OPTIONS["pragmas"], соединения между запросами сохраняет CONN_MAX_AGE.
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    # отрицательное значение -- в КиБ, то есть 64 МиБ
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+TRANSACTION_MODE = "IMMEDIATE"
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **kwargs.pop("pragmas", {})}
+        if self.transaction_mode is None:
+            self.transaction_mode = TRANSACTION_MODE
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
@@ -21,6 +21,7 @@ from django.conf.urls.i18n import i18n_patterns
 from django.contrib.sitemaps.views import sitemap
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
+from .replica import replica_reads
 from .sitemaps import sitemaps
 
 urlpatterns = [
@@ -30,7 +31,7 @@ urlpatterns = [
     path("api/schema/redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
     path("api/", include("myapiapp.urls")),
     path("blog/", include("blogapp.urls"), name="blog"),
-    path("sitemap.xml", sitemap, {"sitemaps": sitemaps}, name="django.contrib.sitemaps.views.sitemap")
+    path("sitemap.xml", replica_reads(sitemap), {"sitemaps": sitemaps}, name="django.contrib.sitemaps.views.sitemap")
 ]
 
 urlpatterns += i18n_patterns(
@@ -1,15 +1,23 @@
+import os
 from io import TextIOWrapper
 from csv import DictReader
+from django.apps import apps
 from django.contrib import admin
+from django.contrib.auth import get_permission_codename
 from django.db.models import QuerySet
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
-from django.urls import path
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.utils import timezone
+from django.utils.html import format_html
+from django.urls import path, reverse
 from django.contrib.auth.models import User
 from .forms import CSVImportForm
-from .models import Product, Order, ProductImage
+from .models import Product, Order, ProductImage, Job
 from .admin_mixins import ExportAsCSVMixin
-from .common import save_csv_products, save_csv_orders
+from .caching import PRODUCTS, bump_on_commit
+from .jobs import enqueue_import
+from .order_totals import refresh_order_totals
 
 
 class OrderInLine(admin.TabularInline):
@@ -24,14 +32,16 @@ class ProductInLine(admin.StackedInline):
 def mark_archived(modeladmin: admin.ModelAdmin,
                   request: HttpRequest,
                   queryset: QuerySet):
-    queryset.update(archived=True)
+    queryset.update(archived=True, updated_at=timezone.now())
+    bump_on_commit(PRODUCTS)
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin,
                     request: HttpRequest,
                     queryset: QuerySet):
-    queryset.update(archived=False)
+    queryset.update(archived=False, updated_at=timezone.now())
+    bump_on_commit(PRODUCTS)
 
 
 @admin.register(Product)
@@ -45,7 +55,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     search_fields = "name", "price"
     fieldsets = [
         (None, {
-            "fields": ("name", "description")
+            "fields": ("name", "sku", "description")
         }),
         ("Price options", {
             "fields": ("price", "discount")
@@ -74,9 +84,9 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         if not form.is_valid():
             context = {"form": form}
             return render(request, "admin/csv_form.html", context, status=400)
-        save_csv_products(file=form.files["csv_file"].file, encoding="UTF-8")
-        self.message_user(request, "Data from CSV was imported")
-        return redirect("..")
+        job = enqueue_import(Job.KIND_IMPORT_PRODUCTS, form.files["csv_file"], request.user)
+        self.message_user(request, f"Import queued as job #{job.pk}")
+        return redirect("admin:shopapp_job_changelist")
 
 
     def get_urls(self):
@@ -101,8 +111,9 @@ class ProductInLine(admin.StackedInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     change_list_template = "shopapp/orders_changelist.html"
+    actions = ["export_csv"]
     inlines = [ProductInLine]
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    list_display = "delivery_address", "promocode", "created_at", "user_verbose", "items_count", "discounted_total"
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
@@ -110,6 +121,11 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # строки товаров из inline сохраняются без m2m_changed
+        refresh_order_totals(form.instance)
+
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
             form = CSVImportForm()
@@ -119,9 +135,9 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         if not form.is_valid():
             context = {"form": form}
             return render(request, "admin/csv_form.html", context, status=400)
-        save_csv_orders(file=form.files["csv_file"].file, encoding="UTF-8")
-        self.message_user(request, "Data from CSV was imported")
-        return redirect("..")
+        job = enqueue_import(Job.KIND_IMPORT_ORDERS, form.files["csv_file"], request.user)
+        self.message_user(request, f"Import queued as job #{job.pk}")
+        return redirect("admin:shopapp_job_changelist")
 
     def get_urls(self):
         urls = super().get_urls()
@@ -133,3 +149,78 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             )
         ]
         return new_urls + urls
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    change_list_template = "shopapp/jobs_changelist.html"
+    list_display = "pk", "kind", "status", "progress_verbose", "message", "result_link", "created_by", "created_at"
+    list_filter = "kind", "status"
+    readonly_fields = [field.name for field in Job._meta.fields] + ["progress_verbose", "result_link"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        return Job.objects.select_related("created_by").defer("params", "errors")
+
+    @admin.display(description="Progress")
+    def progress_verbose(self, obj: Job) -> str:
+        return f"{obj.progress}% ({obj.processed_rows}/{obj.total_rows})"
+
+    @admin.display(description="Result")
+    def result_link(self, obj: Job) -> str:
+        if not obj.result:
+            return "-"
+        return format_html('<a href="{}">Download</a>', reverse("admin:shopapp_job_result", args=[obj.pk]))
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["has_active_jobs"] = Job.objects.filter(
+            status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING]
+        ).exists()
+        return super().changelist_view(request, extra_context)
+
+    def progress(self, request: HttpRequest, object_id) -> JsonResponse:
+        job = get_object_or_404(Job, pk=object_id)
+        return JsonResponse({
+            "status": job.status,
+            "total_rows": job.total_rows,
+            "processed_rows": job.processed_rows,
+            "progress": job.progress,
+            "message": job.message,
+            "result": reverse("admin:shopapp_job_result", args=[job.pk]) if job.result else None
+        })
+
+    def result(self, request: HttpRequest, object_id) -> FileResponse:
+        """
+        Файл результата задачи. /media в production не раздаётся, а выгрузки
+        заказов и покупателей нельзя отдавать без проверки прав: нужны
+        просмотр задачи и просмотр выгруженной модели.
+        """
+        job = get_object_or_404(Job, pk=object_id)
+        if not job.result:
+            raise Http404
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+        if "model" in job.params:
+            opts = apps.get_model(job.params["model"])._meta
+            if not request.user.has_perm(f"{opts.app_label}.{get_permission_codename('view', opts)}"):
+                raise PermissionDenied
+        return FileResponse(job.result.open("rb"), as_attachment=True, filename=os.path.basename(job.result.name))
+
+    def get_urls(self):
+        urls = super().get_urls()
+        new_urls = [
+            path(
+                "<int:object_id>/progress/",
+                self.admin_site.admin_view(self.progress),
+                name="shopapp_job_progress"
+            ),
+            path(
+                "<int:object_id>/result/",
+                self.admin_site.admin_view(self.result),
+                name="shopapp_job_result"
+            )
+        ]
+        return new_urls + urls
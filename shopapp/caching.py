@@ -0,0 +1,210 @@
+"""
+Версионированные ключи кэша для выгрузок магазина.
+
+У каждой группы данных ("products", "orders") есть счётчик поколения.
+Сигналы моделей увеличивают его после коммита, и следующие запросы
+сразу идут по новым ключам, а старые записи просто истекают.
+Поэтому TTL можно держать большим, не рискуя отдать устаревшие данные.
+"""
+import re
+from hashlib import md5
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, HttpResponseBase, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from .streaming import EXPORT_CHUNK_SIZE, iter_buffered, iter_cached, iter_json
+
+PRODUCTS = "products"
+ORDERS = "orders"
+
+GENERATION_KEY = "shop:generation:{}"
+EXPORT_CACHE_TIMEOUT = 60 * 60 * 6
+
+re_accepts_gzip = re.compile(r"\bgzip\b")
+
+STATS_KEY = "shop:stats:{}:{}"
+STATS_TIMEOUT = 60 * 60 * 24
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def get_generation(name: str) -> int:
+    key = GENERATION_KEY.format(name)
+    generation = cache.get(key)
+    if generation is None:
+        # Если счётчик вытеснен из кэша, начинаем с текущего времени,
+        # чтобы не совпасть ни с одним из прежних поколений.
+        cache.add(key, time_ns() // 1000, None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(name: str) -> int:
+    try:
+        return cache.incr(GENERATION_KEY.format(name))
+    except ValueError:
+        return get_generation(name)
+
+
+def bump_on_commit(name: str):
+    transaction.on_commit(lambda: on_generation_bumped(name, bump_generation(name)))
+
+
+def on_generation_bumped(name: str, generation: int):
+    if name == PRODUCTS and getattr(settings, "SHOP_PREWARM_PRODUCTS_EXPORT", False):
+        prewarm_products_export()
+
+
+def versioned_key(name: str, *parts) -> str:
+    return ":".join(["shop", name, str(get_generation(name)), *map(str, parts)])
+
+
+def products_export_key() -> str:
+    return versioned_key(PRODUCTS, "export")
+
+
+def iter_products_export():
+    """
+    Полная выгрузка товаров по частям JSON, строки читаются итератором.
+
+    Курсор берётся до чтения строк: изменения, сделанные во время
+    выгрузки, клиент получит следующим запросом с since.
+    """
+    from .delta import settled_cursor, settled_until
+    from .models import Product
+
+    until = settled_until()
+    latest = Product.objects.order_by("-updated_at", "-pk").values_list("updated_at", "pk").first()
+    rows = (
+        {
+            "pk": pk,
+            "name": name,
+            "price": price,
+            "archived": archived
+        }
+        for pk, name, price, archived in (
+            Product.objects.order_by("pk")
+            .values_list("pk", "name", "price", "archived")
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+    )
+    return iter_json({
+        "products": rows,
+        "next_cursor": settled_cursor(latest, until)
+    })
+
+
+def products_export_response() -> HttpResponseBase:
+    """
+    Из кэша -- готовые байты; при промахе ответ идёт потоком
+    и по завершении сам попадает в кэш.
+    """
+    key = products_export_key()
+    body = cache.get(key)
+    if body is not None:
+        return HttpResponse(body, content_type="application/json")
+    return StreamingHttpResponse(
+        iter_cached(iter_buffered(iter_products_export()), key, EXPORT_CACHE_TIMEOUT),
+        content_type="application/json"
+    )
+
+
+def prewarm_products_export():
+    key = products_export_key()
+    if not cache.has_key(key):
+        for chunk in iter_cached(iter_buffered(iter_products_export()), key, EXPORT_CACHE_TIMEOUT):
+            pass
+
+
+def cached_json_response(request: HttpRequest, key: str, build, filename: str = None) -> HttpResponse:
+    """
+    Отдаёт JSON из кэша готовыми байтами.
+
+    build() вызывается только при промахе; в кэше лежит уже закодированный
+    JSON и, по запросу клиента, его gzip-версия, так что на попадании нет
+    ни распаковки объектов, ни повторного рендеринга.
+    """
+    file_gzip = filename is not None and request.GET.get("compress") == "gzip"
+    use_gzip = file_gzip or bool(re_accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")))
+    body = cache.get(f"{key}:gzip") if use_gzip else None
+    if body is None:
+        raw = cache.get(key)
+        if raw is None:
+            raw = JSONRenderer().render(build())
+            cache.set(key, raw, EXPORT_CACHE_TIMEOUT)
+        body = raw
+        if use_gzip:
+            body = compress_string(raw)
+            cache.set(f"{key}:gzip", body, EXPORT_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type="application/json")
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if file_gzip:
+        response["Content-Type"] = "application/gzip"
+        filename += ".gz"
+    elif use_gzip:
+        response["Content-Encoding"] = "gzip"
+    if filename is not None:
+        response["Content-Disposition"] = f"attachment; filename={filename}"
+    response["Content-Length"] = str(len(body))
+    return response
+
+
+def hashed_key(*parts) -> str:
+    return md5(repr(parts).encode()).hexdigest()
+
+
+def incr_counter(key: str):
+    if not cache.add(key, 1, STATS_TIMEOUT):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, STATS_TIMEOUT)
+
+
+def record_cache_access(endpoint: str, hit: bool, seconds: float):
+    """
+    Счётчики попаданий и гистограмма задержек по корзинам LATENCY_BUCKETS_MS.
+
+    Хранятся в общем кэше, так что статистика общая для всех воркеров.
+    """
+    incr_counter(STATS_KEY.format(endpoint, "hits" if hit else "misses"))
+    milliseconds = seconds * 1000
+    bucket = next((bound for bound in LATENCY_BUCKETS_MS if milliseconds <= bound), "inf")
+    incr_counter(STATS_KEY.format(endpoint, f"latency:{bucket}"))
+
+
+def get_cache_stats(endpoint: str) -> dict:
+    buckets = [*LATENCY_BUCKETS_MS, "inf"]
+    keys = [STATS_KEY.format(endpoint, name) for name in ("hits", "misses")]
+    keys += [STATS_KEY.format(endpoint, f"latency:{bucket}") for bucket in buckets]
+    values = cache.get_many(keys)
+    hits = values.get(keys[0], 0)
+    misses = values.get(keys[1], 0)
+    counts = [values.get(key, 0) for key in keys[2:]]
+    total = sum(counts)
+
+    def percentile(share):
+        if not total:
+            return None
+        seen = 0
+        for bucket, count in zip(buckets, counts):
+            seen += count
+            if seen >= share * total:
+                return bucket
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        "latency_ms": {
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        },
+    }
@@ -0,0 +1,82 @@
+"""
+Валидаторы для условных GET-запросов (If-None-Match / If-Modified-Since).
+
+Всё считается без рендеринга ответа: у одиночного объекта -- по его
+updated_at (один запрос по первичному ключу), у списков и ленты -- по
+счётчикам поколений из caching, которые вообще не обращаются к базе.
+Для страниц в ETag входит и то, от чего зависит шаблон помимо данных:
+язык и права пользователя.
+"""
+from calendar import timegm
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .caching import ORDERS, PRODUCTS, get_generation, hashed_key
+from .models import Order, Product
+
+
+def updated_at(model, pk):
+    try:
+        return model.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+    except (TypeError, ValueError, ValidationError):
+        # некорректный pk: пусть view сама ответит 404
+        return None
+
+
+def product_last_modified(request, pk, *args, **kwargs) -> datetime:
+    return updated_at(Product, pk)
+
+
+def product_details_etag(request, pk, *args, **kwargs) -> str:
+    modified = updated_at(Product, pk)
+    if modified is None:
+        return None
+    return hashed_key(
+        "product", pk, modified.timestamp(),
+        translation.get_language(),
+        request.user.has_perm("shopapp.change_product"),
+    )
+
+
+def order_details_etag(request, pk, *args, **kwargs) -> str:
+    """
+    В шаблоне заказа есть имя покупателя и названия с ценами товаров,
+    поэтому кроме updated_at заказа учитываются поколения заказов
+    (меняется и при правке пользователей) и товаров.
+    """
+    modified = updated_at(Order, pk)
+    if modified is None:
+        return None
+    return hashed_key(
+        "order", pk, modified.timestamp(),
+        get_generation(ORDERS), get_generation(PRODUCTS),
+        translation.get_language(),
+    )
+
+
+def products_feed_etag(request, *args, **kwargs) -> str:
+    return hashed_key("feed", get_generation(PRODUCTS), translation.get_language(), request.get_host())
+
+
+def conditional_response(request, respond, etag=None, last_modified=None):
+    """
+    Как django.views.decorators.http.condition, но для готовых валидаторов:
+    при совпадении -- 304 (или 412), иначе respond() с ETag и Last-Modified.
+    """
+    if etag is not None:
+        etag = quote_etag(etag)
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        return response
+    response = respond()
+    if request.method in ("GET", "HEAD") and response.status_code == 200:
+        if etag is not None and not response.has_header("ETag"):
+            response.headers["ETag"] = etag
+        if timestamp is not None and not response.has_header("Last-Modified"):
+            response.headers["Last-Modified"] = http_date(timestamp)
+    return response
@@ -0,0 +1,112 @@
+"""
+Инкрементальная выгрузка изменений по курсору.
+
+Курсор -- непрозрачная строка с парой (updated_at, pk) последней
+отданной строки. Следующий запрос с этим курсором вернёт только строки,
+изменённые позже, в порядке (updated_at, pk).
+
+updated_at ставится до коммита, поэтому транзакция может закоммитить
+строку со временем раньше уже отданной -- курсор её бы пропустил.
+Поэтому строки, изменённые за последние DELTA_SETTLE_SECONDS, не
+отдаются, а курсор не заходит дальше этой границы (settled_until):
+такие строки придут следующим опросом.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime, timedelta
+
+from django.db.models import Count, Max, Q, QuerySet
+from django.utils import timezone
+
+DELTA_PAGE_SIZE = 1000
+DELTA_SETTLE_SECONDS = 5
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(updated_at: datetime, pk: int) -> str:
+    raw = json.dumps([updated_at.isoformat(), pk]).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, pk = json.loads(raw)
+        return datetime.fromisoformat(updated_at), int(pk)
+    except (BinasciiError, TypeError, ValueError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from error
+
+
+def settled_until() -> datetime:
+    return timezone.now() - timedelta(seconds=DELTA_SETTLE_SECONDS)
+
+
+def settled_cursor(latest, until: datetime):
+    """
+    Курсор после полной выгрузки, последняя строка которой latest
+    (updated_at, pk): не дальше границы until, чтобы следующий опрос
+    не пропустил строки, закоммиченные позже.
+    """
+    if latest is None:
+        return None
+    return encode_cursor(*min(tuple(latest), (until, 0)))
+
+
+def changed_since(queryset: QuerySet, cursor: str = None, until: datetime = None) -> QuerySet:
+    """
+    Строки после курсора, изменённые раньше until (по умолчанию settled_until()).
+    """
+    queryset = queryset.filter(updated_at__lt=until or settled_until()).order_by("updated_at", "pk")
+    if not cursor:
+        return queryset
+    updated_at, pk = decode_cursor(cursor)
+    return queryset.filter(
+        Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk)
+    )
+
+
+def table_version(queryset: QuerySet) -> str:
+    """
+    Дешёвый валидатор состояния таблицы: время последнего изменения и число строк.
+    """
+    state = queryset.aggregate(last_modified=Max("updated_at"), count=Count("pk"))
+    last_modified = state["last_modified"]
+    return f"{last_modified.timestamp() if last_modified else 0}-{state['count']}"
+
+
+class ProductsDelta:
+    """
+    Одна страница изменений товаров после курсора since.
+
+    При обходе отдаются живые товары; номера архивных, next_cursor
+    и has_more становятся известны после обхода, так что страницу
+    можно отдавать потоком, не собирая её в список.
+    """
+    def __init__(self, queryset: QuerySet, since: str, page_size: int = DELTA_PAGE_SIZE):
+        self.rows = changed_since(queryset, since).values(
+            "pk", "name", "price", "archived", "updated_at"
+        )[:page_size + 1]
+        self.page_size = page_size
+        self.archived = []
+        self.next_cursor = since
+        self.has_more = False
+
+    def __iter__(self):
+        for number, row in enumerate(self.rows.iterator(), start=1):
+            if number > self.page_size:
+                self.has_more = True
+                break
+            self.next_cursor = encode_cursor(row["updated_at"], row["pk"])
+            if row["archived"]:
+                self.archived.append(row["pk"])
+                continue
+            yield {
+                "pk": row["pk"],
+                "name": row["name"],
+                "price": row["price"],
+                "archived": False
+            }
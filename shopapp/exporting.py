@@ -0,0 +1,190 @@
+"""
+Параллельный экспорт таблиц в CSV.
+
+Выбранные pk хранятся как диапазоны подряд идущих значений.
+Диапазоны делятся на части примерно равного размера, каждая часть
+рендерится в отдельном процессе во временный файл, после чего файлы
+склеиваются в один CSV (по желанию сжатый gzip).
+"""
+import csv
+import gzip
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+EXPORT_PKS_CHUNK_SIZE = 1000
+# диапазон короче этого читается не отдельным BETWEEN, а в общем IN с соседними
+EXPORT_MIN_RANGE = 100
+EXPORT_MAX_PROCESSES = 4
+
+
+class ExportStats:
+    def __init__(self, rows, seconds):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return float(self.rows)
+        return self.rows / self.seconds
+
+    def __str__(self):
+        return f"{self.rows} exported in {self.seconds:.1f}s ({self.rows_per_second:.0f} rows/s)"
+
+
+def collect_pk_ranges(queryset):
+    """
+    Сворачивает pk выборки в список диапазонов [начало, конец] включительно.
+    """
+    pk_ranges = []
+    for pk in queryset.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=10000):
+        if pk_ranges and pk_ranges[-1][1] == pk - 1:
+            pk_ranges[-1][1] = pk
+        else:
+            pk_ranges.append([pk, pk])
+    return pk_ranges
+
+
+def count_pk_ranges(pk_ranges):
+    return sum(last - first + 1 for first, last in pk_ranges)
+
+
+def split_pk_ranges(pk_ranges, parts):
+    """
+    Делит диапазоны на не более чем parts частей с близким числом строк.
+    """
+    total = count_pk_ranges(pk_ranges)
+    if not total:
+        return []
+    part_size = -(-total // max(parts, 1))
+    result = [[]]
+    room = part_size
+    for first, last in pk_ranges:
+        while first <= last:
+            if not room:
+                result.append([])
+                room = part_size
+            taken_last = min(last, first + room - 1)
+            result[-1].append([first, taken_last])
+            room -= taken_last - first + 1
+            first = taken_last + 1
+    return result
+
+
+def iter_pk_filters(pk_ranges, size=EXPORT_PKS_CHUNK_SIZE):
+    """
+    Фильтры по pk для запросов одной части в порядке pk: длинный диапазон --
+    pk__range, короткие диапазоны подряд собираются в pk__in до size pk.
+    """
+    pks = []
+    for first, last in pk_ranges:
+        if last - first + 1 >= EXPORT_MIN_RANGE:
+            if pks:
+                yield {"pk__in": pks}
+                pks = []
+            yield {"pk__range": (first, last)}
+            continue
+        pks.extend(range(first, last + 1))
+        if len(pks) >= size:
+            yield {"pk__in": pks}
+            pks = []
+    if pks:
+        yield {"pk__in": pks}
+
+
+def render_part(model_label, fields, pk_ranges, path):
+    """
+    Пишет строки одной части в файл path и возвращает их количество.
+
+    Функция верхнего уровня, чтобы её можно было передать в процесс.
+    """
+    model = apps.get_model(model_label)
+    rows_count = 0
+    with open(path, "w", encoding="UTF-8", newline="") as file:
+        writer = csv.writer(file)
+        for pk_filter in iter_pk_filters(pk_ranges):
+            rows = (
+                model.objects
+                .filter(**pk_filter)
+                .order_by("pk")
+                .values_list(*fields)
+                .iterator(chunk_size=EXPORT_PKS_CHUNK_SIZE)
+            )
+            for row in rows:
+                writer.writerow(row)
+                rows_count += 1
+    return rows_count
+
+
+def init_worker(database_name):
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+    # тот же файл базы, что у родителя, а не взятый заново из настроек
+    connections[DEFAULT_DB_ALIAS].settings_dict["NAME"] = database_name
+
+
+def can_use_processes():
+    """
+    Дочерние процессы не увидят ни базу в памяти, ни незакоммиченную транзакцию.
+    """
+    in_memory = getattr(connection, "is_in_memory_db", lambda: False)()
+    return not in_memory and not connection.in_atomic_block
+
+
+def export_csv(model, pk_ranges, output, fields=None, processes=None, compress=False,
+               on_part=None) -> ExportStats:
+    """
+    Экспортирует строки model с pk из pk_ranges в бинарный файл output.
+
+    fields -- имена полей модели (по умолчанию все), on_part(rows) вызывается
+    после готовности каждой части.
+    """
+    meta = model._meta
+    if fields is None:
+        fields = [field.name for field in meta.fields]
+    columns = [meta.get_field(name).attname for name in fields]
+    if processes is None:
+        processes = min(EXPORT_MAX_PROCESSES, os.cpu_count() or 1)
+    if not can_use_processes():
+        processes = 1
+    parts = split_pk_ranges(pk_ranges, processes)
+
+    started = default_timer()
+    rows_count = 0
+    with TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, f"part-{number}.csv") for number in range(len(parts))]
+        if processes > 1 and len(parts) > 1:
+            database_name = connection.settings_dict["NAME"]
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=len(parts), initializer=init_worker,
+                                     initargs=(database_name,)) as executor:
+                futures = [
+                    executor.submit(render_part, meta.label, columns, part, path)
+                    for part, path in zip(parts, paths)
+                ]
+                for future in futures:
+                    rows_count += future.result()
+                    if on_part is not None:
+                        on_part(rows_count)
+        else:
+            for part, path in zip(parts, paths):
+                rows_count += render_part(meta.label, columns, part, path)
+                if on_part is not None:
+                    on_part(rows_count)
+
+        target = gzip.GzipFile(fileobj=output, mode="wb") if compress else output
+        with open(os.path.join(tmpdir, "header.csv"), "w", encoding="UTF-8", newline="") as file:
+            csv.writer(file).writerow(fields)
+        for path in [os.path.join(tmpdir, "header.csv")] + paths:
+            with open(path, "rb") as part_file:
+                shutil.copyfileobj(part_file, target)
+        if compress:
+            target.close()
+    return ExportStats(rows_count, default_timer() - started)
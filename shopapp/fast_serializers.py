@@ -0,0 +1,276 @@
+"""
+Быстрое чтение списков без экземпляров моделей.
+
+FastSerializer выдаёт то же, что и обычный ModelSerializer, но работает
+по строкам queryset.values(): по полям сериализатора один раз
+компилируется кодировщик строки, а на каждую строку приходится лишь
+несколько обращений к словарю. DRF-поля вызываются только там, где
+без них не получить тот же результат (Decimal, дата, файл).
+SerializerMethodField получают лёгкий объект-строку с атрибутами
+из Meta.method_sources (см. query_plan).
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import F
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+RAW = "raw"
+FIELD = "field"
+FILE = "file"
+METHOD = "method"
+MANY = "many"
+
+OWNER_COLUMN = "fast_owner_pk"
+
+# to_representation этих полей не меняет значение, уже полученное из базы
+RAW_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.ReadOnlyField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class RowObject:
+    """
+    Строка values() с доступом через атрибуты: row.user.email -> row["user__email"].
+    """
+    __slots__ = ("_row", "_prefix")
+
+    def __init__(self, row, prefix=""):
+        self._row = row
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        key = self._prefix + name
+        if key in self._row:
+            return self._row[key]
+        nested = key + "__"
+        if any(column.startswith(nested) for column in self._row):
+            return RowObject(self._row, nested)
+        raise AttributeError(name)
+
+
+class RowEncoder:
+    def __init__(self, model, columns, steps, many):
+        self.model = model
+        self.columns = columns
+        # (имя поля, ключ в строке, вид преобразования)
+        self.steps = steps
+        # имя поля -> (связанная модель, имя обратной связи, вложенный сериализатор или None)
+        self.many = many
+
+
+def column_for(model, attrs):
+    """
+    Имя столбца для values() по source_attrs поля и модельное поле в конце пути.
+    """
+    field = None
+    for attr in attrs:
+        if field is not None:
+            if not field.is_relation:
+                raise ImproperlyConfigured(f"{'.'.join(attrs)} is not a model field path")
+            model = field.related_model
+        try:
+            field = model._meta.pk if attr == "pk" else model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f"{model.__name__}.{attr} is not a model field")
+    return "__".join(attrs), field
+
+
+@lru_cache(maxsize=None)
+def compile_encoder(serializer_class) -> RowEncoder:
+    model = serializer_class.Meta.model
+    method_sources = getattr(serializer_class.Meta, "method_sources", {})
+    columns = ["pk"]
+    steps = []
+    many = {}
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            sources = method_sources.get(name, [name])
+            for source in sources:
+                column, _ = column_for(model, source.split("."))
+                columns.append(column)
+            steps.append((name, None, METHOD))
+            continue
+        pk_list = isinstance(field, serializers.ManyRelatedField) and \
+            isinstance(field.child_relation, serializers.PrimaryKeyRelatedField)
+        nested_list = isinstance(field, serializers.ListSerializer) and \
+            isinstance(field.child, serializers.ModelSerializer)
+        if pk_list or nested_list:
+            _, model_field = column_for(model, field.source_attrs)
+            if len(field.source_attrs) != 1 or not model_field.many_to_many or not model_field.concrete:
+                raise ImproperlyConfigured(f"{name}: only forward many-to-many fields are supported")
+            nested_class = type(field.child) if nested_list else None
+            if nested_class is not None:
+                compile_encoder(nested_class)
+            many[name] = (model_field.related_model, model_field.related_query_name(), nested_class)
+            steps.append((name, name, MANY))
+            continue
+        if isinstance(field, (serializers.Serializer, serializers.ListSerializer, serializers.RelatedField,
+                              serializers.ManyRelatedField)) and \
+                not isinstance(field, serializers.PrimaryKeyRelatedField):
+            raise ImproperlyConfigured(f"{name}: {type(field).__name__} is not supported")
+        if field.source == "*":
+            raise ImproperlyConfigured(f"{name}: source='*' is not supported")
+        try:
+            column, _ = column_for(model, field.source_attrs)
+        except ImproperlyConfigured:
+            if not field.read_only or len(field.source_attrs) != 1 or isinstance(field, serializers.FileField):
+                raise
+            # аннотация queryset: values() отдаст её под тем же именем
+            column = field.source
+        columns.append(column)
+        if isinstance(field, serializers.FileField):
+            steps.append((name, column, FILE))
+        elif isinstance(field, RAW_FIELDS):
+            steps.append((name, column, RAW))
+        else:
+            steps.append((name, column, FIELD))
+    return RowEncoder(model, list(dict.fromkeys(columns)), steps, many)
+
+
+class FastSerializer:
+    """
+    Только для чтения: FastSerializer(ProductSerializer, context).encode(rows).
+    """
+    def __init__(self, serializer_class, context=None):
+        self.encoder = compile_encoder(serializer_class)
+        self.serializer = serializer_class(context=context or {})
+
+    def values(self, queryset):
+        """
+        queryset.values() со всеми столбцами, нужными кодировщику и сортировке.
+        """
+        meta = queryset.model._meta
+        columns = list(self.encoder.columns)
+        for term in queryset.query.order_by or meta.ordering:
+            if not isinstance(term, str):
+                continue
+            name = term.lstrip("-")
+            if name in queryset.query.annotations:
+                columns.append(name)
+                continue
+            try:
+                columns.append("pk" if name == "pk" else meta.get_field(name).attname)
+            except FieldDoesNotExist:
+                continue
+        return queryset.prefetch_related(None).values(*dict.fromkeys(columns))
+
+    def file_url(self, column):
+        """
+        Как FileField.to_representation, но префикс хранилища и хоста
+        вычисляется один раз, а не для каждой строки.
+        """
+        model_field = column_for(self.encoder.model, column.split("__"))[1]
+        storage = model_field.storage
+        request = self.serializer.context.get("request")
+
+        def slow(name):
+            url = storage.url(name)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        probe = slow("probe")
+        if not probe.endswith("/probe"):
+            return slow
+        prefix = probe[:-len("probe")]
+
+        def convert(name):
+            # сегменты "." и ".." urljoin нормализует сам
+            if name.startswith("/") or "/." in "/" + name:
+                return slow(name)
+            return prefix + filepath_to_uri(name)
+        return convert
+
+    def datetime_converter(self, field):
+        """
+        DateTimeField.to_representation с часовым поясом, найденным один раз.
+        """
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        if output_format is None or output_format.lower() != ISO_8601:
+            return field.to_representation
+        field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+        if field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if isinstance(value, str) or not timezone.is_aware(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith("+00:00"):
+                value = value.removesuffix("+00:00") + "Z"
+            return value
+        return convert
+
+    def many_values(self, rows):
+        """
+        Значения many-to-many полей для всех строк: по одному запросу на поле.
+        Вложенные сериализаторы кодируются тем же способом, что и верхний.
+        """
+        result = {}
+        pks = [row["pk"] for row in rows]
+        for name, (related_model, query_name, nested_class) in self.encoder.many.items():
+            related = {pk: [] for pk in pks}
+            result[name] = related
+            if not pks:
+                continue
+            queryset = related_model._default_manager.filter(**{f"{query_name}__in": pks})
+            if nested_class is None:
+                for owner, pk in queryset.values_list(query_name, "pk"):
+                    related[owner].append(pk)
+                continue
+            nested = FastSerializer(nested_class, context=self.serializer.context)
+            nested_rows = list(queryset.values(*nested.encoder.columns, **{OWNER_COLUMN: F(query_name)}))
+            for row, item in zip(nested_rows, nested.encode(nested_rows)):
+                related[row[OWNER_COLUMN]].append(item)
+        return result
+
+    def encode(self, rows) -> list:
+        rows = list(rows)
+        fields = self.serializer.fields
+        many = self.many_values(rows) if self.encoder.many else {}
+        converters = []
+        for name, column, kind in self.encoder.steps:
+            field = fields[name]
+            if kind == FIELD and isinstance(field, serializers.DateTimeField):
+                convert = self.datetime_converter(field)
+            elif kind == FIELD:
+                convert = field.to_representation
+            elif kind == FILE:
+                use_url = getattr(field, "use_url", True)
+                convert = self.file_url(column) if use_url else None
+            elif kind == METHOD:
+                convert = getattr(self.serializer, field.method_name)
+            elif kind == MANY:
+                convert = many[name]
+            else:
+                convert = None
+            converters.append((name, column, kind, convert))
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, kind, convert in converters:
+                if kind == METHOD:
+                    item[name] = convert(RowObject(row))
+                elif kind == MANY:
+                    item[name] = convert[row["pk"]]
+                else:
+                    value = row[column]
+                    if kind == FILE and not value:
+                        item[name] = None
+                    elif convert is None or value is None:
+                        item[name] = value
+                    else:
+                        item[name] = convert(value)
+            data.append(item)
+        return data
@@ -0,0 +1,313 @@
+"""
+Советчик по индексам на основе планов запросов SQLite.
+
+Основные страницы и API проигрываются тестовым клиентом, все SELECT
+перехватываются (connection.execute_wrapper) вместе с параметрами,
+и для каждого выполняется EXPLAIN QUERY PLAN. Полный просмотр таблицы
+и сортировка во временном B-дереве отмечаются, а по условиям WHERE
+и ORDER BY запроса предлагается индекс: сначала столбцы равенства,
+затем сортировки; постоянное логическое условие (archived = False,
+published_at IS NOT NULL) становится условием частичного индекса.
+
+Разбор SQL рассчитан на то, что генерирует Django ORM, и намеренно
+простой: запросы с OR и подзапросами получают только индекс под
+сортировку. Предложения проверяются там же: индексы создаются внутри
+откатываемой транзакции, запросы повторяются и сравниваются время и план.
+"""
+import re
+from pathlib import Path
+from timeit import default_timer
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.backends.utils import names_digest
+from django.db.migrations import AddIndex, Migration
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.db.models import BooleanField, Index, Q
+from django.urls import reverse
+
+FULL_SCAN = "full scan"
+TEMP_SORT = "temp b-tree sort"
+
+re_scan = re.compile(r"^SCAN (\w+)(?P<access> VIRTUAL TABLE| USING (?:COVERING )?INDEX| USING INTEGER PRIMARY KEY)?")
+re_temp_sort = re.compile(r"^USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY")
+re_column = re.compile(r'(?P<negated>NOT )?"(?P<table>\w+)"\."(?P<column>\w+)"(?P<rest>[^"]{0,16})')
+re_order_term = re.compile(r'"(\w+)"\."(\w+)" (ASC|DESC)')
+re_clause_end = re.compile(r" (?:GROUP BY|ORDER BY|LIMIT|HAVING) ")
+
+
+class CapturedQuery:
+    """
+    SELECT, выполненный при проигрывании запроса path, и его план.
+    """
+    def __init__(self, sql, params, path):
+        self.sql = sql
+        self.params = tuple(params or ())
+        self.path = path
+        self.plan = []
+        self.problems = []
+        self.proposals = []
+        self.before = None
+        self.after = None
+        self.plan_after = []
+
+
+class IndexProposal:
+    def __init__(self, model, fields, condition=None):
+        self.model = model
+        self.index = Index(fields=list(fields), condition=condition, name="advised")
+        self.index.set_name_with_model(model)
+        if condition is not None:
+            # имя Django строит только по полям; частичный индекс отличается условием
+            prefix = self.index.name.rsplit("_", 2)[0]
+            digest = names_digest(model._meta.db_table, *self.index.fields, repr(condition), length=6)
+            self.index.name = f"{prefix}_{digest}_{self.index.suffix}"
+
+    @property
+    def key(self):
+        return self.model._meta.label, tuple(self.index.fields), repr(self.index.condition)
+
+    def __str__(self):
+        return f"{self.model._meta.label}: {MigrationWriter.serialize(self.index)[0]}"
+
+
+def project_models() -> dict:
+    """
+    Таблица -> модель для приложений из BASE_DIR: индексы предлагаются
+    только туда, где есть свои миграции.
+    """
+    base_dir = str(settings.BASE_DIR)
+    return {
+        model._meta.db_table: model
+        for model in apps.get_models()
+        if model._meta.app_config.path.startswith(base_dir) and model._meta.managed
+    }
+
+
+def advised_paths(user) -> list:
+    """
+    Страницы и API, запросы которых проверяются: списки, ленты, карта сайта.
+    """
+    return [
+        reverse("shopapp:products_list"),
+        reverse("shopapp:orders_list"),
+        reverse("shopapp:user_orders", kwargs={"user_id": user.pk}),
+        reverse("shopapp:products-feed"),
+        reverse("shopapp:product-list"),
+        reverse("shopapp:product-list") + "?ordering=-price",
+        reverse("shopapp:order-list"),
+        reverse("shopapp:products-export"),
+        reverse("blogapp:articles"),
+        reverse("blogapp:articles-feed"),
+        reverse("django.contrib.sitemaps.views.sitemap"),
+    ]
+
+
+def capture_selects(client, paths) -> list:
+    """
+    Проигрывает GET-запросы и возвращает различные SELECT в порядке появления.
+    """
+    captured = {}
+    current = {"path": None}
+
+    def capture(execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith("SELECT") and sql not in captured:
+            captured[sql] = CapturedQuery(sql, params, current["path"])
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(capture):
+        for path in paths:
+            current["path"] = path
+            client.get(path, HTTP_USER_AGENT="Index advisor")
+    return list(captured.values())
+
+
+def explain(query: CapturedQuery) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {query.sql}", query.params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def time_query(query: CapturedQuery, repeat: int) -> float:
+    best = None
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            started = default_timer()
+            cursor.execute(query.sql, query.params)
+            cursor.fetchall()
+            elapsed = default_timer() - started
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def plan_problems(plan) -> list:
+    problems = []
+    for detail in plan:
+        scan = re_scan.match(detail)
+        if scan and not scan.group("access"):
+            problems.append((FULL_SCAN, scan.group(1)))
+        elif re_temp_sort.match(detail):
+            problems.append((TEMP_SORT, None))
+    return problems
+
+
+def split_clauses(sql: str):
+    """
+    WHERE и ORDER BY верхнего уровня; для запросов с подзапросами -- (None, None).
+    """
+    if sql.count("SELECT") > 1:
+        return None, None
+    where = None
+    if " WHERE " in sql:
+        where = sql.split(" WHERE ", 1)[1]
+        end = re_clause_end.search(where)
+        if end:
+            where = where[:end.start()]
+    order = None
+    if " ORDER BY " in sql:
+        order = sql.rsplit(" ORDER BY ", 1)[1].split(" LIMIT ", 1)[0]
+    return where, order
+
+
+def where_terms(sql: str, where: str, params, table: str, model):
+    """
+    Столбцы table из WHERE: (равенства, диапазоны, условие частичного индекса).
+    """
+    fields = {field.column: field for field in model._meta.concrete_fields}
+    equal, ranges, conditions = [], [], []
+    offset = sql.index(where)
+    for match in re_column.finditer(where):
+        if match.group("table") != table or match.group("column") not in fields:
+            continue
+        field = fields[match.group("column")]
+        rest = match.group("rest")
+        if rest.startswith(" = %s") and isinstance(field, BooleanField):
+            value = params[sql[:offset + match.start()].count("%s")]
+            conditions.append(Q(**{field.name: bool(value)}))
+        elif rest.startswith(" = ") or rest.startswith(" IN ("):
+            equal.append(field.name)
+        elif rest.startswith(" IS NOT NULL") and field.null:
+            conditions.append(Q(**{f"{field.name}__isnull": False}))
+        elif rest.startswith(" IS NULL") and field.null:
+            conditions.append(Q(**{f"{field.name}__isnull": True}))
+        elif rest[:3] in (" > ", " < ", " >=", " <="):
+            ranges.append(field.name)
+        elif isinstance(field, BooleanField):
+            # WHERE "t"."archived" или WHERE NOT "t"."archived"
+            conditions.append(Q(**{field.name: not match.group("negated")}))
+    return equal, ranges, conditions
+
+
+def order_fields(order: str, table: str, model) -> list:
+    """
+    Поля сортировки с направлением, если вся сортировка -- по столбцам table.
+    """
+    terms = re_order_term.findall(order or "")
+    if not terms or len(terms) != order.count(",") + 1 or any(name != table for name, _, _ in terms):
+        return []
+    fields = {field.column: field for field in model._meta.concrete_fields}
+    result = []
+    for _, column, direction in terms:
+        if column not in fields:
+            return []
+        result.append(("-" if direction == "DESC" else "") + fields[column].name)
+    # pk в конце сортировки Django добавляет сам, в индексе он есть неявно
+    while result and result[-1].lstrip("-") in ("id", model._meta.pk.name):
+        result.pop()
+    return result
+
+
+def propose(query: CapturedQuery, models: dict) -> list:
+    where, order = split_clauses(query.sql)
+    tables = {table for problem, table in query.problems if problem == FULL_SCAN}
+    sorted_table = None
+    for name, _, _ in re_order_term.findall(order or ""):
+        sorted_table = name
+        break
+    if any(problem == TEMP_SORT for problem, _ in query.problems) and sorted_table:
+        tables.add(sorted_table)
+
+    proposals = []
+    for table in sorted(tables):
+        model = models.get(table)
+        if model is None:
+            continue
+        equal, ranges, conditions = [], [], []
+        if where and " OR " not in where:
+            equal, ranges, conditions = where_terms(query.sql, where, query.params, table, model)
+        ordering = order_fields(order, table, model) if table == sorted_table else []
+        fields = list(dict.fromkeys(equal + (ordering or ranges[:1])))
+        if not fields:
+            continue
+        condition = None
+        for term in conditions:
+            condition = term if condition is None else condition & term
+        proposals.append(IndexProposal(model, fields, condition))
+    return proposals
+
+
+def is_improved(query: CapturedQuery) -> bool:
+    return len(plan_problems(query.plan_after)) < len(query.problems)
+
+
+def existing_indexes(table: str) -> list:
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [
+        (name, constraint["columns"])
+        for name, constraint in constraints.items()
+        if constraint["index"] or constraint["unique"]
+    ]
+
+
+def is_covered(proposal: IndexProposal) -> bool:
+    meta = proposal.model._meta
+    columns = [meta.get_field(field.lstrip("-")).column for field in proposal.index.fields]
+    for name, existing in existing_indexes(meta.db_table):
+        if name == proposal.index.name:
+            return True
+        if proposal.index.condition is None and existing[:len(columns)] == columns:
+            return True
+    return False
+
+
+def create_indexes(proposals):
+    """
+    CREATE INDEX прямо курсором: редактор схемы SQLite нельзя открыть
+    внутри транзакции, а проверка идёт именно в ней.
+    """
+    editor = connection.schema_editor(atomic=False)
+    with connection.cursor() as cursor:
+        for proposal in proposals:
+            cursor.execute(str(proposal.index.create_sql(proposal.model, editor)))
+
+
+def build_migrations(proposals, name="advised_indexes") -> list:
+    """
+    По миграции AddIndex на приложение, после текущих листовых миграций.
+    """
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    writers = []
+    by_app = {}
+    for proposal in proposals:
+        by_app.setdefault(proposal.model._meta.app_label, []).append(proposal)
+    for app_label, items in sorted(by_app.items()):
+        leaves = loader.graph.leaf_nodes(app_label)
+        number = max((MigrationAutodetector.parse_number(leaf) or 0 for _, leaf in leaves), default=0) + 1
+        migration = Migration(f"{number:04d}_{name}", app_label)
+        migration.dependencies = leaves
+        migration.operations = [
+            AddIndex(model_name=proposal.model._meta.model_name, index=proposal.index)
+            for proposal in items
+        ]
+        writers.append(MigrationWriter(migration))
+    return writers
+
+
+def write_migration(writer: MigrationWriter) -> Path:
+    path = Path(writer.path)
+    path.write_text(writer.as_string())
+    return path
@@ -0,0 +1,250 @@
+"""
+Фоновые задачи импорта и экспорта CSV.
+
+Очередь хранится в таблице :model:`shopapp.Job`, задачи выполняет
+команда ``manage.py run_jobs``. Внешний брокер не нужен.
+
+Пока задача выполняется, воркер раз в JOB_HEARTBEAT_INTERVAL секунд
+отмечает heartbeat_at. Задачу, отметка которой старше JOB_HEARTBEAT_TIMEOUT
+(воркер упал), claim_next_job возвращает в очередь: экспорт начинается
+заново, импорт продолжается с первой необработанной строки -- прогресс
+записывается в одной транзакции с порцией.
+"""
+import csv
+import logging
+from datetime import timedelta
+from io import TextIOWrapper
+from tempfile import TemporaryFile
+from threading import Event, Thread
+
+from django.apps import apps
+from django.core.files import File
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from mysite.replica import tracking_writes
+
+from .common import save_csv_products, save_csv_orders
+from .exporting import collect_pk_ranges, count_pk_ranges, export_csv
+from .models import Job
+
+log = logging.getLogger(__name__)
+
+JOB_ERRORS_LIMIT = 1000
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_HEARTBEAT_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_import(kind, uploaded_file, user) -> Job:
+    job = Job(kind=kind, created_by=user)
+    job.source.save(uploaded_file.name, uploaded_file, save=False)
+    job.save()
+    return job
+
+
+def enqueue_export(model, user, pks=None, filters=None, fields=None, processes=None, compress=False) -> Job:
+    """
+    Ставит экспорт в очередь. Выборка хранится в params как JSON:
+    pks -- отмеченные строки, filters -- параметры списка админки
+    (фильтры, поиск) для "выбрать все". Сами строки собирает воркер,
+    а не запрос админки.
+    """
+    params = {
+        "model": model._meta.label,
+        "fields": fields,
+        "processes": processes,
+        "compress": compress,
+    }
+    if pks is not None:
+        params["pks"] = list(pks)
+    else:
+        params["filters"] = filters or {}
+    return Job.objects.create(kind=Job.KIND_EXPORT_CSV, created_by=user, params=params)
+
+
+def changelist_queryset(model, filters: dict, user) -> QuerySet:
+    """
+    Выборка списка админки model с параметрами filters, как её видит user.
+    """
+    from django.contrib import admin
+
+    request = HttpRequest()
+    request.GET = QueryDict(mutable=True)
+    for key, values in filters.items():
+        request.GET.setlist(key, values)
+    request.user = user
+    model_admin = admin.site._registry[model]
+    return model_admin.get_changelist_instance(request).get_queryset(request)
+
+
+def export_queryset(job: Job, model) -> QuerySet:
+    if "pks" in job.params:
+        return model.objects.filter(pk__in=job.params["pks"])
+    if "filters" in job.params:
+        return changelist_queryset(model, job.params["filters"], job.created_by)
+    raise ValueError("Export job has no selection")
+
+
+def requeue_stale_jobs() -> int:
+    return Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        heartbeat_at__lt=timezone.now() - JOB_HEARTBEAT_TIMEOUT
+    ).update(status=Job.STATUS_QUEUED, started_at=None, heartbeat_at=None)
+
+
+def claim_next_job():
+    """
+    Забирает самую старую задачу из очереди, вернув в неё
+    задачи упавших воркеров.
+
+    Статус меняется условным UPDATE, поэтому несколько воркеров
+    не возьмут одну и ту же задачу.
+    """
+    requeue_stale_jobs()
+    queued = Job.objects.filter(status=Job.STATUS_QUEUED).order_by("pk")
+    for pk in queued.values_list("pk", flat=True)[:10]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+class Heartbeat(Thread):
+    """
+    Отмечает heartbeat_at задачи, пока она выполняется: части экспорта
+    и порции импорта могут идти дольше JOB_HEARTBEAT_TIMEOUT.
+    """
+    def __init__(self, job: Job, interval=JOB_HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = Event()
+
+    def beat(self):
+        try:
+            Job.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+        except DatabaseError:
+            # пропущенная отметка не страшна, а остановившийся поток отдал бы
+            # задачу второму воркеру, пока эта ещё выполняется
+            log.warning("Heartbeat of job #%s failed", self.job.pk, exc_info=True)
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                self.beat()
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job: Job):
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        # запись задачи отмечается для реплики один раз, а не на каждое обновление прогресса
+        with tracking_writes():
+            try:
+                JOB_RUNNERS[job.kind](job)
+            except Exception as error:
+                log.exception("Job #%s failed", job.pk)
+                job.status = Job.STATUS_FAILED
+                job.message = str(error)
+            else:
+                job.status = Job.STATUS_DONE
+            job.finished_at = timezone.now()
+            job.save()
+    finally:
+        heartbeat.stop()
+
+
+def update_progress(job: Job, processed_rows, **fields):
+    job.processed_rows = processed_rows
+    for field, value in fields.items():
+        setattr(job, field, value)
+    Job.objects.filter(pk=job.pk).update(processed_rows=processed_rows, **fields)
+
+
+def count_csv_rows(file, encoding="UTF-8"):
+    csv_file = TextIOWrapper(file, encoding)
+    count = sum(1 for row in csv.reader(csv_file)) - 1
+    csv_file.detach()
+    file.seek(0)
+    return max(count, 0)
+
+
+def run_import(job: Job, import_csv, **kwargs):
+    # задача, возвращённая в очередь, продолжается после уже сохранённых порций
+    start = job.processed_rows
+    errors = list(job.errors) if start else []
+    with job.source.open("rb") as file:
+        job.total_rows = count_csv_rows(file)
+        job.save(update_fields=["total_rows"])
+        report = import_csv(
+            file,
+            encoding="UTF-8",
+            start=start,
+            on_chunk=lambda report: update_progress(
+                job, start + report.processed, errors=(errors + report.errors)[:JOB_ERRORS_LIMIT]
+            ),
+            **kwargs
+        )
+    job.processed_rows = start + report.processed
+    job.errors = (errors + report.errors)[:JOB_ERRORS_LIMIT]
+    job.message = f"{report}, resumed after {start} rows" if start else str(report)
+
+
+def run_import_products(job: Job):
+    if job.created_by is None:
+        raise ValueError("Products import needs a user to set created_by")
+    run_import(job, save_csv_products, created_by=job.created_by)
+
+
+def run_import_orders(job: Job):
+    run_import(job, save_csv_orders)
+
+
+def run_export_csv(job: Job):
+    model = apps.get_model(job.params["model"])
+    compress = job.params.get("compress", False)
+    # имя не угадать по номеру задачи; файл отдаёт JobAdmin.result с проверкой прав
+    filename = f"{model._meta.model_name}-export-{get_random_string(16)}.csv"
+    if compress:
+        filename += ".gz"
+    if "pk_ranges" in job.params:
+        # задача поставлена в очередь до того, как выборку стал собирать воркер
+        pk_ranges = job.params["pk_ranges"]
+    else:
+        pk_ranges = collect_pk_ranges(export_queryset(job, model))
+    job.total_rows = count_pk_ranges(pk_ranges)
+    update_progress(job, 0, total_rows=job.total_rows)
+    with TemporaryFile("w+b") as file:
+        stats = export_csv(
+            model,
+            pk_ranges,
+            file,
+            fields=job.params.get("fields"),
+            processes=job.params.get("processes"),
+            compress=compress,
+            on_part=lambda rows: update_progress(job, rows)
+        )
+        file.seek(0)
+        job.result.save(filename, File(file), save=False)
+    job.processed_rows = stats.rows
+    job.message = str(stats)
+
+
+JOB_RUNNERS = {
+    Job.KIND_IMPORT_PRODUCTS: run_import_products,
+    Job.KIND_IMPORT_ORDERS: run_import_orders,
+    Job.KIND_EXPORT_CSV: run_export_csv,
+}
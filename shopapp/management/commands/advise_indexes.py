@@ -0,0 +1,165 @@
+from datetime import timedelta
+from random import Random
+
+from blogapp.models import RSSArticle
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.utils import timezone, translation
+from shopapp.index_advisor import (advised_paths, build_migrations, capture_selects, create_indexes, explain,
+                                   is_covered, is_improved, plan_problems, project_models, propose, time_query,
+                                   write_migration)
+from shopapp.models import Order, Product
+
+SKIPPED_MIDDLEWARE = (
+    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "requestdataapp.middlewares.ThrottlingMiddleware",
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Replays main pages, explains their queries and proposes indexes
+    """
+    help = "EXPLAIN the queries of main views and API, propose indexes as migrations " \
+           "(seeded rows and trial indexes are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000, help="Seed this many products")
+        parser.add_argument("--orders", type=int, default=2000, help="Seed this many orders")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--write", action="store_true", help="Write proposed migrations to the apps")
+
+    def seed(self, products, orders):
+        random = Random(0)
+        user = User.objects.create(username="index-advisor", is_staff=True, is_superuser=True)
+        buyers = User.objects.bulk_create(User(username=f"index-advisor-{number}") for number in range(10))
+        seeded = Product.objects.bulk_create(
+            (
+                Product(
+                    name=f"{random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')} seeded product {number}",
+                    description="Seeded by advise_indexes",
+                    price=random.randrange(1, 100000),
+                    archived=number % 10 == 0,
+                    created_by=user,
+                )
+                for number in range(products)
+            ),
+            batch_size=1000
+        )
+        seeded_orders = Order.objects.bulk_create(
+            (
+                Order(delivery_address=f"Seeded street {number}", user=user if number % 5 == 0 else buyers[number % 10])
+                for number in range(orders)
+            ),
+            batch_size=1000
+        )
+        if seeded:
+            Order.products.through.objects.bulk_create(
+                (
+                    Order.products.through(order_id=order.pk, product_id=product.pk)
+                    for order in seeded_orders
+                    for product in random.sample(seeded, min(3, len(seeded)))
+                ),
+                batch_size=1000
+            )
+        now = timezone.now()
+        RSSArticle.objects.bulk_create(
+            (
+                RSSArticle(
+                    title=f"Seeded article {number}",
+                    body="Seeded by advise_indexes",
+                    published_at=now - timedelta(minutes=number) if number % 4 else None
+                )
+                for number in range(products // 10)
+            ),
+            batch_size=1000
+        )
+        return user
+
+    def handle(self, *args, **options):
+        self.stdout.write("Start index advisor")
+        proposals = {}
+        try:
+            with transaction.atomic():
+                user = self.seed(options["products"], options["orders"])
+                client = Client(raise_request_exception=False)
+                client.force_login(user)
+                with override_settings(
+                    ALLOWED_HOSTS=["testserver"],
+                    MIDDLEWARE=[name for name in settings.MIDDLEWARE if name not in SKIPPED_MIDDLEWARE],
+                    # пустой кэш, чтобы кэшируемые списки действительно читали базу
+                    CACHES={"default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                        "LOCATION": "index-advisor"
+                    }},
+                ), translation.override(settings.LANGUAGE_CODE):
+                    queries = capture_selects(client, advised_paths(user))
+
+                models = project_models()
+                flagged = []
+                for query in queries:
+                    query.plan = explain(query)
+                    query.problems = plan_problems(query.plan)
+                    if not query.problems:
+                        continue
+                    flagged.append(query)
+                    query.proposals = [proposals.setdefault(proposal.key, proposal)
+                                       for proposal in propose(query, models)]
+                proposals = {key: proposal for key, proposal in proposals.items() if not is_covered(proposal)}
+                for query in flagged:
+                    query.proposals = [proposal for proposal in query.proposals if proposal.key in proposals]
+
+                for query in flagged:
+                    query.before = time_query(query, options["repeat"])
+                create_indexes(proposals.values())
+                for query in flagged:
+                    query.after = time_query(query, options["repeat"])
+                    query.plan_after = explain(query)
+                self.report(queries, flagged)
+                # в миграцию идут только индексы, которые изменили план хотя бы одного запроса
+                useful = {proposal.key for query in flagged if is_improved(query) for proposal in query.proposals}
+                for key, proposal in list(proposals.items()):
+                    if key not in useful:
+                        self.stdout.write(f"Rejected, no plan changed: {proposal}")
+                        del proposals[key]
+                raise Rollback
+        except Rollback:
+            pass
+
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS("No indexes to propose"))
+            return
+        self.stdout.write("Proposed indexes (add them to Meta.indexes as well):")
+        for proposal in proposals.values():
+            self.stdout.write(f"  {proposal}")
+        for writer in build_migrations(proposals.values()):
+            if options["write"]:
+                self.stdout.write(self.style.SUCCESS(f"Written {write_migration(writer)}"))
+            else:
+                self.stdout.write(f"# {writer.path}")
+                self.stdout.write(writer.as_string())
+        self.stdout.write("Done")
+
+    def report(self, queries, flagged):
+        self.stdout.write(f"Replayed {len({query.path for query in queries})} pages, "
+                          f"{len(queries)} distinct queries, {len(flagged)} flagged")
+        for query in flagged:
+            problems = ", ".join(sorted({f"{problem} {table or ''}".strip() for problem, table in query.problems}))
+            remaining = plan_problems(query.plan_after)
+            self.stdout.write(f"[{problems}] {query.path}")
+            self.stdout.write(f"    {query.sql[:160]}{'...' if len(query.sql) > 160 else ''}")
+            self.stdout.write(f"    plan: {'; '.join(query.plan)}")
+            for proposal in query.proposals:
+                self.stdout.write(f"    proposed: {proposal}")
+            if remaining:
+                outcome = "plan improved" if is_improved(query) else "plan unchanged"
+            else:
+                outcome = "plan fixed"
+            self.stdout.write(f"    {query.before * 1000:.2f} ms -> {query.after * 1000:.2f} ms ({outcome})")
@@ -1,5 +1,5 @@
 from django.core.management import BaseCommand
-from django.db.models import Avg, Max, Min, Count, Sum
+from django.db.models import Avg, Max, Min, Count
 from shopapp.models import Product, Order
 from django.contrib.auth.models import User
 #from typing import Sequence
@@ -15,10 +15,9 @@ class Command(BaseCommand):
             count=Count("id")
         )
         print(result)
-        orders = Order.objects.annotate(
-            total=Sum("products__price", default=0),
-            products_count=Count("products")
-        )
+        # итоги хранятся в заказе, соединять с товарами не нужно
+        orders = Order.objects.only("items_count", "subtotal", "discounted_total")
         for order in orders:
-            print(f"Order #{order.id} with {order.products_count} products worth {order.total}")
+            print(f"Order #{order.id} with {order.items_count} products worth {order.subtotal} "
+                  f"({order.discounted_total} with discounts)")
         self.stdout.write("Done")
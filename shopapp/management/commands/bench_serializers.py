@@ -0,0 +1,76 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from shopapp.fast_serializers import FastSerializer
+from shopapp.models import Product
+from shopapp.serializers import ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compares ProductSerializer with FastSerializer on a product list
+    """
+    help = "Benchmark ProductSerializer vs FastSerializer (test rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def measure(self, render, repeat):
+        best = None
+        body = None
+        for _ in range(repeat):
+            started = default_timer()
+            body = render()
+            elapsed = default_timer() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, body
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        request = RequestFactory().get("/api/products/", HTTP_HOST="127.0.0.1")
+        context = {"request": request}
+        renderer = JSONRenderer()
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username="bench-serializers")
+                Product.objects.bulk_create(
+                    Product(
+                        name=f"Bench product {number}",
+                        description="Benchmark product",
+                        price=number % 1000,
+                        discount=number % 50,
+                        created_by=user,
+                        preview=f"products/bench/{number}.png" if number % 2 else None,
+                    )
+                    for number in range(rows)
+                )
+                queryset = Product.objects.filter(created_by=user)
+
+                slow, slow_body = self.measure(
+                    lambda: renderer.render(ProductSerializer(queryset, many=True, context=context).data),
+                    options["repeat"]
+                )
+                fast_serializer = FastSerializer(ProductSerializer, context=context)
+                fast, fast_body = self.measure(
+                    lambda: renderer.render(fast_serializer.encode(fast_serializer.values(queryset))),
+                    options["repeat"]
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"ProductSerializer: {slow * 1000:.1f} ms for {rows} rows")
+        self.stdout.write(f"FastSerializer:    {fast * 1000:.1f} ms for {rows} rows")
+        if slow_body != fast_body:
+            self.stderr.write("Outputs differ")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Identical output, {slow / fast:.1f}x faster"))
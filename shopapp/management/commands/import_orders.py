@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+from mysite.replica import tracking_writes
+from shopapp.common import save_csv_orders, IMPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Imports orders from CSV file
+    """
+    help = "Import orders from CSV file (delivery_address,promocode,user,products)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file")
+        parser.add_argument("--encoding", default="UTF-8")
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+
+    @tracking_writes()
+    def handle(self, *args, **options):
+        self.stdout.write(f"Start import orders from {options['csv_file']}")
+        with open(options["csv_file"], "rb") as file:
+            report = save_csv_orders(
+                file,
+                encoding=options["encoding"],
+                chunk_size=options["chunk_size"]
+            )
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+        self.stdout.write(self.style.SUCCESS(f"Done: {report}"))
@@ -0,0 +1,24 @@
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+from mysite.replica import tracking_writes
+from shopapp.models import DailySales, ProductSales, UserSales
+from shopapp.reports import rebuild_sales
+
+
+class Command(BaseCommand):
+    """
+    Recomputes sales summary tables from orders
+    """
+    help = "Rebuild daily, per-product and per-user sales summaries from scratch"
+
+    @tracking_writes()
+    def handle(self, *args, **options):
+        self.stdout.write("Start rebuilding sales summaries")
+        started = default_timer()
+        rebuild_sales()
+        self.stdout.write(
+            f"{DailySales.objects.count()} days, {ProductSales.objects.count()} products, "
+            f"{UserSales.objects.count()} users in {default_timer() - started:.2f}s"
+        )
+        self.stdout.write("Done")
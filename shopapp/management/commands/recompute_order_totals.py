@@ -0,0 +1,27 @@
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+from mysite.replica import tracking_writes
+from shopapp.models import Order
+from shopapp.order_totals import TOTALS_BATCH_SIZE, recompute_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Recomputes stored order totals from products and their prices
+    """
+    help = "Recompute items_count, subtotal and discounted_total of orders " \
+           "(needed after changes that bypass signals, e.g. queryset.update() of prices)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("orders", nargs="*", type=int, help="Order ids (default: all orders)")
+        parser.add_argument("--batch-size", type=int, default=TOTALS_BATCH_SIZE)
+
+    @tracking_writes()
+    def handle(self, *args, **options):
+        self.stdout.write("Start recomputing order totals")
+        started = default_timer()
+        changed = recompute_order_totals(options["orders"] or None, batch_size=options["batch_size"])
+        total = Order.objects.filter(pk__in=options["orders"]).count() if options["orders"] else Order.objects.count()
+        self.stdout.write(f"{changed} of {total} orders changed in {default_timer() - started:.2f}s")
+        self.stdout.write("Done")
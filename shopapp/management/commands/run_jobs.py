@@ -0,0 +1,29 @@
+from time import sleep
+
+from django.core.management import BaseCommand
+from shopapp.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    """
+    Runs queued import/export jobs
+    """
+    help = "Process queued CSV import/export jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Start jobs worker")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    break
+                sleep(options["poll_interval"])
+                continue
+            self.stdout.write(f"Running {job}")
+            run_job(job)
+            self.stdout.write(f"{job}: {job.message}")
+        self.stdout.write("Done")
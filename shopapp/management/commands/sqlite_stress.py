@@ -0,0 +1,150 @@
+import multiprocessing
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+from django.core.management import BaseCommand
+
+PROFILES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "OPTIONS": {}},
+    "tuned": {"ENGINE": "mysite.sqlite_backend", "OPTIONS": {}},
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def read_once(connection, pk):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT SUM(value) FROM stress WHERE id BETWEEN %s AND %s", [pk, pk + 100])
+        cursor.fetchone()
+
+
+def write_once(connection, pk):
+    # транзакция открывается так же, как в transaction.atomic()
+    connection.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT value FROM stress WHERE id = %s", [pk])
+            value = cursor.fetchone()[0]
+            cursor.execute("UPDATE stress SET value = %s WHERE id = %s", [value + 1, pk])
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.set_autocommit(True)
+
+
+def run_worker(role, profile, name, rows, seconds, barrier, results):
+    """
+    Процесс-воркер: читатель считает суммы по диапазонам, писатель в
+    транзакции читает строку и обновляет её -- как save() после get().
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from django.db import OperationalError
+    from django.db.utils import ConnectionHandler
+
+    connection = ConnectionHandler({"default": {**PROFILES[profile], "NAME": name}})["default"]
+    connection.ensure_connection()
+    operation = read_once if role == "reader" else write_once
+    ops = 0
+    locked = 0
+    latencies = []
+    barrier.wait()
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        started = monotonic()
+        try:
+            operation(connection, (ops + locked) * 7919 % rows + 1)
+        except OperationalError:
+            # "database is locked"
+            locked += 1
+            continue
+        ops += 1
+        latencies.append(monotonic() - started)
+    connection.close()
+    results.put((role, ops, locked, latencies))
+
+
+class Command(BaseCommand):
+    """
+    Runs reader and writer processes against a scratch SQLite file
+    with the stock backend and with mysite.sqlite_backend
+    """
+    help = "Compare read throughput and write locking of SQLite profiles under several processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+                            help="Profile to run (default: all)")
+
+    def prepare(self, path, rows):
+        with closing(sqlite3.connect(path)) as db:
+            db.execute("CREATE TABLE stress (id INTEGER PRIMARY KEY, value INTEGER NOT NULL, payload TEXT NOT NULL)")
+            db.executemany(
+                "INSERT INTO stress (value, payload) VALUES (?, ?)",
+                ((number, "x" * 200) for number in range(rows))
+            )
+            db.commit()
+
+    def run_profile(self, profile, directory, options):
+        name = str(Path(directory) / f"{profile}.sqlite3")
+        self.prepare(name, options["rows"])
+        # spawn: у воркера не должно быть унаследованных соединений SQLite
+        context = multiprocessing.get_context("spawn")
+        roles = ["reader"] * options["readers"] + ["writer"] * options["writers"]
+        barrier = context.Barrier(len(roles))
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=run_worker,
+                args=(role, profile, name, options["rows"], options["seconds"], barrier, results)
+            )
+            for role in roles
+        ]
+        for process in processes:
+            process.start()
+        # запас на запуск Django в каждом процессе и на ожидание блокировок
+        collected = [results.get(timeout=options["seconds"] + 120) for _ in processes]
+        for process in processes:
+            process.join()
+
+        summary = {"locked": sum(result[2] for result in collected)}
+        for role in ("reader", "writer"):
+            done = [result for result in collected if result[0] == role]
+            latencies = [latency for result in done for latency in result[3]]
+            summary[role] = {
+                "per_second": sum(result[1] for result in done) / options["seconds"],
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "max_ms": max(latencies, default=0) * 1000,
+            }
+        return summary
+
+    def handle(self, *args, **options):
+        profiles = options["profile"] or list(PROFILES)
+        self.stdout.write(f"{options['readers']} readers, {options['writers']} writers, "
+                          f"{options['seconds']:g}s per profile")
+        self.stdout.write(f"{'profile':<8} {'reads/s':>9} {'writes/s':>9} {'locked':>7} "
+                          f"{'write p95':>10} {'write max':>10}")
+        with TemporaryDirectory() as directory:
+            for profile in profiles:
+                summary = self.run_profile(profile, directory, options)
+                reader, writer = summary["reader"], summary["writer"]
+                self.stdout.write(
+                    f"{profile:<8} {reader['per_second']:>9.0f} {writer['per_second']:>9.0f} "
+                    f"{summary['locked']:>7} {writer['p95_ms']:>8.1f}ms {writer['max_ms']:>8.1f}ms"
+                )
+        self.stdout.write("Done")
@@ -0,0 +1,57 @@
+import sqlite3
+from contextlib import closing
+from time import sleep, time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from mysite.replica import REPLICA, mark_synced
+
+
+class Command(BaseCommand):
+    """
+    Copies the primary SQLite database into the replica file
+    with the SQLite online backup API
+    """
+    help = "Refresh the local SQLite replica from the default database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Repeat every INTERVAL seconds (default: sync once)")
+        parser.add_argument("--target", help="Copy into this file instead of the replica database")
+
+    def get_target(self, options) -> str:
+        if options["target"]:
+            return options["target"]
+        if REPLICA not in connections.settings:
+            raise CommandError(f"No {REPLICA!r} database is configured")
+        replica = connections[REPLICA]
+        if replica.vendor != "sqlite":
+            raise CommandError(f"The {REPLICA!r} database is not SQLite, it has to be synced by the database itself")
+        return str(replica.settings_dict["NAME"])
+
+    def sync(self, target: str):
+        primary = connections[DEFAULT_DB_ALIAS]
+        started = time()
+        primary.ensure_connection()
+        # копия за один шаг: читающая транзакция держит согласованный снимок,
+        # писатели в WAL её не ждут; читатели реплики ждут по busy timeout
+        with closing(sqlite3.connect(target, timeout=30)) as replica:
+            primary.connection.backup(replica)
+        return started
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("The default database is not SQLite")
+        target = self.get_target(options)
+        if target == str(primary.settings_dict["NAME"]):
+            raise CommandError("The replica and the default database are the same file")
+        while True:
+            started = self.sync(target)
+            if not options["target"]:
+                mark_synced(started)
+            self.stdout.write(f"Synced {target} in {(time() - started) * 1000:.0f} ms")
+            if not options["interval"]:
+                break
+            sleep(options["interval"])
+        self.stdout.write("Done")
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:46
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+
+
+def fill_totals(apps, schema_editor):
+    # то же, что shopapp.order_totals, но на исторических моделях
+    Order = apps.get_model("shopapp", "Order")
+    rows = Order.objects.using(schema_editor.connection.alias).order_by().values("pk").annotate(
+        items=Count("products"),
+        prices=Sum("products__price", default=0),
+        cents=Sum(F("products__price") * (100 - F("products__discount")), default=0,
+                  output_field=DecimalField(max_digits=18, decimal_places=0))
+    )
+    Order.objects.using(schema_editor.connection.alias).bulk_update(
+        [
+            Order(pk=row["pk"], items_count=row["items"], subtotal=row["prices"], discounted_total=row["cents"] / 100)
+            for row in rows
+        ],
+        ["items_count", "subtotal", "discounted_total"],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0018_sales_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=0, default=0, editable=False, max_digits=14),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,235 @@
+"""
+Примеси для наборов представлений DRF интернет-магазина.
+"""
+from itertools import islice
+from timeit import default_timer
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import translation
+from mysite.replica import reading_replica, replica_response
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .caching import get_generation, hashed_key, record_cache_access
+from .conditional import conditional_response
+from .fast_serializers import FastSerializer
+from .query_plan import plan_for_serializer
+from .serializers import sparse_serializer
+from .streaming import EXPORT_CHUNK_SIZE, StreamingJSONResponse, compress_export_response
+
+CACHED_ENDPOINTS = set()
+
+
+class CompressedExportMixin:
+    """
+    Сжимает ответы действий из compressed_actions (см. compress_export_response).
+    """
+    compressed_actions = ()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action not in self.compressed_actions:
+            return response
+        if not response.streaming and hasattr(response, "render"):
+            response.render()
+        return compress_export_response(request, response)
+
+
+class ReplicaReadMixin:
+    """
+    Действия из replica_actions читают с реплики (см. mysite.replica).
+
+    replica_actions -- словарь действие -> допустимое отставание в секундах,
+    None -- REPLICA_MAX_LAG. Ответы, которые кэшируются по поколению
+    модели, читают только с догнавшей реплики (0), иначе в кэш под новым
+    поколением попали бы старые данные.
+    """
+    replica_actions = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        action = (self.action_map or {}).get(request.method.lower())
+        if action not in self.replica_actions:
+            return super().dispatch(request, *args, **kwargs)
+        with reading_replica(self.replica_actions[action]) as state:
+            return replica_response(super().dispatch(request, *args, **kwargs), state)
+
+
+class ConditionalGetMixin:
+    """
+    304 для list() и retrieve(), если валидаторы совпали с заголовками
+    запроса; ни queryset, ни сериализатор при этом не задействуются.
+
+    get_list_validators() и get_object_validators() возвращают пару
+    (etag, last_modified), любой из элементов может быть None.
+    """
+    def get_list_validators(self, request):
+        return None, None
+
+    def get_object_validators(self, request):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+            *self.get_list_validators(request)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+            *self.get_object_validators(request)
+        )
+
+
+class CachedListMixin:
+    """
+    Кэш результатов list() с ключом по нормализованным параметрам запроса.
+
+    В ключ входят поколение cache_tag (любая запись модели его меняет),
+    параметры фильтрации, поиска, сортировки и страницы, язык,
+    факт аутентификации, хост и формат ответа. Попадания и задержки
+    пишутся в статистику под именем cache_endpoint.
+    """
+    cache_tag = None
+    cache_endpoint = None
+    cache_timeout = 60 * 60
+    cache_query_params = ("search", "ordering", "cursor", "page", "page_size", "fields", "expand")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.cache_endpoint:
+            CACHED_ENDPOINTS.add(cls.cache_endpoint)
+
+    def get_list_cache_key(self, request):
+        names = set(self.cache_query_params) | set(getattr(self, "filterset_fields", ()))
+        params = sorted(
+            (name, tuple(sorted(value.strip() for value in request.query_params.getlist(name) if value.strip())))
+            for name in names
+            if any(value.strip() for value in request.query_params.getlist(name))
+        )
+        return "shop:list:{}:{}:{}".format(
+            self.cache_endpoint,
+            get_generation(self.cache_tag),
+            hashed_key(
+                params,
+                translation.get_language(),
+                request.user.is_authenticated,
+                request.get_host(),
+                request.scheme,
+                request.accepted_renderer.format,
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        started = default_timer()
+        cache_key = self.get_list_cache_key(request)
+        data = cache.get(cache_key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            cache.set(cache_key, response.data, self.cache_timeout)
+        else:
+            response = Response(data)
+        record_cache_access(self.cache_endpoint, data is not None, default_timer() - started)
+        return response
+
+
+class QueryPlanMixin:
+    """
+    Подстраивает queryset под сериализатор: select_related, prefetch_related
+    и only() выводятся из его полей (см. query_plan).
+
+    Применяется только к читающим запросам: экземпляр, загруженный через
+    only(), при save() не обновил бы отложенные поля (например, updated_at).
+    """
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return queryset
+        return plan_for_serializer(self.get_serializer_class()).apply(queryset)
+
+
+class FastListMixin:
+    """
+    list() через FastSerializer: строки queryset.values() кодируются
+    без создания экземпляров моделей, ответ совпадает с обычным.
+
+    Отключается атрибутом fast_list = False.
+    """
+    fast_list = True
+
+    def get_fast_serializer(self):
+        return FastSerializer(self.get_serializer_class(), context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_fast_serializer()
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.encode(page))
+        return Response(serializer.encode(queryset))
+
+
+class StreamingJSONMixin:
+    """
+    streaming_response(queryset) отдаёт весь queryset JSON-массивом без
+    пагинации: строки читаются и кодируются порциями по stream_chunk_size,
+    в памяти одновременно только одна порция.
+
+    Сериализатор, который не поддерживает FastSerializer, применяется
+    к экземплярам по одному.
+    """
+    stream_chunk_size = EXPORT_CHUNK_SIZE
+
+    def iter_serialized(self, queryset):
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        try:
+            fast_serializer = FastSerializer(serializer_class, context=context)
+        except ImproperlyConfigured:
+            serializer = serializer_class(context=context)
+            for instance in queryset.iterator(chunk_size=self.stream_chunk_size):
+                yield serializer.to_representation(instance)
+            return
+        rows = fast_serializer.values(queryset).iterator(chunk_size=self.stream_chunk_size)
+        while chunk := list(islice(rows, self.stream_chunk_size)):
+            yield from fast_serializer.encode(chunk)
+
+    def streaming_response(self, queryset, filename=None):
+        response = StreamingJSONResponse(self.iter_serialized(queryset))
+        if filename is not None:
+            response["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=pk,name оставляет в ответе только перечисленные поля,
+    ?expand=products раскрывает связи из Meta.expandable сериализатора.
+
+    Работает на уровне класса сериализатора (см. sparse_serializer),
+    поэтому вместе с ответом сужается и запрос: QueryPlanMixin и
+    FastListMixin видят уже урезанный набор полей.
+    """
+    fields_query_param = "fields"
+    expand_query_param = "expand"
+
+    def get_query_list(self, name):
+        value = self.request.query_params.get(name, "")
+        return tuple(dict.fromkeys(item.strip() for item in value.split(",") if item.strip()))
+
+    def get_sparse_serializer_class(self, serializer_class):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return serializer_class
+        fields = self.get_query_list(self.fields_query_param)
+        expand = self.get_query_list(self.expand_query_param)
+        if not fields and not expand:
+            return serializer_class
+        return sparse_serializer(serializer_class, tuple(sorted(fields)) or None, tuple(sorted(expand)))
+
+    def get_serializer_class(self):
+        return self.get_sparse_serializer_class(super().get_serializer_class())
@@ -10,24 +10,53 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
     )
 
 
+class LiveProductManager(models.Manager):
+    """
+    Только неархивные товары: витрина, ленты, карта сайта.
+
+    Условие совпадает с условием частичных индексов Product, поэтому
+    стоимость запросов зависит от размера живого каталога, а не от
+    числа архивных товаров.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(archived=False)
+
+
 class Product(models.Model):
     """
     Модель Product представляет товар,
     который можно продавать в интернет-магазине.
 
+    Product.objects -- все товары, включая архивные (админка, API,
+    выгрузки, товары заказов); Product.live -- только продающиеся.
+
     Заказы тут: :model:`shopapp.Order`
     """
     class Meta:
         ordering = ["name", "price"]
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
+        indexes = [
+            # список товаров: WHERE NOT archived ORDER BY name, price
+            models.Index(fields=["name", "price"], condition=models.Q(archived=False),
+                         name="product_live_name_price_idx"),
+            # лента и карта сайта: WHERE NOT archived ORDER BY created_at DESC
+            models.Index(fields=["created_at"], condition=models.Q(archived=False),
+                         name="product_live_created_at_idx"),
+        ]
+
+    objects = models.Manager()
+    live = LiveProductManager()
+
     name = models.CharField(max_length=100, db_index=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     color = models.CharField(max_length=40, db_index=True)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=10000, max_digits=6, decimal_places=0)
     discount = models.PositiveSmallIntegerField(default=0)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name="products")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     archived = models.BooleanField(default=False)
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
 
@@ -44,6 +73,23 @@ class Product(models.Model):
     def __str__(self):
         return f"Product ({self.name!r}, color: {self.color})"
 
+class ProductSearchIndex(models.Model):
+    """
+    Строка FTS5-индекса товаров (миграция 0017, см. shopapp.search).
+
+    Таблицу создаёт и обновляет не Django: модель нужна только для того,
+    чтобы соединить индекс с shopapp_product одним JOIN по rowid.
+    """
+    class Meta:
+        managed = False
+        db_table = "shopapp_product_fts"
+
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid",
+                                   db_constraint=False, related_name="search_index")
+    name = models.TextField()
+    description = models.TextField()
+
+
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     return "products/product_{pk}/images/{filename}".format(
         pk=instance.product.pk,
@@ -63,7 +109,133 @@ class Order(models.Model):
         verbose_name_plural = _("Orders")
     delivery_address = models.TextField(null=False, blank=True)
     promocode = models.CharField(max_length=25)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="orders")
     products = models.ManyToManyField(Product, related_name="orders")
     receipt = models.FileField(null=True, upload_to='orders/receipts/')
+    # итоги по товарам заказа, поддерживаются shopapp.order_totals
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+    subtotal = models.DecimalField(default=0, max_digits=14, decimal_places=0, editable=False)
+    discounted_total = models.DecimalField(default=0, max_digits=16, decimal_places=2, editable=False)
+
+    TOTALS_FIELDS = ("items_count", "subtotal", "discounted_total")
+
+    def save(self, *args, **kwargs):
+        """
+        Итоги пишет только shopapp.order_totals (bulk_update), обычный
+        save() существующего заказа их не трогает: в экземпляре они могли
+        устареть, пока товары заказа менялись.
+        """
+        if not self._state.adding and not kwargs.get("force_insert"):
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs["update_fields"] = [name for name in update_fields if name not in self.TOTALS_FIELDS]
+        super().save(*args, **kwargs)
+
+
+class DailySales(models.Model):
+    """
+    Сводка продаж за день: заказы, позиции и выручка.
+
+    Поддерживается модулем shopapp.reports, руками не редактируется.
+    """
+    class Meta:
+        ordering = ["-date"]
+        verbose_name = _("Daily sales")
+        verbose_name_plural = _("Daily sales")
+
+    date = models.DateField(unique=True)
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=0)
+
+
+class ProductSales(models.Model):
+    """
+    Сводка продаж товара: в скольких заказах он есть и на какую сумму.
+    """
+    class Meta:
+        ordering = ["-revenue"]
+        verbose_name = _("Product sales")
+        verbose_name_plural = _("Product sales")
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="sales")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=0)
+
+
+class UserSales(models.Model):
+    """
+    Сводка заказов покупателя.
+    """
+    class Meta:
+        ordering = ["-orders_count"]
+        verbose_name = _("User sales")
+        verbose_name_plural = _("User sales")
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="sales")
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=0)
+
+
+class Job(models.Model):
+    """
+    Фоновая задача импорта или экспорта CSV.
+
+    Задачи ставятся в очередь из админки и выполняются
+    командой ``manage.py run_jobs`` вне HTTP-запроса.
+    """
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = _("Job")
+        verbose_name_plural = _("Jobs")
+
+    KIND_IMPORT_PRODUCTS = "import_products"
+    KIND_IMPORT_ORDERS = "import_orders"
+    KIND_EXPORT_CSV = "export_csv"
+    KIND_CHOICES = [
+        (KIND_IMPORT_PRODUCTS, _("Import products")),
+        (KIND_IMPORT_ORDERS, _("Import orders")),
+        (KIND_EXPORT_CSV, _("Export CSV")),
+    ]
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, _("Queued")),
+        (STATUS_RUNNING, _("Running")),
+        (STATUS_DONE, _("Done")),
+        (STATUS_FAILED, _("Failed")),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    params = models.JSONField(default=dict, blank=True)
+    source = models.FileField(null=True, blank=True, upload_to="jobs/uploads/")
+    result = models.FileField(null=True, blank=True, upload_to="jobs/exports/")
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(null=False, blank=True)
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name="jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # воркер обновляет во время работы; задачу без свежей отметки забирает другой воркер
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def progress(self):
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, self.processed_rows * 100 // self.total_rows)
+
+    def __str__(self):
+        return f"Job #{self.pk} ({self.kind}, {self.status})"
@@ -0,0 +1,112 @@
+"""
+Итоги заказа, хранимые в самом Order: число позиций (items_count),
+сумма по ценам товаров (subtotal) и сумма со скидками (discounted_total).
+
+Списки, выгрузки и сводки продаж читают их без соединения с товарами.
+Итоги пересчитываются в той же транзакции, что и изменение: сигналы
+m2m_changed Order.products, смена цены или скидки товара и его удаление
+(см. signals), массовые импорты и обновления (см. common). Изменения
+в обход сигналов (queryset.update() цен, сырой SQL) исправляет
+``manage.py recompute_order_totals``. Обычный Order.save() итоги
+не записывает (см. Order.save), поэтому устаревший экземпляр их не затрёт.
+
+Скидка товара -- в процентах. Сумма со скидкой считается в сотых долях
+рубля целыми числами, поэтому на SQLite не набегает ошибка округления.
+"""
+from django.db.models import Count, DecimalField, F, QuerySet, Sum
+from django.utils import timezone
+
+from .caching import ORDERS, bump_on_commit
+from .models import Order
+
+TOTALS_BATCH_SIZE = 500
+TOTALS_FIELDS = Order.TOTALS_FIELDS
+
+
+def computed_totals(orders: QuerySet) -> QuerySet:
+    """
+    Строки (pk, хранимые итоги, посчитанные заново) по товарам заказов.
+    """
+    return orders.order_by().values("pk", *TOTALS_FIELDS).annotate(
+        new_items_count=Count("products"),
+        new_subtotal=Sum("products__price", default=0),
+        new_discounted_cents=Sum(
+            F("products__price") * (100 - F("products__discount")),
+            default=0,
+            output_field=DecimalField(max_digits=18, decimal_places=0)
+        )
+    )
+
+
+def new_totals(row: dict) -> dict:
+    return {
+        "items_count": row["new_items_count"],
+        "subtotal": row["new_subtotal"],
+        "discounted_total": row["new_discounted_cents"] / 100,
+    }
+
+
+def is_stale(row: dict, totals: dict) -> bool:
+    return any(row[field] != value for field, value in totals.items())
+
+
+def save_totals(orders: list, batch_size=TOTALS_BATCH_SIZE):
+    # updated_at -- итоги есть в выгрузке, синхронизация с since должна их получить
+    now = timezone.now()
+    for order in orders:
+        order.updated_at = now
+    Order.objects.bulk_update(orders, [*TOTALS_FIELDS, "updated_at"], batch_size=batch_size)
+    bump_on_commit(ORDERS)
+
+
+def recompute_order_totals(orders=None, batch_size=TOTALS_BATCH_SIZE) -> int:
+    """
+    Пересчитывает итоги заказов orders (queryset или номера; None -- всех)
+    и записывает только изменившиеся. Возвращает число изменённых заказов.
+    """
+    if orders is None:
+        orders = Order.objects.all()
+    elif not isinstance(orders, QuerySet):
+        orders = set(orders)
+        if not orders:
+            return 0
+        orders = Order.objects.filter(pk__in=orders)
+
+    changed = []
+    for row in computed_totals(orders):
+        totals = new_totals(row)
+        if is_stale(row, totals):
+            changed.append(Order(pk=row["pk"], **totals))
+    if changed:
+        save_totals(changed, batch_size)
+    return len(changed)
+
+
+def refresh_order_totals(order: Order) -> bool:
+    """
+    Пересчитывает итоги одного заказа в базе и в самом экземпляре:
+    иначе следующий order.save() записал бы прежние значения.
+    """
+    row = computed_totals(Order.objects.filter(pk=order.pk)).first()
+    if row is None:
+        return False
+    totals = new_totals(row)
+    for field, value in totals.items():
+        setattr(order, field, value)
+    if not is_stale(row, totals):
+        return False
+    save_totals([order])
+    return True
+
+
+def recompute_product_orders(products) -> int:
+    """
+    Пересчитывает заказы, в которых есть товары products (номера).
+    """
+    products = set(products)
+    if not products:
+        return 0
+    return recompute_order_totals(
+        Order.objects.filter(pk__in=Order.products.through.objects.filter(product_id__in=products)
+                             .values("order_id"))
+    )
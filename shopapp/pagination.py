@@ -0,0 +1,183 @@
+"""
+Keyset-пагинация для наборов представлений магазина.
+
+В отличие от PageNumberPagination здесь нет ни COUNT(*), ни OFFSET:
+следующая страница выбирается условием "после последней строки"
+по полям сортировки с pk в конце, поэтому N-я страница стоит столько же,
+сколько первая.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по непрозрачному курсору, устойчивая к OrderingFilter.
+
+    Порядок берётся из уже отфильтрованного queryset (или Meta.ordering),
+    к нему всегда добавляется pk. Поля сортировки должны быть NOT NULL.
+    """
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor["r"])
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor["v"], reverse=self.reverse))
+        if self.reverse:
+            queryset = queryset.reverse()
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if self.reverse:
+            page.reverse()
+
+        if self.reverse:
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = page
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        """
+        Возвращает порядок вида ["-price", "pk"], где поля -- столбцы модели
+        или аннотации queryset (например, ранг поиска).
+        """
+        meta = queryset.model._meta
+        ordering = list(queryset.query.order_by or meta.ordering)
+        result = []
+        for term in ordering:
+            if not isinstance(term, str):
+                continue
+            descending = term.startswith("-")
+            name = term.lstrip("-")
+            if name == "pk" or name == meta.pk.name:
+                break
+            if name in queryset.query.annotations:
+                result.append(term)
+                continue
+            try:
+                field = meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            result.append(("-" if descending else "") + field.attname)
+        return result + ["pk"]
+
+    def after(self, values, reverse=False):
+        """
+        Условие "строго после values" для составного ключа сортировки.
+        """
+        condition = Q()
+        equal = Q()
+        for term, value in zip(self.ordering, values):
+            name = term.lstrip("-")
+            descending = term.startswith("-") != reverse
+            lookup = "lt" if descending else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def position(self, obj):
+        if isinstance(obj, dict):
+            # строки queryset.values() (см. FastListMixin)
+            return [obj[term.lstrip("-")] for term in self.ordering]
+        return [getattr(obj, term.lstrip("-")) for term in self.ordering]
+
+    def encode_cursor(self, obj, reverse):
+        raw = json.dumps(
+            {"o": self.ordering, "v": self.position(obj), "r": reverse},
+            cls=DjangoJSONEncoder
+        ).encode()
+        cursor = urlsafe_b64encode(raw).decode().rstrip("=")
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+            if cursor["o"] != self.ordering or len(cursor["v"]) != len(self.ordering):
+                raise ValueError("cursor ordering does not match")
+            model = self.model
+            cursor["v"] = [
+                model._meta.pk.to_python(value) if term == "pk"
+                else self.field_for(term).to_python(value)
+                for term, value in zip(self.ordering, cursor["v"])
+            ]
+            cursor["r"] = bool(cursor.get("r"))
+        except (BinasciiError, KeyError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def field_for(self, term):
+        name = term.lstrip("-")
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        meta = self.model._meta
+        for field in meta.concrete_fields:
+            if field.attname == name:
+                return field
+        return meta.get_field(name)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
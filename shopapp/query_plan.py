@@ -0,0 +1,124 @@
+"""
+План запроса, выведенный из полей сериализатора.
+
+По объявленным полям, их source и подсказкам для SerializerMethodField
+вычисляется, какие связи нужно подтянуть через select_related, какие
+через prefetch_related и какие столбцы достаточно загрузить через only().
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+class QueryPlan:
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = {}
+        self.only = set()
+        # only() безопасен, только если известны все читаемые атрибуты
+        self.restrict_columns = True
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*(
+                Prefetch(path, queryset=inner) if inner is not None else path
+                for path, inner in sorted(self.prefetch_related.items())
+            ))
+        if self.restrict_columns and self.only:
+            queryset = queryset.only(*sorted(self.only))
+        return queryset
+
+    def __repr__(self):
+        return (f"QueryPlan(select_related={sorted(self.select_related)}, "
+                f"prefetch_related={sorted(self.prefetch_related)}, "
+                f"only={sorted(self.only) if self.restrict_columns else None})")
+
+
+def add_path(plan: QueryPlan, model, attrs, prefix="", pk_only=False):
+    """
+    Разбирает путь атрибутов (["user", "email"]) относительно model.
+    """
+    meta = model._meta
+    name = attrs[0]
+    if name == "pk":
+        name = meta.pk.name
+    try:
+        field = meta.get_field(name)
+    except FieldDoesNotExist:
+        # свойство или метод модели: что оно читает, неизвестно
+        plan.restrict_columns = False
+        return
+    path = prefix + name
+    if not field.is_relation:
+        plan.only.add(path)
+        return
+    if field.many_to_many or field.one_to_many:
+        inner = field.related_model.objects.only("pk") if pk_only and len(attrs) == 1 else None
+        if path not in plan.prefetch_related or inner is None:
+            plan.prefetch_related[path] = inner
+        if not field.many_to_many:
+            plan.only.add(prefix + meta.pk.name)
+        return
+    if field.concrete:
+        plan.only.add(path)
+    if len(attrs) == 1:
+        return
+    if field.concrete and attrs[1] in ("pk", field.target_field.attname):
+        return
+    plan.select_related.add(path)
+    add_path(plan, field.related_model, attrs[1:], prefix=path + "__")
+
+
+def add_serializer(plan: QueryPlan, serializer, model, prefix=""):
+    method_sources = getattr(getattr(serializer, "Meta", None), "method_sources", {})
+    plan.only.add(prefix + model._meta.pk.name)
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            sources = method_sources.get(name)
+            if sources is None:
+                # без подсказки считаем, что метод читает одноимённое поле модели
+                try:
+                    model_field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    plan.restrict_columns = False
+                    continue
+                if model_field.is_relation and not (model_field.many_to_many or model_field.one_to_many):
+                    plan.select_related.add(prefix + name)
+                    plan.restrict_columns = False
+                sources = [name]
+            for source in sources:
+                add_path(plan, model, source.split("."), prefix)
+            continue
+        if field.source == "*":
+            plan.restrict_columns = False
+            continue
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if isinstance(nested, serializers.ModelSerializer):
+            add_path(plan, model, field.source_attrs, prefix)
+            related = nested.Meta.model
+            relation_prefix = prefix + "__".join(field.source_attrs) + "__"
+            if (prefix + "__".join(field.source_attrs)) in plan.prefetch_related:
+                # внутри prefetch поля вложенного сериализатора планируются отдельно
+                inner_plan = QueryPlan()
+                add_serializer(inner_plan, nested, related)
+                plan.prefetch_related[prefix + "__".join(field.source_attrs)] = inner_plan.apply(
+                    related.objects.all()
+                )
+            else:
+                add_serializer(plan, nested, related, relation_prefix)
+            continue
+        pk_only = isinstance(field, (serializers.ManyRelatedField, serializers.PrimaryKeyRelatedField))
+        add_path(plan, model, field.source_attrs, prefix, pk_only=pk_only)
+
+
+@lru_cache(maxsize=None)
+def plan_for_serializer(serializer_class) -> QueryPlan:
+    plan = QueryPlan()
+    add_serializer(plan, serializer_class(), serializer_class.Meta.model)
+    return plan
@@ -0,0 +1,151 @@
+"""
+Сводные таблицы продаж: по дням, по товарам и по покупателям.
+
+Строки сводок не пересчитываются целиком при каждом изменении:
+сигналы (см. signals) и массовые операции сообщают, какие дни, товары
+и покупатели затронуты, и после коммита refresh_sales() заново считает
+только эти строки -- по одному сгруппированному запросу на таблицу.
+Полный пересчёт -- команда ``manage.py rebuild_sales``; она нужна после
+изменений в обход сигналов (queryset.update() цен, сырой SQL) и сначала
+пересчитывает итоги заказов.
+
+Выручка, как и в команде agg, -- сумма текущих цен товаров заказа
+(хранимый Order.subtotal).
+Дни считаются в часовом поясе проекта (TIME_ZONE).
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, QuerySet, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, Product, ProductSales, UserSales
+from .order_totals import recompute_order_totals
+
+SALES_BATCH_SIZE = 1000
+
+
+def sales_day(value: datetime):
+    return timezone.localdate(value, timezone.get_default_timezone())
+
+
+def day_start(day) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_default_timezone())
+
+
+def order_keys(orders: QuerySet):
+    """
+    Дни и покупатели заказов из orders -- то, что нужно пересчитать
+    при изменении этих заказов или цен их товаров.
+    """
+    rows = (
+        orders.annotate(day=TruncDate("created_at", tzinfo=timezone.get_default_timezone()))
+        .values_list("day", "user_id")
+        .order_by()
+        .distinct()
+    )
+    days = set()
+    users = set()
+    for day, user_id in rows:
+        days.add(day)
+        users.add(user_id)
+    return days, users
+
+
+def order_totals(orders: QuerySet, *group_by) -> QuerySet:
+    # итоги хранятся в заказе (см. order_totals), соединять с товарами не нужно
+    return orders.values(*group_by).annotate(
+        orders_count=Count("pk"),
+        units=Sum("items_count", default=0),
+        revenue=Sum("subtotal", default=0)
+    ).order_by()
+
+
+def replace_rows(summaries: QuerySet, build_rows):
+    """
+    Удаляет прежние строки сводки и записывает новые, которые возвращает
+    build_rows(), в одной транзакции. Итоги читаются внутри неё: иначе из
+    двух одновременных обновлений последним могло записаться то, что
+    прочитано раньше. Дни и покупатели без заказов, товары без продаж
+    в сводку не попадают.
+    """
+    with transaction.atomic():
+        rows = build_rows()
+        summaries.delete()
+        summaries.model.objects.bulk_create(rows, batch_size=SALES_BATCH_SIZE)
+
+
+def refresh_daily_sales(days=None):
+    orders = Order.objects.all()
+    summaries = DailySales.objects.all()
+    if days is not None:
+        days = set(days)
+        if not days:
+            return
+        # диапазон по индексу created_at, лишние дни внутри него отсекаются после группировки
+        orders = orders.filter(
+            created_at__gte=day_start(min(days)),
+            created_at__lt=day_start(max(days) + timedelta(days=1))
+        )
+        summaries = summaries.filter(date__in=days)
+    totals = order_totals(
+        orders.annotate(day=TruncDate("created_at", tzinfo=timezone.get_default_timezone())), "day"
+    )
+    replace_rows(summaries, lambda: [
+        DailySales(date=row["day"], orders_count=row["orders_count"], units=row["units"], revenue=row["revenue"])
+        for row in totals
+        if days is None or row["day"] in days
+    ])
+
+
+def refresh_product_sales(products=None):
+    queryset = Product.objects.all()
+    summaries = ProductSales.objects.all()
+    if products is not None:
+        products = set(products)
+        if not products:
+            return
+        queryset = queryset.filter(pk__in=products)
+        summaries = summaries.filter(product_id__in=products)
+    # товар входит в заказ не больше одного раза, поэтому позиций столько же, сколько заказов
+    totals = queryset.annotate(units=Count("orders")).filter(units__gt=0).values_list("pk", "price", "units")
+    replace_rows(summaries, lambda: [
+        ProductSales(product_id=pk, units=units, revenue=price * units)
+        for pk, price, units in totals.order_by()
+    ])
+
+
+def refresh_user_sales(users=None):
+    orders = Order.objects.all()
+    summaries = UserSales.objects.all()
+    if users is not None:
+        users = set(users)
+        if not users:
+            return
+        orders = orders.filter(user_id__in=users)
+        summaries = summaries.filter(user_id__in=users)
+    replace_rows(summaries, lambda: [
+        UserSales(user_id=row["user_id"], orders_count=row["orders_count"], units=row["units"],
+                  revenue=row["revenue"])
+        for row in order_totals(orders, "user_id")
+    ])
+
+
+def refresh_sales(days=(), products=(), users=()):
+    refresh_daily_sales(days)
+    refresh_product_sales(products)
+    refresh_user_sales(users)
+
+
+def refresh_sales_on_commit(days=(), products=(), users=()):
+    days, products, users = set(days), set(products), set(users)
+    if days or products or users:
+        transaction.on_commit(lambda: refresh_sales(days, products, users))
+
+
+def rebuild_sales():
+    recompute_order_totals()
+    refresh_daily_sales()
+    refresh_product_sales()
+    refresh_user_sales()
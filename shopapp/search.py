@@ -0,0 +1,112 @@
+"""
+Полнотекстовый поиск товаров на SQLite FTS5.
+
+Индекс shopapp_product_fts (миграция 0017) -- внешний для shopapp_product
+и поддерживается триггерами, поэтому не зависит от того, как изменён товар:
+save(), update() или bulk_create(). Результаты ранжируются по BM25
+(совпадение в названии весит больше, чем в описании), каждое слово
+запроса ищется как префикс. Если FTS5 недоступен, фильтр ведёт себя
+как обычный SearchFilter.
+
+Индекс соединяется с товарами одним JOIN (ProductSearchIndex), в том же
+запросе строки сортируются по BM25. Подсветка и фрагмент описания дороже
+ранга, поэтому search_highlights() строит их отдельным запросом только
+для товаров отданной страницы.
+
+Префиксы из 2-3 символов проиндексированы отдельно (prefix='2 3'),
+поэтому короткие префиксы не разворачиваются в перебор всех терминов.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, CharField, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from rest_framework.filters import SearchFilter
+
+from .models import ProductSearchIndex
+
+FTS_TABLE = ProductSearchIndex._meta.db_table
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# FTS5 вставляет управляющие символы, а теги появляются уже после экранирования текста
+MARK_START = "\x02"
+MARK_END = "\x03"
+SNIPPET_TOKENS = 16
+
+re_word = re.compile(r"\w+")
+
+
+def fts_enabled(using="default") -> bool:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    enabled = getattr(connection, "_shop_fts_enabled", None)
+    if enabled is None:
+        enabled = FTS_TABLE in connection.introspection.table_names()
+        connection._shop_fts_enabled = enabled
+    return enabled
+
+
+def build_match_query(terms) -> str:
+    """
+    ["Sams", "a5"] -> '"sams"* "a5"*': все слова обязательны, каждое как префикс.
+    """
+    words = [word for term in terms for word in re_word.findall(term)]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def fts_match(match) -> RawSQL:
+    return RawSQL(f"{FTS_TABLE} MATCH %s", (match,), output_field=BooleanField())
+
+
+def full_text_search(queryset, terms):
+    """
+    Оставляет товары, подходящие под terms, добавляет аннотацию
+    search_rank (BM25, меньше -- лучше) и сортирует по ней.
+    """
+    match = build_match_query(terms)
+    if not match:
+        return queryset
+    return queryset.filter(search_index__isnull=False).filter(fts_match(match)).annotate(
+        search_rank=RawSQL(
+            f"bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT})", (), output_field=FloatField()
+        )
+    ).order_by("search_rank", "pk")
+
+
+def mark_up(text) -> str:
+    # название и описание -- пользовательский текст, HTML в ответе только <mark>
+    return escape(text).replace(MARK_START, HIGHLIGHT_START).replace(MARK_END, HIGHLIGHT_END)
+
+
+def search_highlights(terms, pks, using="default") -> dict:
+    """
+    {pk: (название с подсветкой, фрагмент описания с подсветкой)}
+    для товаров pks -- одним запросом к индексу.
+    """
+    match = build_match_query(terms)
+    if not match or not pks:
+        return {}
+    marks = f"'{MARK_START}', '{MARK_END}'"
+    rows = ProductSearchIndex.objects.using(using).filter(product_id__in=pks).filter(fts_match(match)).annotate(
+        search_name=RawSQL(f"highlight({FTS_TABLE}, 0, {marks})", (), output_field=CharField()),
+        search_snippet=RawSQL(f"snippet({FTS_TABLE}, 1, {marks}, '...', {SNIPPET_TOKENS})", (),
+                              output_field=CharField()),
+    ).values_list("product_id", "search_name", "search_snippet")
+    return {pk: (mark_up(name), mark_up(snippet)) for pk, name, snippet in rows}
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter на FTS5 для Product; без индекса -- исходный icontains.
+    """
+    def uses_full_text(self, request, queryset) -> bool:
+        return bool(build_match_query(self.get_search_terms(request))) and fts_enabled(queryset.db)
+
+    def filter_queryset(self, request, queryset, view):
+        if not self.uses_full_text(request, queryset):
+            return super().filter_queryset(request, queryset, view)
+        return full_text_search(queryset, self.get_search_terms(request))
@@ -1,6 +1,8 @@
+from functools import lru_cache
+
 from rest_framework import serializers
 
-from .models import Product, Order
+from .models import DailySales, Order, Product, ProductSales, UserSales
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,6 +18,34 @@ class ProductSerializer(serializers.ModelSerializer):
             "preview"
         )
 
+class ProductSearchSerializer(ProductSerializer):
+    """
+    Товар из полнотекстового поиска: ранг BM25 и подсветка совпадений.
+
+    Подсветку страницы представление кладёт в context["search_highlights"]
+    (см. shopapp.search.search_highlights).
+    """
+    search_rank = serializers.FloatField(read_only=True)
+    search_name = serializers.SerializerMethodField()
+    search_snippet = serializers.SerializerMethodField()
+
+    def get_search_name(self, instance):
+        return self.context.get("search_highlights", {}).get(instance.pk, ("", ""))[0]
+
+    def get_search_snippet(self, instance):
+        return self.context.get("search_highlights", {}).get(instance.pk, ("", ""))[1]
+
+    class Meta(ProductSerializer.Meta):
+        method_sources = {
+            "search_name": ["pk"],
+            "search_snippet": ["pk"],
+        }
+        fields = ProductSerializer.Meta.fields + (
+            "search_rank",
+            "search_name",
+            "search_snippet"
+        )
+
 class OrderSerializer(serializers.ModelSerializer):
     user = serializers.SerializerMethodField("user_desc")
     created_at = serializers.SerializerMethodField("formate_datetime")
@@ -28,6 +58,15 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
+        # поля, которые ?expand= заменяет вложенными объектами
+        expandable = {
+            "products": lambda: ProductSerializer(many=True, read_only=True),
+        }
+        # что читают SerializerMethodField (для QueryPlanMixin)
+        method_sources = {
+            "user": ["user.username", "user.email"],
+            "created_at": ["created_at"],
+        }
         fields = (
             "pk",
             "delivery_address",
@@ -35,5 +74,89 @@ class OrderSerializer(serializers.ModelSerializer):
             "created_at",
             "user",
             "products",
-            "receipt"
-        )
\ No newline at end of file
+            "receipt",
+            "items_count",
+            "subtotal",
+            "discounted_total"
+        )
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = (
+            "date",
+            "orders_count",
+            "units",
+            "revenue"
+        )
+
+
+class DailySalesTotalsSerializer(serializers.Serializer):
+    days = serializers.IntegerField()
+    orders_count = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=16, decimal_places=0)
+
+
+class ProductSalesSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source="product.name", read_only=True)
+
+    class Meta:
+        model = ProductSales
+        fields = (
+            "product",
+            "name",
+            "units",
+            "revenue"
+        )
+
+
+class UserSalesSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source="user.username", read_only=True)
+
+    class Meta:
+        model = UserSales
+        fields = (
+            "user",
+            "username",
+            "orders_count",
+            "units",
+            "revenue"
+        )
+
+
+@lru_cache(maxsize=None)
+def sparse_serializer(serializer_class, fields=None, expand=()):
+    """
+    Подкласс serializer_class только с полями fields (в порядке Meta.fields)
+    и с раскрытыми связями expand из Meta.expandable.
+
+    Класс кэшируется, поэтому план запроса и быстрый кодировщик,
+    которые тоже кэшируются по классу, строятся для него один раз.
+    Кэш без вытеснения: вытесненный класс был бы построен заново, и его
+    план и кодировщик навсегда остались бы в их кэшах рядом с прежними.
+    Размер ограничен: неизвестные поля и связи отклоняются до кэширования.
+    """
+    meta = serializer_class.Meta
+    expandable = getattr(meta, "expandable", {})
+    unknown = [name for name in fields or () if name not in meta.fields]
+    if unknown:
+        raise serializers.ValidationError({"fields": [f"Unknown field: {name}" for name in unknown]})
+    unknown = [name for name in expand if name not in expandable]
+    if unknown:
+        raise serializers.ValidationError({"expand": [f"Cannot expand: {name}" for name in unknown]})
+
+    selected = meta.fields if fields is None else tuple(name for name in meta.fields if name in fields)
+    attrs = {
+        "Meta": type("Meta", (meta,), {"fields": selected}),
+        "__module__": serializer_class.__module__,
+    }
+    # объявленные, но не выбранные поля убираются, иначе DRF потребует их в Meta.fields
+    for name in serializer_class._declared_fields:
+        if name not in selected:
+            attrs[name] = None
+    for name in expand:
+        if name in selected:
+            attrs[name] = expandable[name]()
+    return type(serializer_class.__name__, (serializer_class,), attrs)
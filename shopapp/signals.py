@@ -0,0 +1,145 @@
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from django.utils import timezone
+
+from .caching import PRODUCTS, ORDERS, bump_on_commit
+from .models import Product, Order
+from .order_totals import recompute_order_totals, recompute_product_orders, refresh_order_totals
+from .reports import order_keys, refresh_sales_on_commit, sales_day
+
+
+@receiver(m2m_changed, sender=Order.products.through, dispatch_uid="order.touch_on_products_changed")
+def touch_order_on_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        orders = Order.objects.filter(pk__in=pk_set) if reverse else Order.objects.filter(pk=instance.pk)
+    elif action == "pre_clear" and reverse:
+        # instance -- товар; после clear его заказы уже не найти
+        orders = instance.orders.all()
+    elif action == "post_clear" and not reverse:
+        orders = Order.objects.filter(pk=instance.pk)
+    else:
+        return
+    orders.update(updated_at=timezone.now())
+    bump_on_commit(ORDERS)
+
+
+@receiver(post_save, sender=Product, dispatch_uid="product.bump_cache_on_save")
+@receiver(post_delete, sender=Product, dispatch_uid="product.bump_cache_on_delete")
+def bump_products_cache(sender, **kwargs):
+    bump_on_commit(PRODUCTS)
+
+
+@receiver(post_save, sender=Order, dispatch_uid="order.bump_cache_on_save")
+@receiver(post_delete, sender=Order, dispatch_uid="order.bump_cache_on_delete")
+def bump_orders_cache(sender, **kwargs):
+    bump_on_commit(ORDERS)
+
+
+@receiver(post_save, sender=User, dispatch_uid="user.bump_orders_cache_on_save")
+def bump_orders_cache_on_user_change(sender, update_fields=None, **kwargs):
+    # в выгрузке заказов есть username и email; вход в систему их не меняет
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_on_commit(ORDERS)
+
+
+@receiver(pre_save, sender=Order, dispatch_uid="order.remember_sales_user")
+def remember_order_user(sender, instance, update_fields=None, **kwargs):
+    # при смене покупателя пересчитать нужно и прежнего
+    if instance.pk is None or update_fields is not None and "user" not in update_fields:
+        return
+    instance._sales_previous_user_id = Order.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+
+
+@receiver(post_save, sender=Order, dispatch_uid="order.refresh_sales_on_save")
+def refresh_sales_on_order_save(sender, instance, **kwargs):
+    users = {instance.user_id, getattr(instance, "_sales_previous_user_id", None)} - {None}
+    refresh_sales_on_commit(days=[sales_day(instance.created_at)], users=users)
+
+
+@receiver(pre_delete, sender=Order, dispatch_uid="order.refresh_sales_on_delete")
+def refresh_sales_on_order_delete(sender, instance, **kwargs):
+    # строки Order.products удаляются каскадом, без m2m_changed
+    refresh_sales_on_commit(
+        days=[sales_day(instance.created_at)],
+        products=instance.products.values_list("pk", flat=True),
+        users=[instance.user_id]
+    )
+
+
+@receiver(m2m_changed, sender=Order.products.through, dispatch_uid="order.refresh_sales_on_products_changed")
+def refresh_sales_on_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        changed = pk_set
+    elif action == "pre_clear":
+        # после clear уже не узнать, какие строки были
+        changed = instance.orders.values_list("pk", flat=True) if reverse else \
+            instance.products.values_list("pk", flat=True)
+    else:
+        return
+    if reverse:
+        days, users = order_keys(Order.objects.filter(pk__in=changed))
+        refresh_sales_on_commit(days=days, products=[instance.pk], users=users)
+    else:
+        refresh_sales_on_commit(days=[sales_day(instance.created_at)], products=changed, users=[instance.user_id])
+
+
+@receiver(pre_save, sender=Product, dispatch_uid="product.remember_sales_price")
+def remember_product_price(sender, instance, update_fields=None, **kwargs):
+    # цена нужна сводкам продаж, цена и скидка -- итогам заказов
+    if instance.pk is None or update_fields is not None and not {"price", "discount"} & set(update_fields):
+        return
+    instance._previous_price = Product.objects.filter(pk=instance.pk).values_list("price", "discount").first()
+
+
+@receiver(post_save, sender=Product, dispatch_uid="product.refresh_sales_on_price_change")
+def refresh_sales_on_price_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_price", None)
+    if created or previous is None or previous[0] == instance.price:
+        return
+    days, users = order_keys(instance.orders.all())
+    refresh_sales_on_commit(days=days, products=[instance.pk], users=users)
+
+
+@receiver(pre_delete, sender=Product, dispatch_uid="product.refresh_sales_on_delete")
+def refresh_sales_on_product_delete(sender, instance, **kwargs):
+    days, users = order_keys(instance.orders.all())
+    refresh_sales_on_commit(days=days, users=users)
+
+
+@receiver(m2m_changed, sender=Order.products.through, dispatch_uid="order.recompute_totals_on_products_changed")
+def recompute_totals_on_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # related manager вызывает сигнал внутри своей транзакции, итоги меняются вместе со строками
+    if action not in ("post_add", "post_remove", "pre_clear", "post_clear"):
+        return
+    if not reverse:
+        if action != "pre_clear":
+            refresh_order_totals(instance)
+    elif action == "pre_clear":
+        # instance -- товар; после clear его заказы уже не найти
+        instance._totals_orders = list(instance.orders.values_list("pk", flat=True))
+    elif action == "post_clear":
+        recompute_order_totals(getattr(instance, "_totals_orders", ()))
+    else:
+        recompute_order_totals(pk_set)
+
+
+@receiver(post_save, sender=Product, dispatch_uid="product.recompute_totals_on_price_change")
+def recompute_totals_on_price_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_price", None)
+    if created or previous is None or previous == (instance.price, instance.discount):
+        return
+    recompute_product_orders([instance.pk])
+
+
+@receiver(pre_delete, sender=Product, dispatch_uid="product.remember_totals_orders")
+def remember_product_orders(sender, instance, **kwargs):
+    # строки Order.products удаляются каскадом, без m2m_changed
+    instance._totals_orders = list(instance.orders.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product, dispatch_uid="product.recompute_totals_on_delete")
+def recompute_totals_on_product_delete(sender, instance, **kwargs):
+    recompute_order_totals(getattr(instance, "_totals_orders", ()))
+
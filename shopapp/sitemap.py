@@ -8,7 +8,7 @@ class ShopSitemap(Sitemap):
     priority = 0.5
 
     def items(self):
-        return Product.objects.filter(created_at__isnull=False).order_by("-created_at")
+        return Product.live.order_by("-created_at")
 
     def lastmod(self, obj: Product):
         return obj.created_at
\ No newline at end of file
@@ -0,0 +1,239 @@
+"""
+Вспомогательные функции для потоковой отдачи больших выгрузок.
+
+Строки читаются из базы порциями и сразу уходят клиенту,
+поэтому расход памяти не зависит от размера таблицы.
+"""
+import csv
+import json
+import re
+from functools import wraps
+from typing import Iterable, Iterator, Sequence
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.db.models.fields.files import FieldFile
+from django.http import HttpRequest, HttpResponseBase, StreamingHttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.text import compress_sequence, compress_string
+
+EXPORT_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 64 * 1024
+# больше этого тело потоковой выгрузки в кэш не копится
+STREAM_CACHE_MAX_SIZE = 16 * 1024 * 1024
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer: вместо записи возвращает строку.
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_buffered(chunks: Iterable[str], size: int = STREAM_BUFFER_SIZE) -> Iterator[str]:
+    """
+    Склеивает мелкие куски в блоки примерно по size символов,
+    чтобы не писать в сокет (и в gzip) по одной строке.
+    """
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_csv_rows(header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_values_list(queryset: QuerySet, fields: Sequence[str],
+                     chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def streaming_csv_response(queryset: QuerySet, fields: Sequence[str],
+                           filename: str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(
+        iter_buffered(iter_csv_rows(fields, iter_values_list(queryset, fields))),
+        content_type="text/csv"
+    )
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder (Decimal, datetime, UUID...) плюс файлы моделей:
+    FieldFile кодируется своим URL, пустой -- null.
+    """
+    def default(self, o):
+        if isinstance(o, FieldFile):
+            if not o:
+                return None
+            try:
+                return o.url
+            except ValueError:
+                return o.name
+        return super().default(o)
+
+
+def is_lazy(value) -> bool:
+    return callable(value) or isinstance(value, (Iterator, QuerySet))
+
+
+def iter_json(value, encoder: json.JSONEncoder = None) -> Iterator[str]:
+    """
+    Кодирует value в JSON по частям.
+
+    Итераторы, генераторы и QuerySet превращаются в массивы и читаются
+    по одному элементу, не собираясь в список; словари и списки, в которых
+    есть такие значения, обходятся рекурсивно, остальные кодируются
+    целиком. Вызываемый объект вычисляется в момент, когда до него дошла
+    очередь, -- так в конец ответа можно положить значение, известное
+    только после обхода строк.
+    """
+    if encoder is None:
+        encoder = ExportJSONEncoder()
+    if callable(value):
+        value = value()
+    if isinstance(value, QuerySet):
+        value = value.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if isinstance(value, dict) and not any(map(is_lazy, value.values())) or \
+            isinstance(value, (list, tuple)) and not any(map(is_lazy, value)):
+        # обычный контейнер кодируется целиком, без разбора по значениям
+        yield encoder.encode(value)
+    elif isinstance(value, dict):
+        yield "{"
+        separator = ""
+        for key, item in value.items():
+            yield f"{separator}{encoder.encode(str(key))}: "
+            yield from iter_json(item, encoder)
+            separator = ", "
+        yield "}"
+    elif isinstance(value, (list, tuple, Iterator)):
+        yield "["
+        separator = ""
+        for item in value:
+            yield separator
+            yield from iter_json(item, encoder)
+            separator = ", "
+        yield "]"
+    else:
+        yield encoder.encode(value)
+
+
+def iter_json_array(key: str, rows: Iterable[dict], trailer=None) -> Iterator[str]:
+    """
+    Отдаёт объект вида {key: [...]} по одной строке за раз.
+
+    trailer() вызывается после всех строк и возвращает словарь
+    дополнительных ключей объекта (например, курсор).
+    """
+    encoder = ExportJSONEncoder()
+    yield f"{{{json.dumps(key)}: "
+    yield from iter_json(iter(rows), encoder)
+    if trailer is not None:
+        for name, value in trailer().items():
+            yield f", {json.dumps(name)}: "
+            yield from iter_json(value, encoder)
+    yield "}"
+
+
+NDJSON_TRAILER_TYPE = "trailer"
+
+
+def iter_ndjson(rows: Iterable[dict], trailer=None) -> Iterator[str]:
+    """
+    По строке JSON на запись. Словарь trailer() идёт последней строкой
+    с ключом "type": "trailer" -- у строк данных такого ключа нет.
+    """
+    encoder = ExportJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+    if trailer is not None:
+        yield encoder.encode({"type": NDJSON_TRAILER_TYPE, **trailer()}) + "\n"
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Аналог JsonResponse, который не держит тело в памяти: data кодируется
+    через iter_json по мере отдачи блоками по STREAM_BUFFER_SIZE.
+    """
+    def __init__(self, data, encoder=ExportJSONEncoder, json_dumps_params=None, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(iter_buffered(iter_json(data, encoder(**(json_dumps_params or {})))), **kwargs)
+
+
+def streaming_json_response(key: str, rows: Iterable[dict], ndjson: bool = False,
+                            trailer=None) -> StreamingHttpResponse:
+    if ndjson:
+        return StreamingHttpResponse(
+            iter_buffered(iter_ndjson(rows, trailer)),
+            content_type="application/x-ndjson"
+        )
+    return StreamingHttpResponse(
+        iter_buffered(iter_json_array(key, rows, trailer)),
+        content_type="application/json"
+    )
+
+
+def iter_cached(chunks: Iterable[str], key: str, timeout: int,
+                max_size: int = STREAM_CACHE_MAX_SIZE) -> Iterator[bytes]:
+    """
+    Пропускает блоки клиенту и, если поток дошёл до конца,
+    кладёт всё тело в кэш одним значением.
+
+    Тело копится в одном bytearray. Если оно выросло больше max_size,
+    накопленное сразу отбрасывается и ответ не кэшируется: иначе
+    потоковая выгрузка держала бы в памяти всё тело.
+    """
+    body = bytearray()
+    for chunk in chunks:
+        chunk = chunk.encode()
+        if body is not None:
+            body += chunk
+            if len(body) > max_size:
+                body = None
+        yield chunk
+    if body is not None:
+        cache.set(key, bytes(body), timeout)
+
+
+def compress_export_response(request: HttpRequest, response: HttpResponseBase) -> HttpResponseBase:
+    """
+    Сжимает выгрузку gzip.
+
+    ?compress=gzip у скачиваемого файла отдаёт сам файл .gz, иначе сжатие
+    согласуется по Accept-Encoding. Потоковые ответы сжимаются по мере
+    отдачи блоков, а не после сборки всего тела.
+    """
+    disposition = response.get("Content-Disposition", "")
+    if request.GET.get("compress") != "gzip" or "filename=" not in disposition:
+        return GZipMiddleware(lambda request: response).process_response(request, response)
+    if response.streaming:
+        response.streaming_content = compress_sequence(response.streaming_content)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.content = compress_string(response.content)
+        response["Content-Length"] = str(len(response.content))
+    response["Content-Type"] = "application/gzip"
+    response["Content-Disposition"] = re.sub(r"filename=(\"?)([^\";]+)", r"filename=\1\2.gz", disposition)
+    return response
+
+
+def compressed_export(view_func):
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return compress_export_response(request, view_func(request, *args, **kwargs))
+    return wrapper
@@ -1,13 +1,56 @@
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import gzip
+import json
+import os
 from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from io import BytesIO, StringIO
 
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from string import ascii_letters
+from tempfile import TemporaryDirectory, mkdtemp
+from time import time
+from unittest.mock import Mock, patch
 from random import choices
+import sqlite3
 from django.conf import settings
+from mysite.replica import (REPLICA, STICKY_COOKIE, WRITTEN_KEY, ReplicaMiddleware, mark_synced, mark_written,
+                            reading_replica, routing, tracking_writes)
 
-from shopapp.models import Product, Order
+from shopapp.admin import mark_archived
+from shopapp.caching import PRODUCTS, get_generation, products_export_key
+from shopapp.common import save_csv_orders, save_csv_products, save_products_bulk
+from shopapp.exporting import (collect_pk_ranges, count_pk_ranges, export_csv,
+                                iter_pk_filters, render_part, split_pk_ranges)
+from shopapp.delta import decode_cursor, settled_cursor, settled_until
+from shopapp.fast_serializers import FastSerializer
+from shopapp.index_advisor import order_fields, split_clauses, where_terms
+from shopapp.jobs import JOB_HEARTBEAT_TIMEOUT, Heartbeat, enqueue_import, enqueue_export, claim_next_job, run_job
+from shopapp.models import DailySales, Job, Order, Product, ProductSales, UserSales
+from shopapp.order_totals import recompute_order_totals
+from shopapp.query_plan import plan_for_serializer
+from shopapp.reports import rebuild_sales
+from shopapp.serializers import OrderSerializer, ProductSerializer, sparse_serializer
+from shopapp.streaming import iter_cached, iter_json
+from shopapp.sitemap import ShopSitemap
+from shopapp.views import LatestProductsFeed, ProductsListView, ProductViewSet
 
 
 class ProductCreateViewTestCase(TestCase):
@@ -76,6 +119,7 @@ class ProductsListViewTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.user.delete()
+        super().tearDownClass()
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
@@ -99,6 +143,7 @@ class OrdersListViewTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.user.delete()
+        super().tearDownClass()
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
@@ -130,7 +175,7 @@ class ProductsExportViewTestCase(TestCase):
             }
             for product in products
         ]
-        products_data = response.json()
+        products_data = json.loads(response.getvalue())
         self.assertEqual(products_data["products"], expected_data)
 
 
@@ -146,6 +191,7 @@ class OrderDetailViewTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.user.delete()
+        super().tearDownClass()
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
@@ -177,11 +223,14 @@ class OrdersExportTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.user.delete()
+        super().tearDownClass()
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
 
     def test_get_products_view(self):
+        # фикстуры загружаются без сигналов
+        recompute_order_totals()
         response = self.client.get(reverse("shopapp:orders-export"), HTTP_USER_AGENT="Test")
         self.assertEqual(response.status_code, 200)
         orders = Order.objects.order_by("pk").all()
@@ -191,9 +240,1416 @@ class OrdersExportTestCase(TestCase):
                 "delivery_address": order.delivery_address,
                 "promocode": order.promocode,
                 "user_id": order.user.pk,
+                "items_count": order.items_count,
+                "subtotal": str(order.subtotal),
+                "discounted_total": str(order.discounted_total),
                 "products_id": sorted([p.pk for p in order.products.all()])
             }
             for order in orders
         ]
-        orders_data = response.json()
+        orders_data = json.loads(b"".join(response.streaming_content))
         self.assertEqual(orders_data["orders"], expected_data)
+
+    def test_orders_export_ndjson_in_batches(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("shopapp:orders-export"), {"format": "ndjson"},
+                                       HTTP_USER_AGENT="Test")
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["pk"] for line in lines],
+                         list(Order.objects.order_by("pk").values_list("pk", flat=True)))
+
+
+class ProductsDownloadCSVTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def test_download_csv_is_streamed_and_ordered(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"ordering": "-price"},
+            HTTP_USER_AGENT="Test"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ["sku", "name", "description", "price", "discount"])
+        expected_names = list(Product.objects.order_by("-price").values_list("name", flat=True))
+        self.assertEqual([row[1] for row in rows[1:]], expected_names)
+
+    def test_download_csv_gzip_negotiated(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            HTTP_USER_AGENT="Test",
+            HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=products-export.csv")
+        content = gzip.decompress(b"".join(response.streaming_content)).decode()
+        self.assertTrue(content.startswith("sku,name,description,price,discount"))
+
+    def test_download_csv_compress_param(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"compress": "gzip"},
+            HTTP_USER_AGENT="Test"
+        )
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=products-export.csv.gz")
+        content = gzip.decompress(b"".join(response.streaming_content)).decode()
+        self.assertIn("Samsung S23", content)
+
+    def test_download_csv_search(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"search": "iPhone"},
+            HTTP_USER_AGENT="Test"
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("iPhone", content)
+        self.assertNotIn("Samsung S23", content)
+
+
+class SaveCSVOrdersTestCase(TestCase):
+    fixtures = ["product.json", "users.json"]
+
+    def test_import_orders_in_chunks_with_error_report(self):
+        username = User.objects.order_by("pk").first().username
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True)[:2])
+        csv_data = (
+            "delivery_address,promocode,user,products\n"
+            f'"Nevskiy 1","A1","{username}","({product_ids[0]}, {product_ids[1]})"\n'
+            f'"Nevskiy 2","A2","nobody","{product_ids[0]}"\n'
+            f'"Nevskiy 3","A3","{username}","{product_ids[1]}"\n'
+            f'"Nevskiy 4","A4","{username}","999999"\n'
+        )
+        # на порцию: 6 запросов импорта и 2 на итоги заказов
+        with self.assertNumQueries(2 * 8):
+            report = save_csv_orders(BytesIO(csv_data.encode()), chunk_size=2)
+        self.assertEqual(report.imported, 2)
+        self.assertEqual([line for line, message in report.errors], [3, 5])
+        first = Order.objects.get(promocode="A1")
+        self.assertEqual(sorted(first.products.values_list("pk", flat=True)), product_ids)
+        self.assertEqual(first.user.username, username)
+        self.assertEqual(first.items_count, 2)
+        self.assertEqual(first.subtotal, sum(Product.objects.filter(pk__in=product_ids).values_list("price", flat=True)))
+
+    def test_missing_columns_reported(self):
+        report = save_csv_orders(BytesIO(b"promocode,products\nA1,1\n"))
+        self.assertEqual(report.imported, 0)
+        self.assertEqual(report.errors, [(1, "missing columns: delivery_address, user")])
+        self.assertFalse(Order.objects.filter(promocode="A1").exists())
+
+
+class SaveCSVProductsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="importer", password="testpswd")
+
+    def test_upsert_by_sku(self):
+        csv_data = (
+            "sku,name,description,price,discount\n"
+            "S24,Galaxy S24,First,130000,10\n"
+            "S25,Galaxy S25,Second,150000,15\n"
+            ",No sku,Third,1000,0\n"
+            "BAD,Broken,Fourth,not-a-price,0\n"
+        )
+        report = save_csv_products(BytesIO(csv_data.encode()), created_by=self.user, chunk_size=2)
+        self.assertEqual(report.imported, 3)
+        self.assertEqual([line for line, message in report.errors], [5])
+
+        feed = "sku,price,discount\nS24,120000,20\n"
+        report = save_csv_products(BytesIO(feed.encode()), created_by=self.user)
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(Product.objects.filter(sku="S24").count(), 1)
+        product = Product.objects.get(sku="S24")
+        self.assertEqual((product.name, product.price, product.discount), ("Galaxy S24", 120000, 20))
+        self.assertEqual(product.created_by, self.user)
+
+    def test_blank_cells_keep_values_and_new_rows_need_name(self):
+        Product.objects.create(sku="S24", name="Galaxy S24", color="black", description="First", price=130000,
+                               created_by=self.user)
+        csv_data = (
+            "sku,name,color,description,price,discount\n"
+            "S24,,,,,5\n"
+            "NEW,,,Nameless,100,0\n"
+            ",,,No sku either,100,0\n"
+        )
+        report = save_csv_products(BytesIO(csv_data.encode()), created_by=self.user)
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.errors, [(3, "name: This field cannot be blank."),
+                                         (4, "name: This field cannot be blank.")])
+        product = Product.objects.get(sku="S24")
+        self.assertEqual((product.name, product.color, product.description, product.price, product.discount),
+                         ("Galaxy S24", "black", "First", 130000, 5))
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_exported_catalog_uploads_without_duplicates(self):
+        Product.objects.create(sku="S24", name="Galaxy S24", price=130000, created_by=self.user)
+        Product.objects.create(name="No sku", price=1000, created_by=self.user)
+        response = self.client.get(reverse("shopapp:product-download-csv"), HTTP_USER_AGENT="Test")
+        exported = b"".join(response.streaming_content).replace(b"1000", b"900")
+        report = save_csv_products(BytesIO(exported), created_by=self.user)
+        self.assertEqual((report.imported, report.errors), (2, []))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Product.objects.get(name="No sku").price, 900)
+
+        Product.objects.create(name="No sku", created_by=self.user)
+        report = save_csv_products(BytesIO(b"name,price\nNo sku,1\n"), created_by=self.user)
+        self.assertEqual(report.errors, [(2, "name: 2 products without sku have this name.")])
+
+    def test_duplicate_sku_in_chunk_reported(self):
+        csv_data = "sku,name,price\nS24,Galaxy S24,100\nS24,Galaxy S24 again,200\nS25,Galaxy S25,300\n"
+        report = save_csv_products(BytesIO(csv_data.encode()), created_by=self.user)
+        self.assertEqual(report.imported, 2)
+        self.assertEqual(report.errors, [(3, "sku: duplicate of line 2.")])
+        self.assertEqual(Product.objects.get(sku="S24").name, "Galaxy S24")
+
+    def test_upload_requires_user(self):
+        response = self.client.post(reverse("shopapp:product-upload-csv"),
+                                    {"file": SimpleUploadedFile("p.csv", b"name\nX\n")}, HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("non_field_errors", response.json())
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class JobsTestCase(TestCase):
+    fixtures = ["product.json", "users.json"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="jobs-admin", password="testpswd")
+
+    def test_import_job_is_queued_and_processed(self):
+        csv_data = b"name,price\nQueued product,1000\nBad product,oops\n"
+        job = enqueue_import(Job.KIND_IMPORT_PRODUCTS, SimpleUploadedFile("p.csv", csv_data), self.user)
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertFalse(Product.objects.filter(name="Queued product").exists())
+
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(claim_next_job())
+        run_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual((job.total_rows, job.processed_rows, job.progress), (2, 2, 100))
+        self.assertEqual(len(job.errors), 1)
+        self.assertTrue(Product.objects.filter(name="Queued product", created_by=self.user).exists())
+
+    def test_export_job_writes_csv_to_media(self):
+        with CaptureQueriesContext(connection) as queries:
+            job = enqueue_export(Product, self.user, filters={})
+        # запрос админки не обходит выборку, pk собирает воркер
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(job.total_rows, 0)
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        with job.result.open("r") as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0][:2], ["id", "name"])
+        self.assertEqual([int(row[0]) for row in rows[1:]],
+                         list(Product.objects.order_by("pk").values_list("pk", flat=True)))
+        self.assertEqual(job.total_rows, Product.objects.count())
+
+    def test_export_action_stores_selection_as_json(self):
+        admin_user = User.objects.create_superuser(username="jobs-superuser", password="testpswd")
+        self.client.force_login(admin_user)
+        products = list(Product.objects.order_by("pk").values_list("pk", "name"))
+        url = reverse("admin:shopapp_product_changelist")
+        self.client.post(url, {"action": "export_csv", ACTION_CHECKBOX_NAME: [products[0][0], products[2][0]]},
+                         HTTP_USER_AGENT="Test")
+        self.client.post(f"{url}?q={products[1][1]}", {"action": "export_csv", "select_across": "1",
+                                                       ACTION_CHECKBOX_NAME: [products[1][0]]},
+                         HTTP_USER_AGENT="Test")
+        selected, filtered = Job.objects.order_by("pk")
+        self.assertEqual(selected.params["pks"], [str(products[0][0]), str(products[2][0])])
+        self.assertEqual(filtered.params["filters"], {"q": [products[1][1]]})
+
+        for job in (selected, filtered):
+            run_job(claim_next_job())
+            job.refresh_from_db()
+            with job.result.open("r") as file:
+                exported = [int(row[0]) for row in list(csv.reader(file))[1:]]
+            expected = job.params.get("pks") or Product.objects.filter(name__icontains=products[1][1])\
+                .values_list("pk", flat=True)
+            self.assertEqual(sorted(exported), sorted(int(pk) for pk in expected))
+
+    def test_export_result_needs_permissions(self):
+        job = enqueue_export(Order, self.user, filters={})
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertRegex(job.result.name, r"order-export-\w{16}\.csv$")
+        url = reverse("admin:shopapp_job_result", args=[job.pk])
+
+        staff = User.objects.create_user(username="jobs-staff", password="testpswd", is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename="view_job"))
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url, HTTP_USER_AGENT="Test").status_code, 403)
+        staff.user_permissions.add(Permission.objects.get(codename="view_order"))
+        response = self.client.get(url, HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"id,"))
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_USER_AGENT="Test").status_code, 302)
+
+    def test_heartbeat_survives_database_errors(self):
+        job = Job.objects.create(kind=Job.KIND_EXPORT_CSV, status=Job.STATUS_RUNNING)
+        heartbeat = Heartbeat(job, interval=0.01)
+        beats = []
+
+        def beat(**fields):
+            beats.append(fields)
+            if len(beats) == 1:
+                raise OperationalError("database is locked")
+            if len(beats) == 3:
+                heartbeat.stopped.set()
+
+        with patch("shopapp.jobs.Job.objects.filter", side_effect=lambda **kwargs: Mock(update=Mock(
+                side_effect=beat))), self.assertLogs("shopapp.jobs", "WARNING"):
+            heartbeat.start()
+            heartbeat.join(5)
+        self.assertFalse(heartbeat.is_alive())
+        self.assertEqual(len(beats), 3)
+
+    def test_stale_job_requeued_and_import_resumed(self):
+        csv_data = b"name,price\nFirst,1000\nSecond,oops\nThird,3000\n"
+        job = enqueue_import(Job.KIND_IMPORT_PRODUCTS, SimpleUploadedFile("p.csv", csv_data), self.user)
+        claimed = claim_next_job()
+        # воркер успел сохранить первую порцию и упал
+        report = save_csv_products(BytesIO(csv_data[:csv_data.index(b"Third")]), created_by=self.user)
+        Job.objects.filter(pk=claimed.pk).update(processed_rows=report.processed, errors=report.errors)
+        self.assertIsNone(claim_next_job())
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - JOB_HEARTBEAT_TIMEOUT * 2)
+        reclaimed = claim_next_job()
+        self.assertEqual(reclaimed.pk, job.pk)
+        run_job(reclaimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual((job.processed_rows, len(job.errors)), (3, 1))
+        self.assertEqual(list(Product.objects.filter(name__in=["First", "Third"]).values_list("name", flat=True)
+                              .order_by("name")), ["First", "Third"])
+        self.assertIn("resumed after 2 rows", job.message)
+
+
+class ExportEngineTestCase(TestCase):
+    fixtures = ["product.json", "users.json"]
+
+    def test_split_pk_ranges(self):
+        pk_ranges = [[1, 5], [8, 8], [10, 13]]
+        parts = split_pk_ranges(pk_ranges, 3)
+        self.assertEqual(parts, [[[1, 4]], [[5, 5], [8, 8], [10, 11]], [[12, 13]]])
+        self.assertEqual(sum(count_pk_ranges(part) for part in parts), count_pk_ranges(pk_ranges))
+        self.assertEqual(split_pk_ranges([], 4), [])
+
+    def test_collect_pk_ranges(self):
+        pks = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+        pk_ranges = collect_pk_ranges(Product.objects.exclude(pk=pks[1]))
+        self.assertEqual(count_pk_ranges(pk_ranges), len(pks) - 1)
+
+    def test_pk_filters_use_ranges(self):
+        filters = list(iter_pk_filters([[1, 500], [502, 502], [504, 505], [600, 799]], size=2))
+        self.assertEqual(filters, [{"pk__range": (1, 500)}, {"pk__in": [502, 504, 505]}, {"pk__range": (600, 799)}])
+        with CaptureQueriesContext(connection) as queries:
+            with TemporaryDirectory() as tmpdir:
+                render_part("shopapp.Product", ["id"], [[1, 500]], os.path.join(tmpdir, "part.csv"))
+        self.assertIn("BETWEEN", queries[0]["sql"])
+
+    def test_export_csv_gzip(self):
+        output = BytesIO()
+        stats = export_csv(Product, collect_pk_ranges(Product.objects.all()), output,
+                           fields=["name", "price"], processes=2, compress=True)
+        rows = list(csv.reader(StringIO(gzip.decompress(output.getvalue()).decode())))
+        self.assertEqual(rows[0], ["name", "price"])
+        self.assertEqual(stats.rows, Product.objects.count())
+        self.assertEqual([row[0] for row in rows[1:]],
+                         list(Product.objects.order_by("pk").values_list("name", flat=True)))
+
+
+class ParallelExportTestCase(TransactionTestCase):
+    fixtures = ["product.json", "users.json"]
+
+    def test_export_csv_in_processes(self):
+        # дочерние процессы не видят тестовую базу в памяти: экспорт читает её копию в файле
+        connection.ensure_connection()
+        memory, name = connection.connection, connection.settings_dict["NAME"]
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "export.sqlite3")
+            with closing(sqlite3.connect(path)) as target:
+                memory.backup(target)
+            connection.connection = None
+            connection.settings_dict["NAME"] = path
+            try:
+                output = BytesIO()
+                with patch("shopapp.exporting.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as executor:
+                    stats = export_csv(Product, collect_pk_ranges(Product.objects.all()), output,
+                                       fields=["name"], processes=2)
+                expected = list(Product.objects.order_by("pk").values_list("name", flat=True))
+            finally:
+                connection.close()
+                connection.connection, connection.settings_dict["NAME"] = memory, name
+        self.assertEqual(executor.call_args.kwargs["max_workers"], 2)
+        rows = list(csv.reader(StringIO(output.getvalue().decode())))
+        self.assertEqual(stats.rows, len(expected))
+        self.assertEqual([row[0] for row in rows[1:]], expected)
+
+
+class DeltaExportTestCase(TestCase):
+    fixtures = ["order.json", "product.json", "users.json"]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="delta", password="testpswd", is_staff=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user.delete()
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+        # граница settled_until проверяется отдельно, здесь строки отдаются сразу
+        settle = patch("shopapp.delta.DELTA_SETTLE_SECONDS", 0)
+        settle.start()
+        self.addCleanup(settle.stop)
+
+    def test_products_delta_and_etag(self):
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        cursor = json.loads(response.getvalue())["next_cursor"]
+        etag = response["ETag"]
+
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse("shopapp:products-export"), {"since": cursor}, HTTP_USER_AGENT="Test")
+        data = json.loads(response.getvalue())
+        self.assertEqual(data["products"], [])
+        self.assertEqual(data["next_cursor"], cursor)
+
+        changed, archived = Product.objects.filter(archived=False).order_by("pk")[:2]
+        changed.price = 1
+        changed.save()
+        archived.archived = True
+        archived.save()
+        response = self.client.get(reverse("shopapp:products-export"), {"since": cursor}, HTTP_USER_AGENT="Test")
+        data = json.loads(response.getvalue())
+        self.assertEqual([product["pk"] for product in data["products"]], [changed.pk])
+        self.assertEqual(data["archived"], [archived.pk])
+        self.assertNotEqual(data["next_cursor"], cursor)
+
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:products-export"), {"since": "garbage"}, HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 400)
+
+    def test_orders_delta_includes_products_changes(self):
+        response = self.client.get(reverse("shopapp:orders-export"), HTTP_USER_AGENT="Test")
+        cursor = json.loads(b"".join(response.streaming_content))["next_cursor"]
+        order = Order.objects.order_by("pk").first()
+        order.products.remove(order.products.first())
+        response = self.client.get(reverse("shopapp:orders-export"), {"since": cursor}, HTTP_USER_AGENT="Test")
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([row["pk"] for row in data["orders"]], [order.pk])
+
+        response = self.client.get(reverse("shopapp:orders-export"), {"since": cursor, "format": "ndjson"},
+                                   HTTP_USER_AGENT="Test")
+        *rows, trailer = map(json.loads, b"".join(response.streaming_content).decode().splitlines())
+        self.assertEqual([row["pk"] for row in rows], [order.pk])
+        self.assertEqual(trailer, {"type": "trailer", "next_cursor": data["next_cursor"]})
+
+    def test_recent_changes_wait_for_settle(self):
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        cursor = json.loads(response.getvalue())["next_cursor"]
+        product = Product.objects.order_by("pk").first()
+        product.price = 2
+        product.save()
+        with patch("shopapp.delta.DELTA_SETTLE_SECONDS", 60):
+            # транзакция с более ранним updated_at ещё может закоммититься
+            response = self.client.get(reverse("shopapp:products-export"), {"since": cursor},
+                                       HTTP_USER_AGENT="Test")
+            data = json.loads(response.getvalue())
+            self.assertEqual((data["products"], data["next_cursor"]), ([], cursor))
+            latest = (product.updated_at, product.pk)
+            self.assertLess(decode_cursor(settled_cursor(latest, settled_until()))[0], product.updated_at)
+        response = self.client.get(reverse("shopapp:products-export"), {"since": cursor}, HTTP_USER_AGENT="Test")
+        self.assertEqual([row["pk"] for row in json.loads(response.getvalue())["products"]], [product.pk])
+
+
+class ExportCacheInvalidationTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_product_save_bumps_products_export(self):
+        generation = get_generation(PRODUCTS)
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        product = Product.objects.order_by("pk").first()
+        self.assertEqual(json.loads(response.getvalue())["products"][0]["name"], product.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Renamed product"
+            product.save()
+        self.assertGreater(get_generation(PRODUCTS), generation)
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        self.assertEqual(json.loads(response.getvalue())["products"][0]["name"], "Renamed product")
+
+    def test_admin_archive_action_bumps_products_export(self):
+        generation = get_generation(PRODUCTS)
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=1))
+        self.assertGreater(get_generation(PRODUCTS), generation)
+
+    @override_settings(SHOP_PREWARM_PRODUCTS_EXPORT=True)
+    def test_prewarm_after_bump(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=1).first().save()
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(cache.get(products_export_key()))
+
+
+class UserOrdersExportCacheTestCase(TestCase):
+    fixtures = ["order.json", "product.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.owner = User.objects.get(pk=1)
+        self.client.force_login(self.owner)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_orders_served_from_cached_bytes(self):
+        url = reverse("shopapp:orders-orders", kwargs={"pk": self.owner.pk})
+        response = self.client.get(url, HTTP_USER_AGENT="Test")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        expected = [order["pk"] for order in response.json()]
+        self.assertEqual(expected, list(self.owner.orders.order_by("pk").values_list("pk", flat=True)))
+
+        # сессия, пользователь запроса и владелец заказов; сами заказы не читаются
+        with self.assertNumQueries(3):
+            cached = self.client.get(url, HTTP_USER_AGENT="Test")
+        self.assertEqual(cached.content, response.content)
+
+        compressed = self.client.get(url, HTTP_USER_AGENT="Test", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+
+    def test_order_export_file(self):
+        url = reverse("shopapp:orders-order-export", kwargs={"pk": self.owner.pk})
+        response = self.client.get(url, {"compress": "gzip"}, HTTP_USER_AGENT="Test")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertTrue(response["Content-Disposition"].endswith("orders export.json.gz"))
+        orders = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(orders), self.owner.orders.count())
+
+
+@override_settings(MIDDLEWARE=[
+    middleware for middleware in settings.MIDDLEWARE
+    if middleware != "requestdataapp.middlewares.ThrottlingMiddleware"
+])
+class KeysetPaginationTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def walk(self, params):
+        url = reverse("shopapp:product-list")
+        pks = []
+        pages = []
+        while url:
+            response = self.client.get(url, params, HTTP_USER_AGENT="Test")
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn("count", data)
+            pks.extend(product["pk"] for product in data["results"])
+            pages.append(data)
+            url, params = data["next"], None
+        return pks, pages
+
+    def test_pages_follow_ordering_with_pk_tiebreak(self):
+        for ordering in ("-price", "discount", "name"):
+            pks, pages = self.walk({"ordering": ordering, "page_size": 2})
+            field = ordering.lstrip("-")
+            expected = list(Product.objects.order_by(ordering, "pk").values_list("pk", flat=True))
+            self.assertEqual(pks, expected, ordering)
+            self.assertIsNone(pages[0]["previous"])
+            self.assertGreater(len(pages), 2)
+
+    def test_previous_link(self):
+        pks, pages = self.walk({"ordering": "price", "page_size": 3})
+        response = self.client.get(pages[1]["previous"], HTTP_USER_AGENT="Test")
+        self.assertEqual([product["pk"] for product in response.json()["results"]], pks[:3])
+        self.assertIsNone(response.json()["previous"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "broken"}, HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductListCacheTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_list_cached_until_product_write(self):
+        url = reverse("shopapp:product-list")
+        first = self.client.get(url, {"ordering": "price"}, HTTP_USER_AGENT="Test")
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, {"ordering": " price", "unrelated": "1"}, HTTP_USER_AGENT="Test")
+        self.assertEqual(cached.json()["results"], first.json()["results"])
+
+        other = self.client.get(url, {"ordering": "-price"}, HTTP_USER_AGENT="Test")
+        self.assertNotEqual(other.json()["results"], first.json()["results"])
+
+        product = Product.objects.get(pk=first.json()["results"][0]["pk"])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Cheapest renamed"
+            product.save()
+        fresh = self.client.get(url, {"ordering": "price"}, HTTP_USER_AGENT="Test")
+        self.assertEqual(fresh.json()["results"][0]["name"], "Cheapest renamed")
+
+    def test_cache_stats(self):
+        url = reverse("shopapp:product-list")
+        self.client.get(url, HTTP_USER_AGENT="Test")
+        self.client.get(url, HTTP_USER_AGENT="Test")
+        staff = User.objects.create_user(username="stats", password="testpswd", is_staff=True)
+        self.client.force_login(staff)
+        stats = self.client.get(reverse("shopapp:cache-stats"), HTTP_USER_AGENT="Test").json()
+        self.assertEqual((stats["products-list"]["hits"], stats["products-list"]["misses"]), (1, 1))
+        self.assertEqual(stats["products-list"]["hit_ratio"], 0.5)
+        self.assertIsNotNone(stats["products-list"]["latency_ms"]["p95"])
+
+
+class QueryPlanTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="planner", password="testpswd")
+        self.products = list(Product.objects.all()[:3])
+
+    def create_orders(self, count):
+        for number in range(count):
+            order = Order.objects.create(delivery_address=f"street {number}", user=self.user)
+            order.products.set(self.products)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:order-list"), HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()["results"]
+
+    def test_plan_from_serializer(self):
+        plan = plan_for_serializer(OrderSerializer)
+        self.assertEqual(plan.select_related, {"user"})
+        self.assertEqual(set(plan.prefetch_related), {"products"})
+        self.assertTrue({"user__username", "user__email"} <= plan.only)
+
+    def test_orders_list_queries_do_not_grow(self):
+        self.create_orders(2)
+        few, _ = self.count_queries()
+        self.create_orders(8)
+        many, results = self.count_queries()
+        self.assertEqual(few, many)
+        mine = [order for order in results if order["user"].startswith("planner")]
+        self.assertTrue(mine)
+        self.assertEqual(sorted(mine[0]["products"]), sorted(product.pk for product in self.products))
+
+
+class FastSerializerTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.request = RequestFactory().get("/api/products/", HTTP_HOST="127.0.0.1")
+        Product.objects.filter(pk__in=Product.objects.order_by("pk").values("pk")[:2]) \
+            .update(preview="products/product_1/preview/phone 1.png")
+        user = User.objects.create_user(username="fast", email="fast@mail.ru")
+        order = Order.objects.create(delivery_address="Fast street", user=user)
+        order.products.set(Product.objects.all()[:3])
+
+    def assertSameJSON(self, serializer_class, queryset):
+        context = {"request": self.request}
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(queryset, many=True, context=context).data)
+        fast = FastSerializer(serializer_class, context=context)
+        self.assertEqual(renderer.render(fast.encode(fast.values(queryset))), expected)
+
+    def test_products_identical(self):
+        self.assertSameJSON(ProductSerializer, Product.objects.order_by("pk"))
+
+    def test_orders_identical(self):
+        self.assertSameJSON(OrderSerializer, Order.objects.order_by("pk"))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("bench_serializers", rows=20, repeat=1, stdout=out)
+        self.assertIn("Identical output", out.getvalue())
+
+
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != "requestdataapp.middlewares.ThrottlingMiddleware"])
+class FullTextSearchTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="searcher", password="testpswd")
+        Product.objects.bulk_create([
+            Product(name="Samsung Galaxy A52", description="Phone with AMOLED screen", created_by=self.user),
+            Product(name="Apple iPhone", description="Not a samsung at all", created_by=self.user),
+            Product(name="Xiaomi Redmi", description="Budget phone", created_by=self.user),
+        ])
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def search(self, term, **params):
+        response = self.client.get(
+            reverse("shopapp:product-list"), {"search": term, **params}, HTTP_USER_AGENT="Test"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_match_ranked_by_name_first(self):
+        results = self.search("sams")["results"]
+        self.assertEqual([product["name"] for product in results], ["Samsung Galaxy A52", "Apple iPhone"])
+        self.assertEqual(results[0]["search_name"], "<mark>Samsung</mark> Galaxy A52")
+        self.assertIn("<mark>samsung</mark>", results[1]["search_snippet"])
+        self.assertLess(results[0]["search_rank"], results[1]["search_rank"])
+
+    def test_all_words_required(self):
+        self.assertEqual([p["name"] for p in self.search("phone budg")["results"]], ["Xiaomi Redmi"])
+        self.assertEqual(self.search("!!!")["results"], [])
+
+    def test_index_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="Xiaomi Redmi").update(name="Xiaomi Poco")
+            Product.objects.filter(name="Apple iPhone").delete()
+        self.assertEqual([p["name"] for p in self.search("poco")["results"]], ["Xiaomi Poco"])
+        self.assertEqual(self.search("redmi")["results"], [])
+        self.assertEqual([p["name"] for p in self.search("samsung")["results"]], ["Samsung Galaxy A52"])
+
+    def test_cursor_pages_keep_rank_order(self):
+        Product.objects.bulk_create(
+            Product(name=f"Phone {number}", description="phone " * (number % 4 + 1), created_by=self.user)
+            for number in range(7)
+        )
+        data = self.search("phone", page_size=3)
+        names = [product["name"] for product in data["results"]]
+        ranks = [product["search_rank"] for product in data["results"]]
+        while data["next"]:
+            data = self.client.get(data["next"], HTTP_USER_AGENT="Test").json()
+            names += [product["name"] for product in data["results"]]
+            ranks += [product["search_rank"] for product in data["results"]]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(len(names), 9)
+        self.assertEqual(ranks, sorted(ranks))
+
+    def test_highlights_escaped_and_built_for_page_only(self):
+        Product.objects.bulk_create(
+            Product(name=f"<b>Phone</b> {number}", description="phone", created_by=self.user) for number in range(5)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            results = self.search("phone", page_size=2)["results"]
+        self.assertEqual(results[0]["search_name"], "&lt;b&gt;<mark>Phone</mark>&lt;/b&gt; 0")
+        searches = [query["sql"] for query in queries if "shopapp_product_fts" in query["sql"]]
+        self.assertEqual(len(searches), 2)
+        ranked, highlighted = searches
+        self.assertEqual(ranked.count("MATCH"), 1)
+        self.assertNotIn("highlight", ranked)
+        self.assertIn("IN ({}, {})".format(*[product["pk"] for product in results]), highlighted)
+
+    def test_fallback_without_fts(self):
+        with patch("shopapp.search.fts_enabled", return_value=False):
+            results = self.search("samsung")["results"]
+        self.assertEqual({p["name"] for p in results}, {"Samsung Galaxy A52", "Apple iPhone"})
+        self.assertNotIn("search_rank", results[0])
+
+
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != "requestdataapp.middlewares.ThrottlingMiddleware"])
+class ConditionalGetTestCase(TestCase):
+    fixtures = ["order.json", "product.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.product = Product.objects.order_by("pk").first()
+        self.user = User.objects.create_user(username="conditional", password="testpswd")
+        self.user.user_permissions.add(Permission.objects.get(codename="view_order"))
+        self.client.force_login(self.user)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def revalidate(self, url, **headers):
+        first = self.client.get(url, HTTP_USER_AGENT="Test", **headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("ETag"))
+        response = self.client.get(url, HTTP_USER_AGENT="Test", HTTP_IF_NONE_MATCH=first["ETag"], **headers)
+        return first, response
+
+    def touch_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+
+    def test_product_details(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        first, response = self.revalidate(url)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_USER_AGENT="Test", HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+        self.touch_product()
+        response = self.client.get(url, HTTP_USER_AGENT="Test", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertContains(response, "Renamed")
+
+    def test_product_api(self):
+        detail = reverse("shopapp:product-detail", kwargs={"pk": self.product.pk})
+        for url in (detail, reverse("shopapp:product-list")):
+            first, response = self.revalidate(url)
+            self.assertEqual(response.status_code, 304, url)
+        self.touch_product()
+        response = self.client.get(detail, HTTP_USER_AGENT="Test", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse("shopapp:product-detail", kwargs={"pk": "abc"}),
+                                         HTTP_USER_AGENT="Test").status_code, 404)
+
+    def test_order_details_and_feed(self):
+        order = Order.objects.filter(products=self.product).first()
+        url = reverse("shopapp:order_details", kwargs={"pk": order.pk})
+        first, response = self.revalidate(url)
+        self.assertEqual(response.status_code, 304)
+        self.touch_product()
+        response = self.client.get(url, HTTP_USER_AGENT="Test", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertContains(response, "Renamed")
+
+        first, response = self.revalidate(reverse("shopapp:products-feed"))
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductsBulkTestCase(TestCase):
+    fixtures = ["product.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="bulk", password="testpswd", is_staff=True)
+        self.client.force_login(self.user)
+        self.url = reverse("shopapp:product-bulk")
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def post(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, items, content_type="application/json", HTTP_USER_AGENT="Test")
+
+    def test_create_update_archive(self):
+        first, second = Product.objects.order_by("pk")[:2]
+        generation = get_generation(PRODUCTS)
+        response = self.post([
+            {"pk": first.pk, "price": 123, "discount": 5},
+            {"name": "Bulk phone", "price": 10},
+            {"pk": second.pk, "archived": True},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([(r["index"], r["status"]) for r in results], [(0, "updated"), (1, "created"), (2, "updated")])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.price, first.discount, first.name), (123, 5, first.name))
+        self.assertTrue(second.archived)
+        self.assertGreater(second.updated_at, second.created_at)
+        created = Product.objects.get(pk=results[1]["pk"])
+        self.assertEqual((created.name, created.created_by), ("Bulk phone", self.user))
+        self.assertNotEqual(get_generation(PRODUCTS), generation)
+
+    def test_invalid_items_reject_whole_request(self):
+        product = Product.objects.order_by("pk").first()
+        count = Product.objects.count()
+        response = self.post([
+            {"name": "Fine"},
+            {"pk": product.pk, "discount": -1},
+            {"pk": 999999, "price": 1},
+            {"price": 1},
+            {"pk": product.pk, "price": 2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2, 3, 4])
+        self.assertIn("discount", errors[0]["errors"])
+        self.assertIn("name", errors[2]["errors"])
+        self.assertEqual(Product.objects.count(), count)
+
+    def test_ten_thousand_items(self):
+        pks = list(Product.objects.values_list("pk", flat=True))
+        items = [{"name": f"Bulk {number}", "price": number % 1000} for number in range(10000 - len(pks))]
+        items += [{"pk": pk, "discount": 10} for pk in pks]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        # INSERT на пакет (SQLite ограничивает число параметров запроса), а не на товар
+        self.assertLess(len(queries), 150)
+        self.assertEqual(len(response.json()["results"]), 10000)
+        self.assertEqual(Product.objects.filter(discount=10).count(), len(pks))
+
+    def test_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username="customer", password="testpswd"))
+        response = self.client.post(self.url, [], content_type="application/json", HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 403)
+        self.client.logout()
+        response = self.client.post(self.url, [], content_type="application/json", HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != "requestdataapp.middlewares.ThrottlingMiddleware"])
+class SparseFieldsTestCase(TestCase):
+    fixtures = ["order.json", "product.json", "users.json"]
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def get(self, name, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name), params, HTTP_USER_AGENT="Test")
+        return response, " ".join(query["sql"] for query in queries.captured_queries)
+
+    def test_fields_narrow_payload_and_sql(self):
+        response, sql = self.get("shopapp:product-list", fields="price,pk,name")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()["results"][0]), ["pk", "name", "price"])
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"preview"', sql)
+
+    def test_expand_products_in_orders(self):
+        response, sql = self.get("shopapp:order-list", fields="pk,products", expand="products")
+        order = response.json()["results"][0]
+        self.assertEqual(list(order), ["pk", "products"])
+        expected = Order.objects.get(pk=order["pk"]).products.order_by("name", "price")
+        self.assertEqual([product["name"] for product in order["products"]],
+                         [product.name for product in expected])
+        self.assertNotIn("auth_user", sql)
+
+    def test_fast_path_matches_serializer(self):
+        request = RequestFactory().get("/", HTTP_HOST="127.0.0.1")
+        for serializer_class, queryset in (
+            (sparse_serializer(OrderSerializer, None, ("products",)), Order.objects.order_by("pk")),
+            (sparse_serializer(ProductSerializer, ("name", "pk"), ()), Product.objects.order_by("pk")),
+        ):
+            planned = plan_for_serializer(serializer_class).apply(queryset)
+            expected = JSONRenderer().render(serializer_class(planned, many=True, context={"request": request}).data)
+            fast = FastSerializer(serializer_class, context={"request": request})
+            self.assertEqual(JSONRenderer().render(fast.encode(fast.values(queryset))), expected)
+
+    def test_unknown_names_rejected(self):
+        self.assertEqual(self.get("shopapp:product-list", fields="pk,secret")[0].status_code, 400)
+        self.assertEqual(self.get("shopapp:order-list", expand="user")[0].status_code, 400)
+
+    def test_sparse_classes_are_never_rebuilt(self):
+        first = sparse_serializer(ProductSerializer, ("name", "pk"), ())
+        # больше наборов полей, чем было мест в прежнем LRU-кэше (256)
+        for serializer_class in (ProductSerializer, OrderSerializer):
+            names = serializer_class.Meta.fields
+            for mask in range(1, 2 ** len(names)):
+                sparse_serializer(serializer_class, tuple(sorted(
+                    name for bit, name in enumerate(names) if mask >> bit & 1
+                )), ())
+        self.assertIs(sparse_serializer(ProductSerializer, ("name", "pk"), ()), first)
+
+
+class StreamingJSONTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_iter_json_matches_json_response(self):
+        product = Product.objects.order_by("pk").first()
+        product.preview = "products/product_1/preview/phone 1.png"
+        rows = list(Product.objects.order_by("pk").values("pk", "price", "created_at"))
+        data = {
+            "rows": iter(rows),
+            "preview": product.preview,
+            "empty": Product().preview,
+            "total": lambda: sum(row["price"] for row in rows),
+        }
+        expected = {
+            "rows": rows,
+            "preview": product.preview.url,
+            "empty": None,
+            "total": sum(row["price"] for row in rows),
+        }
+        self.assertEqual("".join(iter_json(data)), json.dumps(expected, cls=DjangoJSONEncoder))
+
+    def test_download_json_matches_serializer(self):
+        with patch.object(ProductViewSet, "stream_chunk_size", 2):
+            response = self.client.get(reverse("shopapp:product-download-json"), HTTP_USER_AGENT="Test")
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Disposition"].endswith("products-export.json"))
+        request = response.wsgi_request
+        expected = ProductSerializer(Product.objects.all(), many=True, context={"request": request}).data
+        self.assertEqual(json.loads(response.getvalue()), json.loads(JSONRenderer().render(expected)))
+
+    def test_products_export_cached_after_stream(self):
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        self.assertTrue(response.streaming)
+        body = response.getvalue()
+        self.assertEqual(cache.get(products_export_key()), body)
+        # только ETag (table_version); строки товаров не читаются
+        with self.assertNumQueries(1):
+            cached = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+        self.assertFalse(cached.streaming)
+        self.assertEqual(cached.content, body)
+
+    def test_large_export_not_cached(self):
+        with patch("shopapp.caching.iter_cached", partial(iter_cached, max_size=100)):
+            response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT="Test")
+            body = response.getvalue()
+        self.assertGreater(len(body), 100)
+        self.assertIsNone(cache.get(products_export_key()))
+
+
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != "requestdataapp.middlewares.ThrottlingMiddleware"])
+class SalesSummaryTestCase(TestCase):
+    fixtures = ["products-fixture.json", "users.json"]
+
+    def setUp(self) -> None:
+        self.buyer = User.objects.create_user(username="buyer", password="testpswd")
+        self.other = User.objects.create_user(username="other buyer")
+        self.products = list(Product.objects.order_by("pk")[:3])
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_sales()
+
+    def snapshot(self):
+        return (
+            list(DailySales.objects.order_by("date").values_list("date", "orders_count", "units", "revenue")),
+            list(ProductSales.objects.order_by("pk").values_list("product", "units", "revenue")),
+            list(UserSales.objects.order_by("pk").values_list("user", "orders_count", "units", "revenue")),
+        )
+
+    def assertSummariesFresh(self):
+        incremental = self.snapshot()
+        rebuild_sales()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_incremental_refresh_matches_rebuild(self):
+        first, second, third = self.products
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.buyer, delivery_address="Sales street")
+            order.products.set([first, second])
+        self.assertEqual(ProductSales.objects.get(product=first).units, first.orders.count())
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.remove(first)
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            third.orders.add(order)
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.price += 7
+            second.save()
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.user = self.other
+            order.save()
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.clear()
+        self.assertSummariesFresh()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertSummariesFresh()
+        self.assertFalse(UserSales.objects.filter(user=self.other).exists())
+
+    def test_csv_import_refreshes_summaries(self):
+        pks = [product.pk for product in self.products]
+        data = f'user,delivery_address,promocode,products\nbuyer,Street,,"{pks[0]},{pks[1]}"\n'.encode()
+        with self.captureOnCommitCallbacks(execute=True):
+            save_csv_orders(BytesIO(data))
+        self.assertEqual(UserSales.objects.get(user=self.buyer).units, 2)
+        self.assertSummariesFresh()
+
+    def test_csv_price_upsert_refreshes_summaries(self):
+        first = self.products[0]
+        first.sku = "SALES-1"
+        first.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.buyer, delivery_address="Sales street")
+            order.products.set([first])
+        data = f"sku,price\n{first.sku},{first.price + 100}\n".encode()
+        with self.captureOnCommitCallbacks(execute=True):
+            save_csv_products(BytesIO(data), created_by=self.buyer)
+        self.assertEqual(ProductSales.objects.get(product=first).revenue, (first.price + 100) * first.orders.count())
+        self.assertSummariesFresh()
+
+    def test_api_reads_summaries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.buyer, delivery_address="Sales street")
+            order.products.set(self.products)
+        response = self.client.get(reverse("shopapp:dailysales-list"), HTTP_USER_AGENT="Test")
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(User.objects.create_user(username="analyst", is_staff=True))
+        with self.assertNumQueries(3):
+            # сессия, пользователь и одна страница сводки
+            response = self.client.get(reverse("shopapp:dailysales-list"), HTTP_USER_AGENT="Test")
+        today = DailySales.objects.order_by("-date").first()
+        self.assertEqual(response.json()["results"][0]["date"], today.date.isoformat())
+        self.assertEqual(response.json()["results"][0]["revenue"], str(today.revenue))
+
+        response = self.client.get(reverse("shopapp:dailysales-totals"), HTTP_USER_AGENT="Test")
+        revenue = sum(product.price * product.orders.count() for product in Product.objects.all())
+        self.assertEqual(response.json()["revenue"], str(revenue))
+
+        response = self.client.get(reverse("shopapp:productsales-list"), {"ordering": "-units"},
+                                   HTTP_USER_AGENT="Test")
+        top = response.json()["results"][0]
+        self.assertEqual(top["units"], max(ProductSales.objects.values_list("units", flat=True)))
+        self.assertEqual(top["name"], Product.objects.get(pk=top["product"]).name)
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command("rebuild_sales", stdout=out)
+        self.assertIn(f"{UserSales.objects.count()} users", out.getvalue())
+
+
+class IndexAdvisorTestCase(TestCase):
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_proposes_indexes_and_skips_covered_queries(self):
+        out = StringIO()
+        call_command("advise_indexes", products=300, orders=30, repeat=1, stdout=out)
+        output = out.getvalue()
+        # витрина читает Product.live, его запросы уже покрыты частичными индексами
+        self.assertNotIn("] /en/shop/products/\n", output)
+        self.assertNotIn("] /en/shop/products/latest/feed/\n", output)
+        self.assertIn("[full scan shopapp_product, temp b-tree sort] /en/shop/api/products/?ordering=-price", output)
+        self.assertIn("models.Index(fields=['-price']", output)
+        self.assertIn("condition=models.Q(('published_at__isnull', False)), fields=['-published_at']", output)
+        self.assertIn("migrations.AddIndex(", output)
+        self.assertIn("(plan fixed)", output)
+        # проба идёт в откатываемой транзакции
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(User.objects.filter(username="index-advisor").exists())
+
+    def test_where_terms(self):
+        sql, params = Order.objects.filter(user_id=1, created_at__gte=datetime(2020, 1, 1).astimezone()) \
+            .order_by("-updated_at").query.sql_with_params()
+        where, order = split_clauses(sql)
+        self.assertEqual(where_terms(sql, where, params, "shopapp_order", Order), (["user"], ["created_at"], []))
+        self.assertEqual(order_fields(order, "shopapp_order", Order), ["-updated_at"])
+
+
+class SQLiteBackendTestCase(TestCase):
+    def test_pragmas_and_immediate_transactions(self):
+        with connection.cursor() as cursor:
+            values = {}
+            for pragma in ("busy_timeout", "synchronous", "temp_store", "cache_size", "foreign_keys"):
+                cursor.execute(f"PRAGMA {pragma}")
+                values[pragma] = cursor.fetchone()[0]
+        self.assertEqual(values, {
+            "busy_timeout": 5000,
+            "synchronous": 1,
+            "temp_store": 2,
+            "cache_size": -64 * 1024,
+            "foreign_keys": 1,
+        })
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    def test_stress_tuned_profile_never_locks(self):
+        out = StringIO()
+        call_command("sqlite_stress", readers=2, writers=2, seconds=0.5, rows=500, profile=["tuned"], stdout=out)
+        row = next(line.split() for line in out.getvalue().splitlines() if line.startswith("tuned"))
+        self.assertGreater(float(row[1]), 0)
+        self.assertGreater(float(row[2]), 0)
+        self.assertEqual(row[3], "0")
+
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="totals-buyer", password="testpswd")
+        cls.first = Product.objects.create(name="First", price=100, discount=10, created_by=cls.user)
+        cls.second = Product.objects.create(name="Second", price=50, created_by=cls.user)
+
+    def setUp(self) -> None:
+        self.order = Order.objects.create(user=self.user, delivery_address="Totals street")
+
+    def assertTotals(self, items_count, subtotal, discounted_total, order=None):
+        stored = Order.objects.values_list("items_count", "subtotal", "discounted_total").get(pk=(order or self.order).pk)
+        self.assertEqual(stored, (items_count, Decimal(subtotal), Decimal(discounted_total)))
+
+    def test_products_changed_in_both_directions(self):
+        self.order.products.add(self.first, self.second)
+        self.assertTotals(2, "150", "140.00")
+        self.assertEqual((self.order.items_count, self.order.discounted_total), (2, Decimal("140")))
+        self.order.products.remove(self.second)
+        self.assertTotals(1, "100", "90.00")
+        self.second.orders.add(self.order)
+        self.assertTotals(2, "150", "140.00")
+        self.first.orders.clear()
+        self.assertTotals(1, "50", "50.00")
+        self.order.products.clear()
+        self.assertTotals(0, "0", "0.00")
+
+    def test_price_and_discount_changes(self):
+        self.order.products.set([self.first, self.second])
+        stale = Order.objects.get(pk=self.order.pk)
+        before = stale.updated_at
+        self.first.discount = 50
+        self.first.save()
+        self.assertTotals(2, "150", "100.00")
+        self.second.price = 75
+        self.second.save(update_fields=["price"])
+        self.assertTotals(2, "175", "125.00")
+        self.assertGreater(Order.objects.get(pk=self.order.pk).updated_at, before)
+        # экземпляр, загруженный до изменений, не возвращает старые итоги
+        stale.delivery_address = "New street"
+        with CaptureQueriesContext(connection) as queries:
+            stale.save()
+        self.assertTotals(2, "175", "125.00")
+        self.assertEqual(Order.objects.get(pk=self.order.pk).delivery_address, "New street")
+        # итоги не пересчитываются после каждого save(), их просто нет в UPDATE
+        self.assertFalse([query for query in queries if "subtotal" in query["sql"]])
+        stale.subtotal = 1
+        stale.save(update_fields=["subtotal"])
+        self.assertTotals(2, "175", "125.00")
+        self.second.delete()
+        self.assertTotals(1, "100", "50.00")
+
+    def test_bulk_paths_and_recompute_command(self):
+        self.order.products.add(self.first)
+        save_products_bulk([{"pk": self.first.pk, "discount": 0}], created_by=self.user)
+        self.assertTotals(1, "100", "100.00")
+        Product.objects.filter(pk=self.first.pk).update(price=120)
+        self.assertTotals(1, "100", "100.00")
+        out = StringIO()
+        call_command("recompute_order_totals", stdout=out)
+        self.assertIn("1 of 1 orders changed", out.getvalue())
+        self.assertTotals(1, "120", "120.00")
+
+    def test_orders_list_reads_stored_totals(self):
+        self.order.products.set([self.first, self.second])
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:orders_list"), HTTP_USER_AGENT="Test")
+        self.assertContains(response, "Total: 150 rub., with discounts 140.00 rub.")
+        self.assertFalse([query for query in queries if "shopapp_product" in query["sql"]])
+
+
+class LiveProductsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="live-owner", password="testpswd")
+        cls.live = Product.objects.create(name="Live product", created_by=cls.user)
+        cls.archived = Product.objects.create(name="Archived product", archived=True, created_by=cls.user)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_managers(self):
+        self.assertEqual(list(Product.live.all()), [self.live])
+        # архивные товары остаются в заказах, админке и API
+        self.assertIs(Product._default_manager, Product.objects)
+        self.assertEqual(Product.objects.count(), 2)
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.archived)
+        self.assertEqual(list(order.products.all()), [self.archived])
+
+    def test_storefront_uses_partial_indexes(self):
+        plans = [
+            ("product_live_name_price_idx", ProductsListView.queryset),
+            ("product_live_created_at_idx", LatestProductsFeed().items()),
+            ("product_live_created_at_idx", ShopSitemap().items()),
+        ]
+        for index, queryset in plans:
+            self.assertIn(f"USING INDEX {index}", queryset.explain())
+
+    def test_storefront_hides_archived(self):
+        self.client.force_login(self.user)
+        for url in (reverse("shopapp:products_list"), reverse("shopapp:products-feed"),
+                    reverse("django.contrib.sitemaps.views.sitemap")):
+            response = self.client.get(url, HTTP_USER_AGENT="Test")
+            self.assertContains(response, self.live.get_absolute_url())
+            self.assertNotContains(response, self.archived.get_absolute_url())
+
+    def test_soft_delete_leaves_live_products(self):
+        self.client.force_login(User.objects.create_superuser(username="live-admin", password="testpswd"))
+        self.client.post(reverse("shopapp:product_delete", kwargs={"pk": self.live.pk}), HTTP_USER_AGENT="Test")
+        self.assertFalse(Product.live.exists())
+        self.assertTrue(Product.objects.filter(pk=self.live.pk, archived=True).exists())
+
+
+class ReplicaRoutingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="replica-user")
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_reads_go_to_replica_only_when_asked_and_synced(self):
+        self.assertEqual(Product.objects.all().db, "default")
+        with reading_replica():
+            self.assertEqual(Product.objects.all().db, "default")
+        mark_synced(time())
+        with reading_replica():
+            self.assertEqual(Product.objects.all().db, REPLICA)
+        self.assertEqual(Product.objects.all().db, "default")
+
+    def test_lag_guard(self):
+        mark_synced(time())
+        with reading_replica(max_lag=0):
+            self.assertEqual(Product.objects.all().db, REPLICA)
+        mark_written()
+        # синхронизация началась за минуту до последней записи
+        mark_synced(time() - 60)
+        with reading_replica(max_lag=0):
+            self.assertEqual(Product.objects.all().db, "default")
+        with reading_replica(max_lag=30):
+            self.assertEqual(Product.objects.all().db, "default")
+        with reading_replica(max_lag=120):
+            self.assertEqual(Product.objects.all().db, REPLICA)
+
+    def test_write_keeps_request_on_primary(self):
+        mark_synced(time())
+        with reading_replica() as state:
+            self.assertEqual(Product.objects.all().db, REPLICA)
+            Product.objects.create(name="Written", created_by=self.user)
+            self.assertTrue(state.wrote)
+            self.assertEqual(Product.objects.all().db, "default")
+        self.assertGreaterEqual(cache.get(WRITTEN_KEY), cache.get("replica:synced_at"))
+
+    def test_sessions_and_users_read_from_primary(self):
+        mark_synced(time())
+        with reading_replica():
+            self.assertEqual(User.objects.all().db, "default")
+            self.assertEqual(Session.objects.all().db, "default")
+            self.assertEqual(Product.objects.all().db, REPLICA)
+
+    def test_background_writer_marked_once(self):
+        with tracking_writes():
+            Product.objects.create(name="Written", created_by=self.user)
+            mark_synced(time())
+            with patch("mysite.replica.cache.set") as cache_set:
+                Product.objects.create(name="Written again", created_by=self.user)
+            cache_set.assert_not_called()
+            # синхронизация посреди задачи не делает реплику догнавшей
+            with reading_replica(max_lag=0):
+                self.assertEqual(Product.objects.all().db, "default")
+        mark_synced(time())
+        with reading_replica(max_lag=0):
+            self.assertEqual(Product.objects.all().db, REPLICA)
+
+    def test_write_outside_request_marked_after_commit(self):
+        cache.delete(WRITTEN_KEY)
+        Product.objects.create(name="Written", created_by=self.user)
+        Product.objects.filter(name="Written").update(price=1)
+        # синхронизация до коммита не должна счесть реплику догнавшей
+        self.assertIsNone(cache.get(WRITTEN_KEY))
+        marks = [func for _, func, _ in connection.run_on_commit if func is mark_written]
+        self.assertEqual(len(marks), 1)
+        with patch.object(connection, "in_atomic_block", False):
+            Product.objects.filter(name="Written").update(price=2)
+        self.assertIsNotNone(cache.get(WRITTEN_KEY))
+
+    def test_sticky_window_covers_max_lag(self):
+        self.assertGreaterEqual(settings.REPLICA_STICKY_SECONDS, settings.REPLICA_MAX_LAG)
+        with override_settings(REPLICA_STICKY_SECONDS=5, REPLICA_MAX_LAG=30):
+            with self.assertRaises(ImproperlyConfigured):
+                ReplicaMiddleware(lambda request: HttpResponse())
+
+    def test_middleware_sticky_after_write(self):
+        factory = RequestFactory()
+        seen = {}
+
+        def write(request):
+            Product.objects.create(name="Written", created_by=self.user)
+            return HttpResponse()
+
+        def read(request):
+            seen["pinned"] = routing.get().pinned
+            return HttpResponse()
+
+        response = ReplicaMiddleware(write)(factory.get("/"))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[STICKY_COOKIE]["max-age"], settings.REPLICA_STICKY_SECONDS)
+        self.assertIsNotNone(cache.get(WRITTEN_KEY))
+
+        request = factory.get("/")
+        request.COOKIES[STICKY_COOKIE] = response.cookies[STICKY_COOKIE].value
+        ReplicaMiddleware(read)(request)
+        self.assertTrue(seen["pinned"])
+        request.COOKIES[STICKY_COOKIE] = str(time() - 1)
+        self.assertNotIn(STICKY_COOKIE, ReplicaMiddleware(read)(request).cookies)
+        self.assertFalse(seen["pinned"])
+        ReplicaMiddleware(read)(factory.post("/"))
+        self.assertTrue(seen["pinned"])
+        self.assertIsNone(routing.get())
+
+
+
+class SyncReplicaTestCase(TransactionTestCase):
+    # резервная копия снимается с соединения вне транзакции, как в команде
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_sync_replica_copies_database(self):
+        Product.objects.create(name="Copied", created_by=User.objects.create_user(username="replica-user"))
+        with TemporaryDirectory() as directory:
+            target = f"{directory}/replica.sqlite3"
+            out = StringIO()
+            call_command("sync_replica", target=target, stdout=out)
+            with closing(sqlite3.connect(target)) as replica:
+                names = [row[0] for row in replica.execute("SELECT name FROM shopapp_product")]
+        self.assertEqual(names, ["Copied"])
+        self.assertIn("Done", out.getvalue())
+
+
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != "requestdataapp.middlewares.ThrottlingMiddleware"])
+class ReplicaViewsTestCase(TestCase):
+    databases = {"default", REPLICA}
+
+    def setUp(self) -> None:
+        mark_synced(time())
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def assertReadsReplica(self, url, expected=True):
+        with CaptureQueriesContext(connections[REPLICA]) as replica, \
+                CaptureQueriesContext(connections["default"]) as default:
+            response = self.client.get(url, HTTP_USER_AGENT="Test")
+            if response.streaming:
+                response.getvalue()
+        self.assertEqual(response.status_code, 200)
+        if expected:
+            self.assertTrue(replica.captured_queries)
+            self.assertFalse(default.captured_queries)
+        else:
+            self.assertFalse(replica.captured_queries)
+
+    def test_heavy_read_views(self):
+        self.assertReadsReplica(reverse("shopapp:products-export"))
+        self.assertReadsReplica(reverse("shopapp:product-list"))
+        self.assertReadsReplica(reverse("shopapp:product-download-json"))
+        self.assertReadsReplica(reverse("shopapp:products-feed"))
+        self.assertReadsReplica(reverse("blogapp:articles-feed"))
+        self.assertReadsReplica(reverse("django.contrib.sitemaps.views.sitemap"))
+        self.assertReadsReplica(reverse("shopapp:order-list"), expected=False)
+
+    def test_cached_views_wait_for_replica(self):
+        mark_written()
+        # список товаров и полная выгрузка кэшируются по поколению, отставшая реплика им не годится
+        self.assertReadsReplica(reverse("shopapp:product-list"), expected=False)
+        self.assertReadsReplica(reverse("shopapp:products-export"), expected=False)
+        self.assertReadsReplica(reverse("shopapp:product-download-json"))
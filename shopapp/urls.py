@@ -1,5 +1,6 @@
 from django.urls import path, include
 from django.views.decorators.cache import cache_page
+from mysite.replica import replica_reads
 from rest_framework.routers import DefaultRouter
 from .views import (ShopIndex,
                     GroupsList,
@@ -19,7 +20,11 @@ from .views import (ShopIndex,
                     OrderDeleteView,
                     OrdersExportView,
                     UserOrdersListView,
-                    UserOrdersExportView)
+                    UserOrdersExportView,
+                    CacheStatsView,
+                    DailySalesViewSet,
+                    ProductSalesViewSet,
+                    UserSalesViewSet)
 
 app_name = "shopapp"
 
@@ -27,6 +32,9 @@ routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("orders", OrderViewSet)
 routers.register("users", UserOrdersExportView, "orders")
+routers.register("sales/daily", DailySalesViewSet)
+routers.register("sales/products", ProductSalesViewSet)
+routers.register("sales/users", UserSalesViewSet)
 
 urlpatterns = [
     #path("", cache_page(180)(ShopIndex.as_view()), name="index"),
@@ -39,12 +47,13 @@ urlpatterns = [
     path("products/<int:pk>/archived", ProductDeleteView.as_view(), name="product_delete"),
     path("products/create/", ProductCreateView.as_view(), name="product_create"),
     path("products/export", ProductsDataExportView.as_view(), name="products-export"),
-    path("products/latest/feed/", LatestProductsFeed(), name="products-feed"),
+    path("products/latest/feed/", replica_reads(LatestProductsFeed()), name="products-feed"),
     path("orders/", OrdersListView.as_view(), name="orders_list"),
     path("orders/<int:pk>/", OrderDetailsView.as_view(), name="order_details"),
     path("orders/create/", OrderCreateView.as_view(), name="order_create"),
     path("orders/<int:pk>/update", OrderUpdateView.as_view(), name="order_update"),
     path("orders/<int:pk>/delete", OrderDeleteView.as_view(), name="order_delete"),
     path("orders/export", OrdersExportView.as_view(), name="orders-export"),
-    path("users/<int:user_id>/orders/", UserOrdersListView.as_view(), name="user_orders")
+    path("users/<int:user_id>/orders/", UserOrdersListView.as_view(), name="user_orders"),
+    path("cache-stats/", CacheStatsView.as_view(), name="cache-stats")
 ]
\ No newline at end of file
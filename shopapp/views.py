@@ -7,29 +7,41 @@ import logging
 import json
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Count, Sum
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
-from django.http import HttpResponse, HttpResponseRedirect, HttpRequest, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, HttpRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
-from django.core.cache import cache
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 from django.views.generic import View, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.utils.translation import gettext_lazy as _, ngettext
 from drf_spectacular.utils import extend_schema, OpenApiResponse
-from .models import Product, Order, ProductImage
+from .models import DailySales, Order, Product, ProductImage, ProductSales, UserSales
 from .forms import ProductForm, OrderForm, GroupForm
-from .serializers import ProductSerializer, OrderSerializer
-from .common import save_csv_products
+from .serializers import (DailySalesSerializer, DailySalesTotalsSerializer, OrderSerializer, ProductSalesSerializer,
+                          ProductSearchSerializer, ProductSerializer, UserSalesSerializer)
+from .caching import (PRODUCTS, ORDERS, cached_json_response, get_cache_stats, hashed_key,
+                      products_export_response, versioned_key)
+from .common import PRODUCTS_BULK_MAX_ITEMS, save_csv_products, save_products_bulk, OrdersExport
+from .delta import InvalidCursor, ProductsDelta, table_version
+from .conditional import (order_details_etag, product_details_etag, product_last_modified, products_feed_etag,
+                          updated_at)
+from .mixins import (CACHED_ENDPOINTS, CachedListMixin, CompressedExportMixin, ConditionalGetMixin, FastListMixin,
+                     QueryPlanMixin, ReplicaReadMixin, SparseFieldsMixin, StreamingJSONMixin)
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter, search_highlights
+from .streaming import StreamingJSONResponse, streaming_csv_response, streaming_json_response, compressed_export
 from django.contrib.auth.models import User, Group
 from django.contrib.syndication.views import Feed
+from mysite.replica import replica_reads
 from timeit import default_timer
-from csv import DictWriter
 
 
 #log = logging.getLogger(__name__)
@@ -41,7 +53,7 @@ class LatestProductsFeed(Feed):
     link = reverse_lazy("shopapp:products_list")
 
     def items(self):
-        return Product.objects.filter(created_at__isnull=False).order_by("-created_at")[:5]
+        return Product.live.order_by("-created_at")[:5]
 
     def item_title(self, item: Product):
         return item.name
@@ -52,17 +64,27 @@ class LatestProductsFeed(Feed):
     def item_link(self, item: Product):
         return item.get_absolute_url()
 
+    def __call__(self, request, *args, **kwargs):
+        return condition(etag_func=products_feed_etag)(super().__call__)(request, *args, **kwargs)
+
 
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedListMixin, CompressedExportMixin,
+                     StreamingJSONMixin, SparseFieldsMixin, FastListMixin, QueryPlanMixin, ModelViewSet):
     """
     Набор представлений для действий над Product
     Полный CRUD для сущностей товара
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+    compressed_actions = ("download_csv", "download_json")
+    # список кэшируется по поколению PRODUCTS, выгрузки -- нет
+    replica_actions = {"list": 0, "download_csv": None, "download_json": None}
+    cache_tag = PRODUCTS
+    cache_endpoint = "products-list"
     filter_backends = [
-        SearchFilter,
+        FullTextSearchFilter,
         OrderingFilter
     ]
     search_fields = ["name", "description"]
@@ -90,42 +112,101 @@ class ProductViewSet(ModelViewSet):
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
-    @method_decorator(cache_page(120))
-    def list(self, *args, **kwargs):
-        return super().list(*args, **kwargs)
+    def get_list_validators(self, request):
+        return self.get_list_cache_key(request), None
+
+    def get_object_validators(self, request):
+        modified = updated_at(Product, self.kwargs[self.lookup_field])
+        if modified is None:
+            return None, None
+        etag = hashed_key(
+            self.kwargs[self.lookup_field], modified.timestamp(), request.accepted_renderer.format,
+            self.get_query_list(self.fields_query_param), self.get_query_list(self.expand_query_param)
+        )
+        return etag, modified
+
+    def get_serializer_class(self):
+        if self.action == "list" and self.request is not None and \
+                FullTextSearchFilter().uses_full_text(self.request, self.queryset):
+            return self.get_sparse_serializer_class(ProductSearchSerializer)
+        return super().get_serializer_class()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # заполняется после пагинации, сериализатор к этому времени уже создан
+        self.search_highlights = {}
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["search_highlights"] = getattr(self, "search_highlights", {})
+        return context
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        search = FullTextSearchFilter()
+        if page and search.uses_full_text(self.request, queryset):
+            pks = [row["pk"] if isinstance(row, dict) else row.pk for row in page]
+            self.search_highlights.update(search_highlights(search.get_search_terms(self.request), pks, queryset.db))
+        return page
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
         queryset = self.filter_queryset(self.get_queryset())
+        # sku -- ключ, по которому upload_csv обновляет товар, а не создаёт копию
         fields = [
+            "sku",
             "name",
             "description",
             "price",
             "discount"
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-        for product in queryset:
-            writer.writerow({field: getattr(product, field) for field in fields})
-        return response
+        return streaming_csv_response(queryset, fields, filename="products-export.csv")
+
+    @action(methods=["get"], detail=False)
+    def download_json(self, request: Request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.streaming_response(queryset, filename="products-export.json")
 
     @action(methods=["post"], detail=False, parser_classes=[MultiPartParser])
     def upload_csv(self, request: Request):
-        products = save_csv_products(
+        if not request.user.is_authenticated:
+            # товару нужен created_by
+            return Response({"non_field_errors": ["Log in to upload products."]}, status=400)
+        if "file" not in request.FILES:
+            return Response({"file": ["No file was submitted."]}, status=400)
+        report = save_csv_products(
             request.FILES["file"].file,
+            created_by=request.user,
             encoding="UTF-8"
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
-
+        return Response({
+            "imported": report.imported,
+            "errors": [{"line": line, "message": message} for line, message in report.errors]
+        })
 
-class OrderViewSet(ModelViewSet):
+    @extend_schema(
+        summary="Create, update and archive products in one request",
+        description="Body is a list of items: without **pk** a product is created, with **pk** "
+                    "the given fields are updated (`{\"pk\": 1, \"archived\": true}` archives). "
+                    "Nothing is saved if any item is invalid.",
+    )
+    @action(methods=["post"], detail=False, permission_classes=[IsAdminUser])
+    def bulk(self, request: Request):
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"detail": "Expected a list of items."}, status=400)
+        if len(items) > PRODUCTS_BULK_MAX_ITEMS:
+            return Response({"detail": f"At most {PRODUCTS_BULK_MAX_ITEMS} items per request."}, status=400)
+        results, errors = save_products_bulk(items, created_by=request.user)
+        if errors:
+            return Response({"errors": errors}, status=400)
+        return Response({"results": results})
+
+
+class OrderViewSet(SparseFieldsMixin, FastListMixin, QueryPlanMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter
@@ -181,6 +262,7 @@ class GroupsList(View):
         return redirect(request.path)
 
 
+@method_decorator(condition(etag_func=product_details_etag, last_modified_func=product_last_modified), name="get")
 class ProductDetailsView(DetailView):
     template_name = "shopapp/products-details.html"
     #model = Product
@@ -191,7 +273,7 @@ class ProductDetailsView(DetailView):
 class ProductsListView(LoginRequiredMixin, ListView):
     login_url = reverse_lazy("myauth:login")
     template_name = "shopapp/products-list.html"
-    queryset = Product.objects.filter(archived=False)
+    queryset = Product.live.all()
     context_object_name = "products"
 
 
@@ -251,23 +333,39 @@ class ProductDeleteView(DeleteView):
         return HttpResponseRedirect(success_url)
 
 
+def products_export_etag(request: HttpRequest, *args, **kwargs) -> str:
+    return f"{table_version(Product.objects.all())}-{request.GET.get('since', '')}"
+
+
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
-        if products_data is None:
-            products = Product.objects.order_by("pk").all()
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "price": product.price,
-                    "archived": product.archived
-                }
-                for product in products
-            ]
-            cache.set(cache_key, products_data, 300)
-        return JsonResponse({"products": products_data})
+    """
+    Выгрузка товаров для синхронизации.
+
+    С параметром since отдаются только товары, изменённые после курсора:
+    живые -- в products, архивные -- номерами в archived. В ответе всегда
+    есть next_cursor для следующего опроса.
+    """
+    # полная выгрузка кэшируется по поколению PRODUCTS
+    @method_decorator(replica_reads(max_lag=0))
+    @method_decorator(compressed_export)
+    @method_decorator(condition(etag_func=products_export_etag))
+    def get(self, request: HttpRequest) -> HttpResponse:
+        since = request.GET.get("since")
+        if since is not None:
+            try:
+                return self.get_delta(since)
+            except InvalidCursor as error:
+                return JsonResponse({"error": str(error)}, status=400)
+        return products_export_response()
+
+    def get_delta(self, since: str) -> StreamingJSONResponse:
+        delta = ProductsDelta(Product.objects.all(), since)
+        return StreamingJSONResponse({
+            "products": iter(delta),
+            "archived": lambda: delta.archived,
+            "next_cursor": lambda: delta.next_cursor,
+            "has_more": lambda: delta.has_more
+        })
 
 
 # class ProductsListView(TemplateView):
@@ -301,9 +399,11 @@ class ProductsDataExportView(View):
 
 
 class OrdersListView(LoginRequiredMixin, ListView):
-    queryset = (Order.objects.select_related("user").prefetch_related("products"))
+    # итоги заказа хранятся в нём самом, товары для списка не нужны
+    queryset = Order.objects.select_related("user")
 
 
+@method_decorator(condition(etag_func=order_details_etag), name="get")
 class OrderDetailsView(PermissionRequiredMixin, DetailView):
     permission_required = "shopapp.view_order"
     queryset = (Order.objects.select_related("user").prefetch_related("products"))
@@ -361,23 +461,84 @@ class OrderDeleteView(DeleteView):
 #     return render(request, "shopapp/create-order.html", context=context)
 
 class OrdersExportView(UserPassesTestMixin, View):
+    """
+    Выгрузка заказов для синхронизации: {"orders": [...], "next_cursor": ...},
+    с format=ndjson -- по заказу на строку. С курсором since отдаются
+    только изменённые заказы; в NDJSON курсор приходит последней строкой
+    {"type": "trailer", "next_cursor": ...}.
+    """
     def test_func(self):
         if self.request.user.is_staff:
             return True
 
+    @method_decorator(replica_reads)
+    @method_decorator(compressed_export)
+    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        since = request.GET.get("since")
+        try:
+            orders = OrdersExport(since=since)
+        except InvalidCursor as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        ndjson = request.GET.get("format") == "ndjson"
+        return streaming_json_response(
+            "orders",
+            orders,
+            ndjson=ndjson,
+            trailer=None if ndjson and not since else lambda: {"next_cursor": orders.next_cursor}
+        )
+
+
+class CacheStatsView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
     def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("pk").all()
-        orders_data = [
-            {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user_id": order.user.pk,
-                "products_id": sorted([p.pk for p in order.products.all()])
-            }
-            for order in orders
-        ]
-        return JsonResponse({"orders": orders_data})
+        return JsonResponse({endpoint: get_cache_stats(endpoint) for endpoint in sorted(CACHED_ENDPOINTS)})
+
+
+@extend_schema(description="Revenue per day from the sales summary")
+class DailySalesViewSet(FastListMixin, QueryPlanMixin, ReadOnlyModelViewSet):
+    """
+    Выручка по дням из сводки продаж (см. shopapp.reports)
+    """
+    queryset = DailySales.objects.all()
+    serializer_class = DailySalesSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+    lookup_field = "date"
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {"date": ["gte", "lte"]}
+
+    @extend_schema(summary="Totals over the filtered days")
+    @action(methods=["get"], detail=False)
+    def totals(self, request: Request):
+        totals = self.filter_queryset(self.get_queryset()).aggregate(
+            days=Count("pk"),
+            orders_count=Sum("orders_count", default=0),
+            units=Sum("units", default=0),
+            revenue=Sum("revenue", default=0)
+        )
+        return Response(DailySalesTotalsSerializer(totals).data)
+
+
+@extend_schema(description="Units and revenue per product from the sales summary")
+class ProductSalesViewSet(FastListMixin, QueryPlanMixin, ReadOnlyModelViewSet):
+    queryset = ProductSales.objects.all()
+    serializer_class = ProductSalesSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["units", "revenue"]
+
+
+@extend_schema(description="Orders and revenue per customer from the sales summary")
+class UserSalesViewSet(FastListMixin, QueryPlanMixin, ReadOnlyModelViewSet):
+    queryset = UserSales.objects.all()
+    serializer_class = UserSalesSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["orders_count", "units", "revenue"]
 
 
 class UserOrdersListView(LoginRequiredMixin, ListView):
@@ -386,7 +547,7 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         self.owner = get_object_or_404(User, id=self.kwargs["user_id"])
-        queryset = Order.objects.select_related("user").prefetch_related("products").filter(user__id=self.kwargs["user_id"])
+        queryset = Order.objects.select_related("user").filter(user__id=self.kwargs["user_id"])
         return queryset
 
     def get_context_data(self, order_list=None, *args, **kwargs):
@@ -395,7 +556,8 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
         return data
 
 
-class UserOrdersExportView(LoginRequiredMixin, ModelViewSet):
+class UserOrdersExportView(LoginRequiredMixin, QueryPlanMixin, ModelViewSet):
+    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     filter_backends = [
         SearchFilter,
@@ -411,42 +573,25 @@ class UserOrdersExportView(LoginRequiredMixin, ModelViewSet):
     ordering_fields = ["id"]
 
     def get_queryset(self):
-        queryset = Order\
-            .objects.select_related("user")\
-            .prefetch_related("products")\
-            .filter(user__id=self.kwargs['pk'])\
-            .order_by("pk")
-        return queryset
+        return super().get_queryset().filter(user__id=self.kwargs['pk']).order_by("pk")
 
     def get_user(self, pk):
         return get_object_or_404(User, id=pk)
 
+    def get_cache_key(self):
+        return versioned_key(ORDERS, "user", self.owner.pk, self.request.GET.urlencode())
+
+    def get_orders_data(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.serializer_class(queryset, many=True).data
+
     @action(methods=["get"], detail=True)
     def orders(self, request: Request, pk=None):
         self.owner = self.get_user(pk)
-        cache_key = f"{self.owner.username}{self.owner.email}_orders_export"
-        user_orders_data = cache.get(cache_key)
-        if user_orders_data is None:
-            queryset = self.filter_queryset(self.get_queryset())
-            serializer = self.serializer_class(queryset, many=True)
-            user_orders_data = serializer.data
-            cache.set(cache_key, user_orders_data, 300)
-        return Response(user_orders_data)
+        return cached_json_response(request, self.get_cache_key(), self.get_orders_data)
 
     @action(methods=["get"], detail=True)
     def order_export(self, request: Request, pk=None):
         self.owner = self.get_user(pk)
         filename = f"{self.owner.username} orders export.json"
-        cache_key = f"{self.owner.username}{self.owner.email}_orders_export"
-        user_orders_data = cache.get(cache_key)
-        if user_orders_data is None:
-            queryset = self.filter_queryset(self.get_queryset())
-            serializer = self.serializer_class(queryset, many=True)
-            user_orders_data = serializer.data
-            cache.set(cache_key, user_orders_data, 300)
-        return HttpResponse(
-            content=user_orders_data,
-            content_type="application/force-download",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-
+        return cached_json_response(request, self.get_cache_key(), self.get_orders_data, filename=filename)